@@ -0,0 +1 @@
+# Loopback benchmark suite for the IMU transports, run with python -m benchmark
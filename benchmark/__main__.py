@@ -0,0 +1,26 @@
+import argparse
+from .client import MODES
+from .runner import run_sweep, write_results
+from .plots import plot_results
+
+DEFAULT_MODES = ('tcp', 'single', 'multi', 'no_priority', 'no_priority_v2')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the TCP and QUIC IMU transports over loopback")
+    parser.add_argument('--modes', type=str, nargs='+', default=list(DEFAULT_MODES), choices=MODES, help='Client modes to run')
+    parser.add_argument('--rates', type=float, nargs='+', default=[500, 2000, 8000], help='IMU readings per second to sweep')
+    parser.add_argument('--batch-bytes', type=int, nargs='+', default=[25, 1200], help='QUIC stream batch sizes to sweep (25 is one record)')
+    parser.add_argument('--linger-ms', type=float, nargs='+', default=[2.0], help='QUIC batch linger times to sweep')
+    parser.add_argument('--duration', type=float, default=5.0, help='Seconds of samples per run')
+    parser.add_argument('--port', type=int, default=5555, help='TCP server port')
+    parser.add_argument('--bulk-parse', action='store_true', help='Use the vectorized source parser in the clients')
+    parser.add_argument('--out', type=str, default='bench_results', help='Directory for results.json, results.csv and plots')
+    parser.add_argument('--no-plots', action='store_true', help='Skip the matplotlib plots')
+    args = parser.parse_args()
+
+    results = run_sweep(args.modes, args.rates, args.batch_bytes, args.linger_ms, args.duration,
+                        port=args.port, bulk=args.bulk_parse)
+    write_results(results, args.out)
+    if results and not args.no_plots:
+        plot_results(results, args.out)
+    print(f"Wrote {len(results)} results to {args.out}")
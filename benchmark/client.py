@@ -0,0 +1,63 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+from helpers import SyntheticSource
+from helpers.rate_control import RateController
+
+QUIC_MODES = ('single', 'multi', 'no_priority', 'no_priority_v2', 'datagram')
+MODES = ('tcp',) + QUIC_MODES
+
+
+def make_client(mode, source, max_batch_bytes, max_linger, port, rate_control=None):
+    """Build the client for a benchmark mode, fed by source"""
+    if mode == 'tcp':
+        from tcp_client import TCPIMUClient
+        return TCPIMUClient('127.0.0.1', port, source=source, rate_control=rate_control)
+    from client_files import IMUClient, IMUClientSingleStream, IMUClientNoPriority, IMUClientNoPriorityV2, IMUClientDatagram
+    clients = {
+        'single': IMUClientSingleStream,
+        'multi': IMUClient,
+        'no_priority': IMUClientNoPriority,
+        'no_priority_v2': IMUClientNoPriorityV2,
+        'datagram': IMUClientDatagram,
+    }
+    return clients[mode](max_batch_bytes=max_batch_bytes, max_linger=max_linger, source=source, rate_control=rate_control)
+
+
+def run_client(client, mode):
+    if mode == 'tcp':
+        client.start()
+    else:
+        asyncio.run(client.start('localhost'))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="IMU client driven by a synthetic source for benchmark runs")
+    parser.add_argument('--mode', type=str, required=True, choices=MODES, help='Client to run')
+    parser.add_argument('--rate', type=float, default=1000, help='IMU readings per second')
+    parser.add_argument('--duration', type=float, default=5.0, help='Seconds of samples to send')
+    parser.add_argument('--batch-bytes', type=int, default=1200, help='Stream batch size for the QUIC clients')
+    parser.add_argument('--linger-ms', type=float, default=2.0, help='Max time a sample waits in a batch')
+    parser.add_argument('--bulk-parse', action='store_true', help='Parse the source in vectorized blocks')
+    parser.add_argument('--adaptive', action='store_true', help='Let the client decimate or average samples under congestion')
+    parser.add_argument('--port', type=int, default=5555, help='TCP server port')
+    parser.add_argument('--out', type=str, required=True, help='Where to write the JSON summary')
+    args = parser.parse_args()
+
+    source = SyntheticSource(rate=args.rate, duration=args.duration)
+    client = make_client(args.mode, source, args.batch_bytes, args.linger_ms / 1000, args.port,
+                         RateController() if args.adaptive else None)
+    client.imu_parser.bulk = args.bulk_parse
+    # The clients print on connect, keep that out of the measurement
+    sys.stdout = open(os.devnull, 'w')
+    wall_start = time.monotonic()
+    cpu_start = time.process_time()
+    run_client(client, args.mode)
+    ring = client.samples
+    summary = dict(client_cpu=time.process_time() - cpu_start, client_wall=time.monotonic() - wall_start,
+                   ring_dropped=ring.dropped_oldest + ring.dropped_newest)
+    with open(args.out, 'w') as f:
+        json.dump(summary, f)
@@ -0,0 +1,71 @@
+import json
+import time
+import argparse
+import numpy as np
+from helpers.codec import SampleEncoder, FORMATS, FORMAT_TEXT, SENSOR_ACCEL, SENSOR_GYRO
+from helpers.framing import StreamReassembler
+from helpers.sources import SyntheticPort
+
+WAVEFORMS = ('sine', 'noise', 'constant')
+
+
+def synthetic_rows(waveform, rate, samples, amplitude):
+    """(samples, 6) accel and gyro rows from the synthetic source's generator"""
+    port = SyntheticPort(rate, waveform, 1.0, amplitude, None)
+    return port._rows(samples).astype(np.float32)
+
+
+def measure(fmt, rows, batch):
+    """Bytes per sample, encode and decode rates and the largest decode error for one format"""
+    encoder = SampleEncoder(fmt)
+    chunks = []
+    began = time.perf_counter()
+    for start in range(0, len(rows), batch):
+        block = rows[start:start + batch]
+        chunks.append(encoder.encode_many(SENSOR_ACCEL, block[:, :3]))
+        chunks.append(encoder.encode_many(SENSOR_GYRO, block[:, 3:]))
+    encode_time = time.perf_counter() - began
+
+    reassembler = StreamReassembler(fmt)
+    began = time.perf_counter()
+    decoded = [reassembler.feed(chunk) for chunk in chunks]
+    decode_time = time.perf_counter() - began
+    records = np.concatenate(decoded)
+    accel = records[records['type'] == SENSOR_ACCEL]['axes']
+    gyro = records[records['type'] == SENSOR_GYRO]['axes']
+    error = max(np.abs(accel - rows[:, :3]).max(), np.abs(gyro - rows[:, 3:]).max())
+    samples = 2 * len(rows)
+    return dict(format=fmt, bytes_per_sample=sum(map(len, chunks)) / samples,
+                encode_per_sec=samples / encode_time, decode_per_sec=samples / decode_time, max_error=float(error))
+
+
+def run(waveform, rate, samples, amplitude, batch):
+    rows = synthetic_rows(waveform, rate, samples, amplitude)
+    results = [measure(fmt, rows, batch) for fmt in FORMATS]
+    text = next(result for result in results if result['format'] == FORMAT_TEXT)
+    for result in results:
+        result.update(waveform=waveform, batch=batch, ratio_vs_text=text['bytes_per_sample'] / result['bytes_per_sample'])
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare wire format size, speed and precision on synthetic IMU data")
+    parser.add_argument('--waveforms', type=str, nargs='+', default=list(WAVEFORMS), choices=WAVEFORMS, help='Synthetic waveforms to encode')
+    parser.add_argument('--rate', type=float, default=1000, help='IMU readings per second the data is generated at')
+    parser.add_argument('--samples', type=int, default=20000, help='IMU readings per waveform')
+    parser.add_argument('--amplitude', type=float, default=1.0, help='Waveform amplitude')
+    parser.add_argument('--batch', type=int, nargs='+', default=[1, 10, 100], help='Readings encoded per call')
+    parser.add_argument('--out', type=str, default=None, help='Also write the results as JSON')
+    args = parser.parse_args()
+
+    results = []
+    for waveform in args.waveforms:
+        for batch in args.batch:
+            for result in run(waveform, args.rate, args.samples, args.amplitude, batch):
+                results.append(result)
+                print(f"{waveform} batch {batch} {result['format']}: {result['bytes_per_sample']:.2f} bytes/sample "
+                      f"({result['ratio_vs_text']:.1f}x vs text), encode {result['encode_per_sec']:.0f}/s, "
+                      f"decode {result['decode_per_sec']:.0f}/s, max error {result['max_error']:.4f}")
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,78 @@
+import json
+import time
+import random
+import argparse
+from helpers.quic_priority import PriorityManager
+
+
+WEIGHTS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+
+def weight_error(shares, weights):
+    """
+    Largest relative difference between a stream's byte share and its weight
+    share, and the total variation distance between the two distributions
+    """
+    total = sum(weights.values())
+    relative = max(abs(shares[sid] - weight / total) / (weight / total) for sid, weight in weights.items())
+    distance = sum(abs(shares[sid] - weight / total) for sid, weight in weights.items()) / 2
+    return relative, distance
+
+
+def run_phase(manager, weights, sends, sizes, rng):
+    """Keep every stream backlogged for sends messages and return the byte share each one got"""
+    start = {sid: manager._streams[sid].bytes_sent for sid in weights}
+    for sid in weights:
+        manager.activate(sid)
+    began = time.perf_counter()
+    for _ in range(sends):
+        sid = manager.next_stream()
+        manager.update_after_send(sid, rng.choice(sizes))
+    elapsed = time.perf_counter() - began
+    sent = {sid: manager._streams[sid].bytes_sent - start[sid] for sid in weights}
+    total = sum(sent.values())
+    return {sid: b / total for sid, b in sent.items()}, sends / elapsed
+
+
+def run(streams, sends_per_stream, sizes, seed=0):
+    rng = random.Random(seed)
+    manager = PriorityManager()
+    weights = {sid: rng.choice(WEIGHTS) for sid in range(streams)}
+    for sid, weight in weights.items():
+        manager.add_stream(sid, weight)
+    sends = sends_per_stream * streams
+    shares, rate = run_phase(manager, weights, sends, sizes, rng)
+    relative, distance = weight_error(shares, weights)
+    result = dict(streams=streams, sends=sends, message_sizes=list(sizes), max_relative_error=relative,
+                  share_distance=distance, decisions_per_sec=rate)
+
+    # Reweight half of the streams and check the shares follow
+    for sid in list(weights)[:streams // 2]:
+        weights[sid] = rng.choice(WEIGHTS)
+        manager.set_weight(sid, weights[sid])
+    shares, rate = run_phase(manager, weights, sends, sizes, rng)
+    relative, distance = weight_error(shares, weights)
+    result.update(reweighted_max_relative_error=relative, reweighted_share_distance=distance,
+                  reweighted_decisions_per_sec=rate)
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Check that PriorityManager byte shares match the stream weights")
+    parser.add_argument('--streams', type=int, nargs='+', default=[2, 16, 256], help='Stream counts to test')
+    parser.add_argument('--sends', type=int, default=2000, help='Messages scheduled per stream in each phase')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[25, 100, 600, 1200], help='Message sizes drawn at random')
+    parser.add_argument('--out', type=str, default=None, help='Also write the results as JSON')
+    args = parser.parse_args()
+
+    results = []
+    for streams in args.streams:
+        result = run(streams, args.sends, args.sizes)
+        results.append(result)
+        print(f"{streams} streams: max share error {result['max_relative_error']:.2%} "
+              f"(distance {result['share_distance']:.4f}), after reweight "
+              f"{result['reweighted_max_relative_error']:.2%} (distance {result['reweighted_share_distance']:.4f}), "
+              f"{result['decisions_per_sec']:.0f} decisions/sec")
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
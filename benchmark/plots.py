@@ -0,0 +1,49 @@
+import os
+from collections import defaultdict
+
+PLOTS = (
+    ('throughput', 'Throughput (samples/s)'),
+    ('latency_p50_ms', 'p50 latency (ms)'),
+    ('latency_p99_ms', 'p99 latency (ms)'),
+    ('latency_p999_ms', 'p99.9 latency (ms)'),
+    ('client_cpu_us_per_sample', 'Client CPU per sample (us)'),
+    ('server_cpu_us_per_sample', 'Server CPU per sample (us)'),
+)
+
+
+def series_label(result):
+    if result['mode'] == 'tcp':
+        return 'tcp'
+    return f"{result['mode']} {result['batch_bytes']}B/{result['linger_ms']:g}ms"
+
+
+def plot_results(results, out_dir):
+    """Plot every metric against sample rate, one line per mode and batching setting"""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    series = defaultdict(list)
+    for result in results:
+        series[series_label(result)].append(result)
+
+    paths = []
+    for metric, title in PLOTS:
+        fig, ax = plt.subplots(figsize=(8, 5))
+        for label, points in sorted(series.items()):
+            points = sorted((p for p in points if metric in p), key=lambda p: p['rate'])
+            if points:
+                ax.plot([p['rate'] for p in points], [p[metric] for p in points], marker='o', label=label)
+        ax.set_xlabel('IMU readings per second')
+        ax.set_ylabel(title)
+        ax.set_xscale('log')
+        if metric.startswith('latency'):
+            ax.set_yscale('log')
+        ax.grid(True, which='both', alpha=0.3)
+        ax.legend(fontsize='small')
+        fig.tight_layout()
+        path = os.path.join(out_dir, f"{metric}.png")
+        fig.savefig(path)
+        plt.close(fig)
+        paths.append(path)
+    return paths
@@ -0,0 +1,118 @@
+import os
+import sys
+import csv
+import json
+import time
+import signal
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Extra time a client gets on top of its sample duration before it is killed
+CLIENT_GRACE = 30.0
+# Time the server gets after the client exits before it is stopped
+SETTLE = 1.0
+SERVER_STOP_TIMEOUT = 15.0
+
+FIELDS = ('mode', 'rate', 'batch_bytes', 'linger_ms', 'duration', 'offered', 'received', 'delivered',
+          'throughput', 'ring_dropped', 'client_cpu_us_per_sample', 'server_cpu_us_per_sample',
+          'latency_p50_ms', 'latency_p99_ms', 'latency_p999_ms', 'latency_max_ms',
+          'client_cpu', 'server_cpu', 'client_wall', 'receive_span')
+
+
+def start_server(transport, port, out):
+    """Start an instrumented server and wait until it accepts connections"""
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'benchmark.server', '--transport', transport, '--port', str(port), '--out', out],
+        cwd=ROOT, stdout=subprocess.PIPE, text=True,
+    )
+    line = server.stdout.readline().strip()
+    if line != 'READY':
+        server.kill()
+        server.wait()
+        raise RuntimeError(f"{transport} server failed to start")
+    return server
+
+
+def stop_server(server):
+    server.send_signal(signal.SIGINT)
+    try:
+        server.wait(timeout=SERVER_STOP_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        server.kill()
+        server.wait()
+        raise RuntimeError("server did not shut down")
+    finally:
+        server.stdout.close()
+
+
+def run_case(mode, rate, duration, batch_bytes, linger_ms, port=5555, bulk=False):
+    """Run one client against a fresh server and return the merged measurements"""
+    with tempfile.TemporaryDirectory() as tmp:
+        server_out = os.path.join(tmp, 'server.json')
+        client_out = os.path.join(tmp, 'client.json')
+        server = start_server('tcp' if mode == 'tcp' else 'quic', port, server_out)
+        try:
+            command = [sys.executable, '-m', 'benchmark.client', '--mode', mode, '--rate', str(rate),
+                       '--duration', str(duration), '--batch-bytes', str(batch_bytes),
+                       '--linger-ms', str(linger_ms), '--port', str(port), '--out', client_out]
+            if bulk:
+                command.append('--bulk-parse')
+            subprocess.run(command, cwd=ROOT, check=True, timeout=duration + CLIENT_GRACE)
+            time.sleep(SETTLE)
+        finally:
+            stop_server(server)
+        with open(server_out) as f:
+            result = json.load(f)
+        with open(client_out) as f:
+            result.update(json.load(f))
+
+    # Every IMU reading becomes one accel and one gyro sample
+    offered = int(rate * duration) * 2
+    received = result['received']
+    result.update(mode=mode, rate=rate, batch_bytes=batch_bytes, linger_ms=linger_ms, duration=duration,
+                  offered=offered, delivered=received / offered if offered else 0.0)
+    result['throughput'] = received / result['receive_span'] if result['receive_span'] else 0.0
+    if received:
+        result['client_cpu_us_per_sample'] = result['client_cpu'] / received * 1e6
+        result['server_cpu_us_per_sample'] = result['server_cpu'] / received * 1e6
+    return result
+
+
+def cases(modes, rates, batch_bytes, linger_ms):
+    """Every (mode, rate, batch_bytes, linger_ms) combination to run"""
+    for mode in modes:
+        for rate in rates:
+            if mode == 'tcp':
+                # The TCP client sends whatever is queued, it has no batching knobs to sweep
+                yield mode, rate, 0, 0.0
+                continue
+            for size in batch_bytes:
+                for linger in linger_ms:
+                    yield mode, rate, size, linger
+
+
+def run_sweep(modes, rates, batch_bytes, linger_ms, duration, port=5555, bulk=False, log=print):
+    results = []
+    for mode, rate, size, linger in cases(modes, rates, batch_bytes, linger_ms):
+        log(f"{mode}: rate={rate:g}/s batch_bytes={size} linger_ms={linger:g}")
+        try:
+            result = run_case(mode, rate, duration, size, linger, port=port, bulk=bulk)
+        except (RuntimeError, OSError, subprocess.SubprocessError) as e:
+            log(f"  failed: {e}")
+            continue
+        log(f"  throughput={result['throughput']:.0f}/s delivered={result['delivered']:.1%} "
+            f"p50={result.get('latency_p50_ms', float('nan')):.2f}ms p99={result.get('latency_p99_ms', float('nan')):.2f}ms")
+        results.append(result)
+    return results
+
+
+def write_results(results, out_dir):
+    """Write results.json and results.csv to out_dir"""
+    os.makedirs(out_dir, exist_ok=True)
+    with open(os.path.join(out_dir, 'results.json'), 'w') as f:
+        json.dump(results, f, indent=2)
+    with open(os.path.join(out_dir, 'results.csv'), 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDS, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(results)
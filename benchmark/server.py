@@ -0,0 +1,126 @@
+import os
+import sys
+import json
+import time
+import signal
+import asyncio
+import argparse
+import numpy as np
+from helpers.sinks import add_sink_arguments, sink_options, pipeline_from_options
+
+READY = 'READY'
+# How long the TCP server may take to process what is still queued when stopped
+DRAIN_TIMEOUT = 5.0
+
+
+class ReceiveStats:
+    """Counts received records and their latency from the sender's timestamp"""
+    def __init__(self):
+        self.received = 0
+        self.first = None
+        self.last = None
+        self.latencies = []
+        self.cpu_start = None
+
+    def start(self):
+        self.cpu_start = time.process_time()
+
+    def observe(self, records):
+        now = time.time()
+        if self.first is None:
+            self.first = now
+        self.last = now
+        self.received += len(records)
+        # Text records carry no timestamp
+        ts = records['ts']
+        ts = ts[ts > 0]
+        if len(ts):
+            self.latencies.append(now - ts)
+
+    def summary(self):
+        cpu = time.process_time() - (self.cpu_start or 0.0)
+        span = (self.last - self.first) if self.received else 0.0
+        result = dict(received=self.received, receive_span=span, server_cpu=cpu)
+        if self.latencies:
+            latencies = np.concatenate(self.latencies) * 1000
+            p50, p99, p999 = np.percentile(latencies, [50, 99, 99.9])
+            result.update(latency_p50_ms=float(p50), latency_p99_ms=float(p99),
+                          latency_p999_ms=float(p999), latency_max_ms=float(latencies.max()))
+        return result
+
+
+def announce_ready(stats):
+    """Tell the runner the server is accepting connections, then silence the stdout sink"""
+    stats.start()
+    sys.stdout.write(READY + '\n')
+    sys.stdout.flush()
+    sys.stdout = open(os.devnull, 'w')
+
+
+def run_quic(stats, options):
+    import quic_server
+
+    class BenchProtocol(quic_server.HttpServerProtocol):
+        async def process_records(self, records):
+            stats.observe(records)
+            await super().process_records(records)
+
+    async def serve():
+        ready = asyncio.Event()
+
+        async def wait_ready():
+            await ready.wait()
+            announce_ready(stats)
+
+        watcher = asyncio.create_task(wait_ready())
+        # main() stops on SIGINT/SIGTERM once every connection has been shut down
+        await quic_server.main('localhost', protocol_class=BenchProtocol, ready=ready, **options)
+        watcher.cancel()
+
+    asyncio.run(serve())
+
+
+def run_tcp(stats, port, options):
+    import tcp_server
+
+    class BenchTCPServer(tcp_server.TCPIMUServer):
+        async def process_records(self, records, device=None):
+            stats.observe(records)
+            await super().process_records(records, device)
+
+        async def run(self):
+            stop = asyncio.Event()
+            loop = asyncio.get_running_loop()
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                loop.add_signal_handler(signum, stop.set)
+            self.server = await asyncio.start_server(self.handle_client, self.host, self.port)
+            processor = asyncio.create_task(self.process_messages())
+            announce_ready(stats)
+            await stop.wait()
+            self.server.close()
+            try:
+                await asyncio.wait_for(self.message_queue.join(), DRAIN_TIMEOUT)
+            except asyncio.TimeoutError:
+                pass
+            processor.cancel()
+            if self.sink:
+                await self.sink.close()
+
+    asyncio.run(BenchTCPServer(host='127.0.0.1', port=port, sink=pipeline_from_options(**options)).run())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Instrumented IMU server for benchmark runs")
+    parser.add_argument('--transport', type=str, default='quic', choices=('quic', 'tcp'), help='Server to run')
+    parser.add_argument('--port', type=int, default=5555, help='TCP port (QUIC always uses 4433)')
+    parser.add_argument('--out', type=str, required=True, help='Where to write the JSON summary on shutdown')
+    add_sink_arguments(parser)
+    args = parser.parse_args()
+
+    stats = ReceiveStats()
+    if args.transport == 'quic':
+        run_quic(stats, sink_options(args))
+    else:
+        run_tcp(stats, args.port, sink_options(args))
+    with open(args.out, 'w') as f:
+        json.dump(stats.summary(), f)
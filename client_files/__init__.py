@@ -2,4 +2,5 @@
 from .quic_client_no_priority import IMUClientNoPriority
 from .quic_client_priority import IMUClient
 from .quic_client_single_stream import IMUClientSingleStream
-from .quic_client_no_priority_v2 import IMUClientNoPriority as IMUClientNoPriorityV2
\ No newline at end of file
+from .quic_client_no_priority_v2 import IMUClientNoPriority as IMUClientNoPriorityV2
+from .quic_client_datagram import IMUClientDatagram
@@ -0,0 +1,122 @@
+import asyncio
+from contextlib import suppress
+from aioquic.quic.configuration import QuicConfiguration
+from aioquic.asyncio.client import connect
+from helpers import IMUParser, SampleEncoder, FORMAT_BINARY, SampleBatcher, SampleBridge
+from helpers.batching import DEFAULT_MAX_LINGER, next_flush_timeout
+from helpers.bridge import IDLE_TIMEOUT, ChannelRings
+from helpers.ring import DROP_OLDEST
+from helpers.tickets import resume_options
+from helpers.session import session_options
+from helpers.codec import RECORD
+import argparse
+
+SERVER = "172.190.228.31"
+# Keep each batch inside one QUIC packet, a datagram cannot be fragmented
+MAX_DATAGRAM_BATCH_BYTES = 1000
+
+class DatagramWriter:
+    """Writer-like adapter that sends each write as one QUIC DATAGRAM frame"""
+    def __init__(self, connection):
+        self.connection = connection
+        self.datagrams_sent = 0
+
+    def write(self, data):
+        self.connection._quic.send_datagram_frame(data)
+        self.connection.transmit()
+        self.datagrams_sent += 1
+
+    async def drain(self):
+        # Datagrams are never retransmitted, so there is nothing to wait for
+        return
+
+class IMUClientDatagram:
+    """QUIC client sending IMU sample batches as unreliable datagrams (RFC 9221)."""
+    def __init__(self, wire_format=FORMAT_BINARY, max_batch_bytes=MAX_DATAGRAM_BATCH_BYTES, max_linger=DEFAULT_MAX_LINGER, source=None, rate_control=None, overflow=DROP_OLDEST, session_cache=None, session=None, channels=()):
+        self.bridge = SampleBridge()
+        # Accel and gyro, plus any extra channels such as the magnetometer
+        self.channels = ChannelRings(self.bridge, channels, overflow=overflow)
+        self.samples = self.channels.imu
+        self.imu_parser = IMUParser(source=source)
+        # Datagrams carry self-describing binary records, there is no stream header to negotiate text
+        self.encoder = SampleEncoder(FORMAT_BINARY)
+        self.rate_control = rate_control
+        # SessionTicketCache to resume with, the stream headers and first samples then go out as 0-RTT data
+        self.session_cache = session_cache
+        # ReliableSession used only to reconnect after outages, datagrams are never replayed
+        self.session = session
+        self.encoder.rate_control = rate_control
+        self.max_batch_bytes = min(max_batch_bytes, MAX_DATAGRAM_BATCH_BYTES)
+        self.max_linger = max_linger
+        self.running = False
+
+    async def start(self, host):
+        configuration = QuicConfiguration(
+            is_client=True,
+            alpn_protocols=["h3"],
+            max_datagram_frame_size=65536,
+            verify_mode=False
+        )
+
+        self.bridge.attach(asyncio.get_running_loop())
+        self.running = True
+        reader = asyncio.create_task(self.imu_parser.read_serial_async(self.channels))
+        try:
+            if self.session:
+                await self.session.run(lambda: self.run_connection(host, configuration, reader))
+            else:
+                await self.run_connection(host, configuration, reader)
+        finally:
+            self.running = False
+            reader.cancel()
+            with suppress(asyncio.CancelledError):
+                await reader
+            if self.session:
+                self.session.close()
+
+    async def run_connection(self, host, configuration, reader):
+        """Send samples over one connection until the source runs out or, with a session, the connection drops"""
+        session = self.session
+        resume = resume_options(self.session_cache, configuration, host)
+        async with connect(host, 4433, configuration=configuration, **resume, **session_options(session, configuration)) as connection:
+            batcher = SampleBatcher(DatagramWriter(connection), self.max_batch_bytes, self.max_linger)
+            step = (self.max_batch_bytes // RECORD.size) * RECORD.size
+
+            if self.rate_control:
+                self.rate_control.attach(self.channels.rings(), connection._quic)
+            if session:
+                session.connected()
+
+            while self.running and (not reader.done() or self.bridge.pending()):
+                if session:
+                    session.check(connection)
+                # Sleep until the serial reader hands over samples or the batch is due
+                await self.bridge.wait(next_flush_timeout([batcher], IDLE_TIMEOUT))
+                if self.rate_control:
+                    # Pick each channel's output rate before draining, and tell the server when it changes
+                    self.rate_control.update()
+                    for sensor, msg in self.rate_control.announcements(self.encoder):
+                        await batcher.write(msg)
+                for sensor, block in self.channels.pop():
+                    payload = self.encoder.encode_items(sensor, [block])
+                    # Split on record boundaries so no datagram exceeds the batch limit
+                    for i in range(0, len(payload), step):
+                        await batcher.write(payload[i:i + step])
+                await batcher.flush_if_due()
+
+            await batcher.flush()
+            # Give the last datagrams a chance to leave before the connection closes
+            await asyncio.sleep(0.05)
+
+if __name__ == "__main__":
+    client = IMUClientDatagram()
+    #add cli args
+    argparse = argparse.ArgumentParser(description="QUIC Datagram Client for IMU Data")
+    argparse.add_argument('--host', type=str, default='local', help='Host to connect to')
+    #get args 
+    args = argparse.parse_args()
+    if args.host == 'local':
+        host= 'localhost'
+    else:
+        host = SERVER
+    asyncio.run(client.start(host))
@@ -1,31 +1,47 @@
 import asyncio
-from queue import Queue
-from threading import Thread
+from contextlib import suppress
 from aioquic.quic.configuration import QuicConfiguration
 from aioquic.asyncio.client import connect
-from helpers import PriorityManager, IMUParser
+from helpers import IMUParser, SampleEncoder, FORMAT_BINARY, SampleBatcher, SampleBridge
+from helpers.batching import DEFAULT_MAX_BATCH_BYTES, DEFAULT_MAX_LINGER
+from helpers.bridge import IDLE_TIMEOUT, ChannelRings
+from helpers.ring import DROP_OLDEST
+from helpers.tickets import resume_options
+from helpers.session import session_options
+from helpers.senders import StreamSender, run_senders, check_overflow
 import argparse
 SERVER_URL = '172.190.228.31'
 
 class IMUClientNoPriority:
-    """QUIC client for sending IMU data to a server with priority management."""
-    def __init__(self):
-        self.accel_queue = Queue(maxsize=100)
-        self.gyro_queue = Queue(maxsize=100)
+    """QUIC client for sending IMU data to a server on one stream per channel, with no priority management."""
+    def __init__(self, wire_format=FORMAT_BINARY, max_batch_bytes=DEFAULT_MAX_BATCH_BYTES, max_linger=DEFAULT_MAX_LINGER, source=None, rate_control=None, overflow=DROP_OLDEST, session_cache=None, session=None, channels=()):
+        check_overflow(overflow)
+        self.bridge = SampleBridge()
+        # Accel and gyro, plus any extra channels such as the magnetometer, each sent on a stream of its own
+        self.channels = ChannelRings(self.bridge, channels, overflow=overflow)
+        self.samples = self.channels.imu
         self.running = False
-        self.imu_parser = IMUParser()
-        self.priority_mgr = PriorityManager()
+        self.imu_parser = IMUParser(source=source)
+        self.encoder = SampleEncoder(wire_format)
+        self.rate_control = rate_control
+        # SessionTicketCache to resume with, the stream headers and first samples then go out as 0-RTT data
+        self.session_cache = session_cache
+        # ReliableSession that reconnects after outages and replays what the server has not acknowledged
+        self.session = session
+        if session:
+            session.bind(self.encoder, wakeup=self.bridge.notify)
+        self.encoder.rate_control = rate_control
+        self.max_batch_bytes = max_batch_bytes
+        self.max_linger = max_linger
         self.stream_ids = {}
 
-    async def create_tagged_stream(self, tag, weight):
+    async def create_tagged_stream(self, tag, channels=None):
         """Create a new stream and return its ID."""
         stream_id = self.connection._quic.get_next_available_stream_id(is_unidirectional=True)
         reader,writer = self.connection._create_stream(stream_id)
         self.stream_ids[tag] = stream_id
-        bytes = tag.encode()
-        writer.write(bytes)
+        writer.write(self.encoder.header(tag, channels))
         await writer.drain()
-        self.priority_mgr.add_stream(stream_id=stream_id, weight=weight)
         return writer
     
     async def start(self, host):
@@ -37,58 +53,66 @@ class IMUClientNoPriority:
             verify_mode=False
         )
 
-        async with connect(host, 4433, configuration=configuration) as connection:
+        self.bridge.attach(asyncio.get_running_loop())
+        self.running = True
+        reader = asyncio.create_task(self.imu_parser.read_serial_async(self.channels))
+        try:
+            if self.session:
+                await self.session.run(lambda: self.run_connection(host, configuration, reader), self.bridge, self.channels)
+            else:
+                await self.run_connection(host, configuration, reader)
+        finally:
+            self.running = False
+            reader.cancel()
+            with suppress(asyncio.CancelledError):
+                await reader
+            if self.session:
+                self.session.close()
+
+    async def run_connection(self, host, configuration, reader):
+        """Send samples over one connection until the source runs out or, with a session, the connection drops"""
+        session = self.session
+        resume = resume_options(self.session_cache, configuration, host)
+        async with connect(host, 4433, configuration=configuration, **resume, **session_options(session, configuration)) as connection:
             # Create and register streams
             self.connection = connection
             print("Connected to server")
-            accel_writer = await self.create_tagged_stream("accel", weight=256)  # Higher priority
-            gyro_writer = await self.create_tagged_stream("gyro", weight=128)  # Lower priority
-            # Start serial reader thread
-            self.running = True
-            serial_thread = Thread(target=self.imu_parser.read_serial, args=(self.accel_queue, self.gyro_queue))
-            serial_thread.start()
-
-            try:
-                while self.running:
-                    # Check which streams have data
-                    ready_streams = []
-                    streams_writers = {}
-                    
-                    if not self.accel_queue.empty():
-                        data = self.accel_queue.get()
-                        accel_writer.write(f"ACCEL:{data[0]:.3f},{data[1]:.3f},{data[2]:.3f}\n".encode())
-                        await accel_writer.drain()
-                        ready_streams.append(self.stream_ids['accel'])
-                        streams_writers[self.stream_ids['accel']] = (accel_writer, self.accel_queue)
-                        
-                    if not self.gyro_queue.empty():
-                        data = self.gyro_queue.get()
-                        gyro_writer.write(f"GYRO:{data[0]:.3f},{data[1]:.3f},{data[2]:.3f}\n".encode())
-                        await gyro_writer.drain()
-                        ready_streams.append(self.stream_ids['gyro'])
-                        streams_writers[self.stream_ids['gyro']] = (gyro_writer, self.gyro_queue)
-
-                    # Let priority manager decide which to send next
-                    if ready_streams and False:
-                        selected_stream = self.priority_mgr.get_next_stream(ready_streams)
-                        if selected_stream:
-                            writer, queue = streams_writers[selected_stream]
-                            data = queue.get()
-                            
-                            if selected_stream == self.stream_ids['accel']:
-                                msg = f"ACCEL:{data[0]:.3f},{data[1]:.3f},{data[2]:.3f}\n".encode()
-                            else:
-                                msg = f"GYRO:{data[0]:.3f},{data[1]:.3f},{data[2]:.3f}\n".encode()
-                            
-                            writer.write(msg)
-                            await writer.drain()
-                            self.priority_mgr.update_after_send(selected_stream)
+            # A stream per channel, each sent from its own task
+            senders = {}
+            for channel in self.channels.channels:
+                writer = await self.create_tagged_stream(channel.name, channels=[channel])
+                batcher = SampleBatcher(writer, self.max_batch_bytes, self.max_linger)
+                senders[channel.id] = StreamSender(channel.id, batcher, self.encoder.encode_records,
+                                                   overflow=self.channels.overflow, session=session)
+            if self.rate_control:
+                self.rate_control.attach(self.channels.rings(), connection._quic)
+            if session:
+                session.connected()
+            await run_senders(self.feed(connection, reader, senders), senders.values())
 
-                    await asyncio.sleep(0)  # Prevent busy waiting
+    async def feed(self, connection, reader, senders):
+        """Hand the serial reader's samples to the stream senders until the source runs out"""
+        session = self.session
+        while self.running and (not reader.done() or self.bridge.pending() or (session and session.pending())):
+            if session:
+                session.check(connection)
+            # Sleep until the serial reader hands over samples, each sender keeps its own batch deadline
+            await self.bridge.wait(IDLE_TIMEOUT)
+            if self.rate_control:
+                # Pick each channel's output rate before draining, and tell the server when it changes
+                self.rate_control.update()
+                for sensor, msg in self.rate_control.announcements(self.encoder):
+                    senders[sensor].send(msg)
 
-            finally:
-                self.running = False
-                serial_thread.join()
+            blocks = self.channels.pop()
+            if session:
+                # Into the backlogs right away, so samples a stream has not sent yet survive a lost connection
+                session.buffer(blocks)
+                for sensor, _ in blocks:
+                    senders[sensor].wake()
+            else:
+                for sensor, block in blocks:
+                    senders[sensor].put(self.encoder.stamp_items(sensor, [block]))
 
 if __name__ == "__main__":
     client = IMUClientNoPriority()
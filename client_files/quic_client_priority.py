@@ -1,30 +1,51 @@
 import asyncio
-from queue import Queue
-from threading import Thread
+from contextlib import suppress
+from collections import deque
 from aioquic.quic.configuration import QuicConfiguration
-from aioquic.asyncio.client import connect
-from helpers import PriorityManager, IMUParser
+from helpers import PriorityManager, IMUParser, SampleEncoder, FORMAT_BINARY, SampleBatcher, SampleBridge
+from helpers.batching import DEFAULT_MAX_BATCH_BYTES, DEFAULT_MAX_LINGER, next_flush_timeout
+from helpers.bridge import IDLE_TIMEOUT, ChannelRings
+from helpers.ring import DROP_OLDEST
+from helpers.tickets import resume_options
+from helpers.session import session_options
+from helpers.quic_connection import connect_prioritized
 import argparse
 SERVER_URL = '172.190.228.31'
+# Rows of one channel sent per scheduling decision
+SCHEDULE_ROWS = 8
 
 class IMUClient:
-    def __init__(self):
-        self.accel_queue = Queue(maxsize=100)
-        self.gyro_queue = Queue(maxsize=100)
+    def __init__(self, wire_format=FORMAT_BINARY, max_batch_bytes=DEFAULT_MAX_BATCH_BYTES, max_linger=DEFAULT_MAX_LINGER, source=None, rate_control=None, overflow=DROP_OLDEST, session_cache=None, session=None, channels=()):
+        self.bridge = SampleBridge()
+        # Accel and gyro, plus any extra channels such as the magnetometer, each on a stream weighted by its priority
+        self.channels = ChannelRings(self.bridge, channels, overflow=overflow)
+        self.samples = self.channels.imu
         self.running = False
-        self.imu_parser = IMUParser()
+        self.imu_parser = IMUParser(source=source)
+        self.encoder = SampleEncoder(wire_format)
+        self.rate_control = rate_control
+        # SessionTicketCache to resume with, the stream headers and first samples then go out as 0-RTT data
+        self.session_cache = session_cache
+        # ReliableSession that reconnects after outages and replays what the server has not acknowledged
+        self.session = session
+        if session:
+            session.bind(self.encoder, wakeup=self.bridge.notify)
+        self.encoder.rate_control = rate_control
+        self.max_batch_bytes = max_batch_bytes
+        self.max_linger = max_linger
         self.priority_mgr = PriorityManager()
         self.stream_ids = {}
 
-    async def create_tagged_stream(self, tag, weight):
+    async def create_tagged_stream(self, tag, weight, channels=None):
         """Create a new stream and return its ID."""
         stream_id = self.connection._quic.get_next_available_stream_id(is_unidirectional=True)
         reader,writer = self.connection._create_stream(stream_id)
         self.stream_ids[tag] = stream_id
-        bytes = tag.encode()
-        writer.write(bytes)
+        writer.write(self.encoder.header(tag, channels))
         await writer.drain()
         self.priority_mgr.add_stream(stream_id=stream_id, weight=weight)
+        # Also weight the stream's share of each packet the connection sends
+        self.connection._quic.set_stream_weight(stream_id, weight)
         return writer
     
     async def start(self,host):
@@ -35,51 +56,88 @@ class IMUClient:
             verify_mode=False
         )
 
-        async with connect(host, 4433, configuration=configuration) as connection:
+        # Start the serial reader on this event loop, it keeps reading across reconnects
+        self.bridge.attach(asyncio.get_running_loop())
+        self.running = True
+        reader = asyncio.create_task(self.imu_parser.read_serial_async(self.channels))
+        try:
+            if self.session:
+                await self.session.run(lambda: self.run_connection(host, configuration, reader), self.bridge, self.channels)
+            else:
+                await self.run_connection(host, configuration, reader)
+        finally:
+            self.running = False
+            reader.cancel()
+            with suppress(asyncio.CancelledError):
+                await reader
+            if self.session:
+                self.session.close()
+
+    async def run_connection(self, host, configuration, reader):
+        """Send samples over one connection until the source runs out or, with a session, the connection drops"""
+        session = self.session
+        resume = resume_options(self.session_cache, configuration, host)
+        async with connect_prioritized(host, 4433, configuration=configuration, **resume, **session_options(session, configuration)) as connection:
             # Create and register streams
             self.connection = connection
-            accel_writer = await self.create_tagged_stream("accel", weight=256)  # Higher priority
-            gyro_writer = await self.create_tagged_stream("gyro", weight=128)  # Lower priority
-            # Start serial reader thread
-            self.running = True
-            serial_thread = Thread(target=self.imu_parser.read_serial, args=(self.accel_queue, self.gyro_queue))
-            serial_thread.start()
+            self.priority_mgr = PriorityManager()
+            # Accel highest, then gyro, then the extra channels
+            batchers = {}
+            sensor_streams = {}
+            for channel in self.channels.channels:
+                writer = await self.create_tagged_stream(channel.name, weight=channel.priority, channels=[channel])
+                sensor_streams[channel.id] = self.stream_ids[channel.name]
+                batchers[sensor_streams[channel.id]] = SampleBatcher(writer, self.max_batch_bytes, self.max_linger)
+            if self.rate_control:
+                self.rate_control.attach(self.channels.rings(), connection._quic)
+            # With a session, samples go through its backlog so they can be replayed
+            encode = session.encode_items if session else self.encoder.encode_items
+            if session:
+                session.connected()
+
+            while self.running and (not reader.done() or self.bridge.pending() or (session and session.pending())):
+                if session:
+                    session.check(connection)
+                # Sleep until the serial reader hands over samples or a batch is due
+                await self.bridge.wait(next_flush_timeout(batchers.values(), session.timeout() if session else IDLE_TIMEOUT))
+                if self.rate_control:
+                    # Pick each channel's output rate before draining, and tell the server when it changes
+                    self.rate_control.update()
+                    for sensor, msg in self.rate_control.announcements(self.encoder):
+                        await batchers[sensor_streams[sensor]].write(msg)
 
-            try:
-                while self.running:
+                # Encode every chunk before writing any, so a write cut short by a lost connection leaves every row in the backlogs
+                pending = {
+                    sensor_streams[sensor]: deque(encode(sensor, [block[start:start + SCHEDULE_ROWS]])
+                                                  for start in range(0, len(block), SCHEDULE_ROWS))
+                    for sensor, block in self.channels.pop()
+                }
+                while True:
                     # Check which streams have data
-                    ready_streams = []
-                    streams_writers = {}
-                    
-                    if not self.accel_queue.empty():
-                        ready_streams.append(self.stream_ids['accel'])
-                        streams_writers[self.stream_ids['accel']] = (accel_writer, self.accel_queue)
-                        
-                    if not self.gyro_queue.empty():
-                        ready_streams.append(self.stream_ids['gyro'])
-                        streams_writers[self.stream_ids['gyro']] = (gyro_writer, self.gyro_queue)
+                    ready_streams = [sid for sid, msgs in pending.items() if msgs]
+                    if not ready_streams:
+                        break
 
                     # Let priority manager decide which to send next
-                    if ready_streams:
-                        selected_stream = self.priority_mgr.get_next_stream(ready_streams)
-                        if selected_stream:
-                            writer, queue = streams_writers[selected_stream]
-                            data = queue.get()
-                            
-                            if selected_stream == self.stream_ids['accel']:
-                                msg = f"ACCEL:{data[0]:.3f},{data[1]:.3f},{data[2]:.3f}\n".encode()
-                            else:
-                                msg = f"GYRO:{data[0]:.3f},{data[1]:.3f},{data[2]:.3f}\n".encode()
-                            
-                            writer.write(msg)
-                            await writer.drain()
-                            self.priority_mgr.update_after_send(selected_stream)
+                    selected_stream = self.priority_mgr.get_next_stream(ready_streams)
+                    msg = pending[selected_stream].popleft()
+
+                    await batchers[selected_stream].write(msg)
+                    self.priority_mgr.update_after_send(selected_stream, len(msg))
+
+                if session:
+                    # Paced replay continues while no new samples arrive
+                    for sensor, stream_id in sensor_streams.items():
+                        msg = session.encode_ready(sensor)
+                        if msg:
+                            await batchers[stream_id].write(msg)
+                            self.priority_mgr.update_after_send(stream_id, len(msg))
 
-                    await asyncio.sleep(0)
+                for batcher in batchers.values():
+                    await batcher.flush_if_due()
 
-            finally:
-                self.running = False
-                serial_thread.join()
+            for batcher in batchers.values():
+                await batcher.close()
 
 if __name__ == "__main__":
     client = IMUClient()
@@ -1,18 +1,35 @@
 import asyncio
-from queue import Queue
-from threading import Thread
+from contextlib import suppress
 from aioquic.quic.configuration import QuicConfiguration
 from aioquic.asyncio.client import connect
-from helpers import IMUParser
+from helpers import IMUParser, SampleEncoder, FORMAT_BINARY, SampleBatcher, SampleBridge
+from helpers.batching import DEFAULT_MAX_BATCH_BYTES, DEFAULT_MAX_LINGER, next_flush_timeout
+from helpers.bridge import IDLE_TIMEOUT, ChannelRings
+from helpers.ring import DROP_OLDEST
+from helpers.tickets import resume_options
+from helpers.session import session_options
 import argparse
 
 SERVER = "172.190.228.31"
 
 class IMUClientSingleStream:
-    def __init__(self):
-        self.gyro_queue = Queue(maxsize=1000)
-        self.accel_queue = Queue(maxsize=1000)
-        self.imu_parser = IMUParser()
+    def __init__(self, wire_format=FORMAT_BINARY, max_batch_bytes=DEFAULT_MAX_BATCH_BYTES, max_linger=DEFAULT_MAX_LINGER, source=None, rate_control=None, overflow=DROP_OLDEST, session_cache=None, session=None, channels=()):
+        self.bridge = SampleBridge()
+        # Accel and gyro, plus any extra channels such as the magnetometer, all sent on the one stream
+        self.channels = ChannelRings(self.bridge, channels, overflow=overflow)
+        self.samples = self.channels.imu
+        self.imu_parser = IMUParser(source=source)
+        self.encoder = SampleEncoder(wire_format)
+        self.rate_control = rate_control
+        # SessionTicketCache to resume with, the stream headers and first samples then go out as 0-RTT data
+        self.session_cache = session_cache
+        # ReliableSession that reconnects after outages and replays what the server has not acknowledged
+        self.session = session
+        if session:
+            session.bind(self.encoder, wakeup=self.bridge.notify)
+        self.encoder.rate_control = rate_control
+        self.max_batch_bytes = max_batch_bytes
+        self.max_linger = max_linger
         self.running = False
         
     async def start(self, host):
@@ -23,31 +40,60 @@ class IMUClientSingleStream:
             verify_mode=False
         )
 
-        async with connect(host, 4433, configuration=configuration) as connection:
+        self.bridge.attach(asyncio.get_running_loop())
+        self.running = True
+        reader = asyncio.create_task(self.imu_parser.read_serial_async(self.channels))
+        try:
+            if self.session:
+                await self.session.run(lambda: self.run_connection(host, configuration, reader), self.bridge, self.channels)
+            else:
+                await self.run_connection(host, configuration, reader)
+        finally:
+            self.running = False
+            reader.cancel()
+            with suppress(asyncio.CancelledError):
+                await reader
+            if self.session:
+                self.session.close()
+
+    async def run_connection(self, host, configuration, reader):
+        """Send samples over one connection until the source runs out or, with a session, the connection drops"""
+        session = self.session
+        resume = resume_options(self.session_cache, configuration, host)
+        async with connect(host, 4433, configuration=configuration, **resume, **session_options(session, configuration)) as connection:
             # Create separate streams
             a_sid = connection._quic.get_next_available_stream_id(is_unidirectional=True)
-            reader, writer = connection._create_stream(a_sid)
-            writer.write(b'both')
-
-            self.running = True
-            serial_thread = Thread(target=self.imu_parser.read_serial, args=(self.accel_queue,self.gyro_queue,))
-            serial_thread.start()
-
-            try:
-                while self.running:
-                    if not self.accel_queue.empty():
-                        data = self.accel_queue.get()
-                        writer.write(f"ACCEL:{data[0]:.3f},{data[1]:.3f},{data[2]:.3f}\n".encode())
-                        await writer.drain()
-                    if not self.gyro_queue.empty():
-                        data = self.gyro_queue.get()
-                        writer.write(f"GYRO:{data[0]:.3f},{data[1]:.3f},{data[2]:.3f}\n".encode())
-                        await writer.drain()
-                    await asyncio.sleep(0)
-
-            finally:
-                self.running = False
-                serial_thread.join()
+            _, writer = connection._create_stream(a_sid)
+            writer.write(self.encoder.header('both', self.channels.channels))
+
+            batcher = SampleBatcher(writer, self.max_batch_bytes, self.max_linger)
+            if self.rate_control:
+                self.rate_control.attach(self.channels.rings(), connection._quic)
+            # With a session, samples go through its backlog so they can be replayed
+            encode = session.encode_items if session else self.encoder.encode_items
+            if session:
+                session.connected()
+
+            while self.running and (not reader.done() or self.bridge.pending() or (session and session.pending())):
+                if session:
+                    session.check(connection)
+                # Sleep until the serial reader hands over samples or the batch is due
+                await self.bridge.wait(next_flush_timeout([batcher], session.timeout() if session else IDLE_TIMEOUT))
+                if self.rate_control:
+                    # Pick each channel's output rate before draining, and tell the server when it changes
+                    self.rate_control.update()
+                    for sensor, msg in self.rate_control.announcements(self.encoder):
+                        await batcher.write(msg)
+                # Encode every channel before writing, so a write cut short by a lost connection leaves every row in the backlogs
+                for data in [encode(sensor, [block]) for sensor, block in self.channels.pop()]:
+                    await batcher.write(data)
+                if session:
+                    # Paced replay continues while no new samples arrive
+                    for channel in self.channels.channels:
+                        await batcher.write(session.encode_ready(channel.id))
+                await batcher.flush_if_due()
+
+            await batcher.close()
 
 if __name__ == "__main__":
     client = IMUClientSingleStream()
@@ -1,2 +1,9 @@
 from .imu import IMUParser
-from .quic_priority import PriorityManager
\ No newline at end of file
+from .quic_priority import PriorityManager
+from .codec import SampleEncoder, FORMAT_TEXT, FORMAT_BINARY, FORMAT_DELTA, SENSOR_ACCEL, SENSOR_GYRO
+from .channels import Channel, ChannelRegistry, CHANNELS
+from .batching import SampleBatcher
+from .sequence import SequenceTracker
+from .framing import StreamReassembler
+from .bridge import SampleBridge, ChannelRings
+from .sources import SerialSource, ReplaySource, SyntheticSource
@@ -0,0 +1,101 @@
+import time
+import asyncio
+
+# One QUIC packet carries roughly 1200 bytes of stream data
+DEFAULT_MAX_BATCH_BYTES = 1200
+DEFAULT_MAX_LINGER = 0.002
+# How long close() waits for the peer to acknowledge the end of a stream
+CLOSE_TIMEOUT = 2.0
+ACK_POLL_INTERVAL = 0.01
+
+
+class SampleBatcher:
+    """
+    Coalesces encoded samples for one stream into a single write.
+    A batch is flushed when it reaches max_batch_bytes or when its oldest
+    sample has waited max_linger seconds, whichever comes first.
+    """
+    def __init__(self, writer, max_batch_bytes=DEFAULT_MAX_BATCH_BYTES, max_linger=DEFAULT_MAX_LINGER):
+        self.writer = writer
+        self.max_batch_bytes = max_batch_bytes
+        self.max_linger = max_linger
+        self._buffer = bytearray()
+        self._first_at = None
+        self.flushes = 0
+
+    def __len__(self):
+        return len(self._buffer)
+
+    def add(self, data):
+        """Append an encoded sample, return True if the batch should be flushed"""
+        if self._first_at is None:
+            self._first_at = time.monotonic()
+        self._buffer += data
+        return len(self._buffer) >= self.max_batch_bytes or self.due()
+
+    def due(self):
+        """Check whether the oldest pending sample has hit the linger deadline"""
+        if self._first_at is None:
+            return False
+        return time.monotonic() - self._first_at >= self.max_linger
+
+    def time_left(self):
+        """Seconds until the pending batch is due, None when nothing is pending"""
+        if self._first_at is None:
+            return None
+        return max(0.0, self._first_at + self.max_linger - time.monotonic())
+
+    def take(self):
+        """Remove and return the pending batch"""
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        self._first_at = None
+        return data
+
+    async def write(self, data):
+        """Add encoded samples and flush if the size or deadline limit is hit"""
+        if not data:
+            return
+        if self._buffer and len(self._buffer) + len(data) > self.max_batch_bytes:
+            # Keep batches within the limit, only a single oversized write may exceed it
+            await self.flush()
+        if self.add(data):
+            await self.flush()
+
+    async def flush_if_due(self):
+        """Flush a pending batch whose deadline has passed"""
+        if self.due():
+            await self.flush()
+
+    async def flush(self):
+        """Write out everything pending with a single write and drain"""
+        if not self._buffer:
+            return
+        self.writer.write(self.take())
+        self.flushes += 1
+        await self.writer.drain()
+
+    def _delivered(self):
+        """Whether the peer has acknowledged all data and the end of the QUIC stream"""
+        transport = self.writer.transport
+        stream = transport.protocol._quic._streams.get(transport.stream_id)
+        return stream is None or stream.sender.is_finished
+
+    async def close(self, timeout=CLOSE_TIMEOUT):
+        """
+        Flush, end the stream and wait until the peer has acknowledged everything,
+        so closing the connection right after does not drop the last batches.
+        """
+        await self.flush()
+        if not hasattr(self.writer, 'write_eof'):
+            return
+        self.writer.write_eof()
+        deadline = time.monotonic() + timeout
+        while not self._delivered() and time.monotonic() < deadline:
+            await asyncio.sleep(ACK_POLL_INTERVAL)
+
+
+def next_flush_timeout(batchers, idle):
+    """How long a send loop may sleep before one of the batchers is due"""
+    pending = [batcher.time_left() for batcher in batchers if len(batcher)]
+    return min(pending) if pending else idle
@@ -0,0 +1,131 @@
+import asyncio
+import threading
+from .ring import SampleRing, DEFAULT_CAPACITY, DROP_OLDEST, SAMPLE_WIDTH
+from .codec import split_by_type
+from .channels import IMU_CHANNELS
+
+# Upper bound on how long an idle consumer sleeps before re-checking its running flag
+IDLE_TIMEOUT = 0.5
+
+
+class SampleBridge:
+    """
+    Hands samples from the serial reader thread to a consumer without polling.
+    Any number of rings share one wakeup, and the producer schedules at most
+    one event loop callback until the consumer has run again.
+    """
+    def __init__(self):
+        self._rings = []
+        self._loop = None
+        self._loop_thread = None
+        self._event = None
+        self._lock = threading.Lock()
+        self._wakeup_pending = False
+        self._thread_event = threading.Event()
+
+    def ring(self, capacity=DEFAULT_CAPACITY, overflow=DROP_OLDEST, width=SAMPLE_WIDTH):
+        """Create a sample ring whose pushes wake this bridge's consumer"""
+        ring = SampleRing(capacity, overflow, width=width, notify=self.notify)
+        self._rings.append(ring)
+        return ring
+
+    def attach(self, loop):
+        """Deliver wakeups to coroutines on loop instead of to a blocking consumer"""
+        self._loop = loop
+        self._loop_thread = threading.get_ident()
+        self._event = asyncio.Event()
+        if self.pending():
+            self._event.set()
+
+    def pending(self):
+        return any(not ring.empty() for ring in self._rings)
+
+    def notify(self):
+        """Producer side: wake the consumer if it is not already being woken"""
+        if self._loop is None:
+            self._thread_event.set()
+            return
+        if threading.get_ident() == self._loop_thread:
+            # A reader running on the loop itself needs no cross-thread callback
+            self._event.set()
+            return
+        with self._lock:
+            if self._wakeup_pending:
+                return
+            self._wakeup_pending = True
+        self._loop.call_soon_threadsafe(self._wake)
+
+    def _wake(self):
+        with self._lock:
+            self._wakeup_pending = False
+        self._event.set()
+
+    async def wait(self, timeout=IDLE_TIMEOUT):
+        """Wait on the event loop until any ring has rows, False on timeout"""
+        if self.pending():
+            return True
+        self._event.clear()
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def wait_blocking(self, timeout=IDLE_TIMEOUT):
+        """Block a consumer thread until any ring has rows, False on timeout"""
+        if self.pending():
+            return True
+        self._thread_event.clear()
+        # Re-check so a put between the first check and clear() is not missed
+        if self.pending():
+            return True
+        return self._thread_event.wait(timeout)
+
+
+class ChannelRings:
+    """
+    The sample rings of a client's channels, all waking one bridge. Accel and
+    gyro arrive together on every untagged serial line and share the `imu`
+    ring of (N, 6) rows. Every extra channel, such as the magnetometer, comes
+    on tagged lines at its own rate and has a ring of its own.
+    """
+    def __init__(self, bridge, extra=(), capacity=DEFAULT_CAPACITY, overflow=DROP_OLDEST):
+        self.imu = bridge.ring(capacity, overflow)
+        self.channels = IMU_CHANNELS + tuple(channel for channel in extra if channel not in IMU_CHANNELS)
+        self.extra = {channel.id: bridge.ring(capacity, overflow, width=channel.dim)
+                      for channel in self.channels[len(IMU_CHANNELS):]}
+        # Column range of each IMU channel in the shared rows
+        self._columns = []
+        start = 0
+        for channel in IMU_CHANNELS:
+            self._columns.append((channel.id, slice(start, start + channel.dim)))
+            start += channel.dim
+
+    @property
+    def overflow(self):
+        return self.imu.overflow
+
+    def rings(self):
+        return [self.imu] + list(self.extra.values())
+
+    def route(self, records):
+        """(ring, (N, dim) rows) for the records of tagged lines, dropping channels this client does not send"""
+        routed = []
+        for sensor, block in split_by_type(records):
+            ring = self.extra.get(sensor)
+            if ring is not None:
+                routed.append((ring, block['axes'][:, :ring.width]))
+        return routed
+
+    def pop(self):
+        """Consumer side: everything buffered, as (sensor, (N, dim) block) pairs"""
+        blocks = []
+        rows = self.imu.pop()
+        if len(rows):
+            blocks.extend((sensor, rows[:, columns]) for sensor, columns in self._columns)
+        for sensor, ring in self.extra.items():
+            if not ring.empty():
+                block = ring.pop()
+                if len(block):
+                    blocks.append((sensor, block))
+        return blocks
@@ -0,0 +1,152 @@
+from dataclasses import dataclass
+from typing import Optional
+import numpy as np
+
+# Record types 1-15 are sensor channels, 16 and up are control records
+MAX_CHANNEL_ID = 15
+# Values a record carries per sample, channels with fewer leave the rest at zero
+MAX_DIM = 3
+# Stream tag of the legacy stream that carries accel and gyro together
+TAG_BOTH = 'both'
+
+
+@dataclass(frozen=True)
+class Channel:
+    """
+    One sensor channel. `id` is the record type its samples carry, `dim` how
+    many axes are meaningful, `dtype` the type the sensor reports, which a
+    record holds as float32. `priority` is the stream weight of the channel on
+    prioritized clients, `scale` its quantization step in the dq1 format and
+    `rate` its nominal samples per second, None when it follows the IMU lines.
+    """
+    id: int
+    name: str
+    dim: int = 3
+    dtype: str = 'f4'
+    priority: int = 256
+    scale: float = 0.01
+    rate: Optional[float] = None
+
+    @property
+    def prefix(self):
+        """Line prefix of the channel in the text format and on the serial port"""
+        return self.name.upper()
+
+    def spec(self):
+        """How the channel is announced in a stream header"""
+        return f"{self.name}:{self.id}:{self.dim}:{self.dtype}"
+
+
+class ChannelRegistry:
+    """
+    The channels a client and server know, looked up by record type through
+    a flat table so dispatching a record costs the same however many
+    channels there are. A stream header announces the channels the stream
+    carries with their ids, dimensions and dtypes, and `negotiate` checks
+    them against this registry.
+    """
+    def __init__(self, channels=()):
+        self._by_id = [None] * (MAX_CHANNEL_ID + 1)
+        self._by_name = {}
+        self._by_prefix = {}
+        for channel in channels:
+            self.register(channel)
+
+    def register(self, channel):
+        if not 1 <= channel.id <= MAX_CHANNEL_ID:
+            raise ValueError(f"Channel id must be between 1 and {MAX_CHANNEL_ID}, got {channel.id}")
+        if not 1 <= channel.dim <= MAX_DIM:
+            raise ValueError(f"Channel dimension must be between 1 and {MAX_DIM}, got {channel.dim}")
+        if not np.can_cast(np.dtype(channel.dtype), np.float32, casting='same_kind'):
+            raise ValueError(f"Channel dtype {channel.dtype} does not fit a float32 record")
+        if channel.priority <= 0:
+            raise ValueError(f"Channel priority must be positive, got {channel.priority}")
+        if self._by_id[channel.id] is not None or channel.name in self._by_name:
+            raise ValueError(f"Channel {channel.name} ({channel.id}) is already registered")
+        self._by_id[channel.id] = channel
+        self._by_name[channel.name] = channel
+        self._by_prefix[channel.prefix.encode()] = channel
+
+    def __iter__(self):
+        return (channel for channel in self._by_id if channel is not None)
+
+    def __len__(self):
+        return len(self._by_name)
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __getitem__(self, key):
+        channel = self.get(key)
+        if channel is None:
+            raise KeyError(f"Unknown channel {key!r}")
+        return channel
+
+    def get(self, key, default=None):
+        """Channel by record type or by name"""
+        if isinstance(key, str):
+            return self._by_name.get(key, default)
+        if 0 <= key <= MAX_CHANNEL_ID:
+            return self._by_id[key] or default
+        return default
+
+    def by_prefix(self, prefix):
+        """Channel of a text line prefix such as b'ACCEL', None when unknown"""
+        return self._by_prefix.get(prefix)
+
+    @property
+    def names(self):
+        return [channel.name for channel in self]
+
+    @property
+    def prefixes(self):
+        """Text line starts of every channel, e.g. b'ACCEL:'"""
+        return tuple(prefix + b':' for prefix in self._by_prefix)
+
+    def negotiate(self, spec):
+        """
+        The channels a stream header announces, as a tuple. Raises ValueError
+        when one is unknown or its id, dimension or dtype differ from ours.
+        """
+        channels = []
+        for field in spec.split(','):
+            name, *details = field.split(':')
+            channel = self.get(name)
+            if channel is None:
+                raise ValueError(f"Unknown channel {name!r}")
+            if details and details != channel.spec().split(':')[1:1 + len(details)]:
+                raise ValueError(f"Channel {name} announced as {field!r}, expected {channel.spec()!r}")
+            channels.append(channel)
+        return tuple(channels)
+
+    def stream_channels(self, tag, options):
+        """Channels a stream carries: as announced in its header, else implied by a legacy tag"""
+        spec = options.get('channels')
+        if spec:
+            return self.negotiate(spec)
+        if tag == TAG_BOTH:
+            return IMU_CHANNELS
+        channel = self.get(tag)
+        if channel is None:
+            raise ValueError(f"Unknown stream tag {tag!r}")
+        return (channel,)
+
+
+def channels_spec(channels):
+    """Header option value announcing channels"""
+    return ','.join(channel.spec() for channel in channels)
+
+
+ACCEL = Channel(1, 'accel', 3, priority=256, scale=0.002)
+GYRO = Channel(2, 'gyro', 3, priority=128, scale=0.01)
+# Microtesla, hectopascal and degrees Celsius
+MAG = Channel(3, 'mag', 3, priority=64, scale=0.01, rate=100)
+BARO = Channel(4, 'baro', 1, priority=32, scale=0.05, rate=25)
+TEMP = Channel(5, 'temp', 1, priority=16, scale=0.01, rate=1)
+
+CHANNELS = ChannelRegistry((ACCEL, GYRO, MAG, BARO, TEMP))
+# Channels of the untagged serial lines, in column order
+IMU_CHANNELS = (ACCEL, GYRO)
+IMU_WIDTH = sum(channel.dim for channel in IMU_CHANNELS)
+# Channels read from their own tagged serial lines, at their own rates
+EXTRA_CHANNELS = tuple(channel for channel in CHANNELS if channel not in IMU_CHANNELS)
@@ -0,0 +1,586 @@
+import struct
+import time
+import numpy as np
+from .channels import CHANNELS, ACCEL, GYRO, MAG, BARO, TEMP, MAX_DIM, channels_spec
+
+# Wire formats a client can announce in its stream header
+WIRE_VERSION = 1
+FORMAT_TEXT = "text"
+FORMAT_BINARY = f"bin{WIRE_VERSION}"
+FORMAT_DELTA = f"dq{WIRE_VERSION}"
+FORMATS = (FORMAT_TEXT, FORMAT_BINARY, FORMAT_DELTA)
+
+# Sensor type ids carried in every binary record, see helpers/channels.py
+SENSOR_ACCEL = ACCEL.id
+SENSOR_GYRO = GYRO.id
+SENSOR_MAG = MAG.id
+SENSOR_BARO = BARO.id
+SENSOR_TEMP = TEMP.id
+
+# Control record announcing a channel's effective send rate: seq holds the
+# sensor id, axes hold (rate in Hz, reduction factor, index into RATE_MODES)
+RECORD_RATE = 16
+RATE_FULL, RATE_DECIMATE, RATE_AVERAGE = 'full', 'decimate', 'average'
+RATE_MODES = (RATE_FULL, RATE_DECIMATE, RATE_AVERAGE)
+
+# Control record the server sends back on a reliable session: seq holds the
+# highest sequence number it has taken in for a channel, axes[0] the sensor id
+RECORD_ACK = 17
+
+# type, seq, timestamp, x, y, z -- little-endian, no padding (25 bytes).
+# Channels with fewer than three axes leave the others at zero.
+RECORD = struct.Struct('<BIdfff')
+RECORD_DTYPE = np.dtype([
+    ('type', 'u1'),
+    ('seq', '<u4'),
+    ('ts', '<f8'),
+    ('axes', '<f4', (3,)),
+])
+assert RECORD_DTYPE.itemsize == RECORD.size
+
+SEQ_MASK = 0xFFFFFFFF
+# Sequence numbers less than half the space ahead of another count as newer
+SEQ_HALF = 0x80000000
+
+# Delta format frames: kind and sensor bytes, varint sample count, then
+#   key:     first seq, timestamp, scale (KEY_HEADER), varint body length, body
+#   delta:   zigzag varint microseconds since the previous frame, varint body length, body
+#   records: count whole binary records, for control records such as rate announcements
+# The body is dim * count zigzag varints, each axis's difference from the previous
+# sample in scale units. A key frame's first sample is a difference from zero.
+FRAME_KEY, FRAME_DELTA, FRAME_RECORDS = 1, 2, 3
+KEY_HEADER = struct.Struct('<Idf')
+# Units per int16 step, so accel spans +-65 m/s^2, gyro +-327 and baro +-1638 hPa
+DEFAULT_SCALES = {channel.id: channel.scale for channel in CHANNELS}
+# A channel sends a key frame at least this often, in samples
+KEYFRAME_INTERVAL = 1024
+INT16_MIN, INT16_MAX = -0x8000, 0x7FFF
+# Zigzagged differences of int16 values fit in 17 bits, three varint bytes
+VARINT_MAX_BYTES = 3
+# Below this many values a plain loop beats the vectorized varint paths
+VARINT_VECTOR_MIN = 64
+
+
+def encode_header(tag, fmt=FORMAT_TEXT, **options):
+    """
+    Build the stream-open header announcing the stream tag and wire format,
+    followed by any `key=value` options such as a reliable session's id
+    """
+    if fmt == FORMAT_TEXT and not options:
+        return f"{tag}\n".encode()
+    fields = [tag, fmt] + [f"{key}={value}" for key, value in options.items()]
+    return (';'.join(fields) + '\n').encode()
+
+
+def parse_header_options(data):
+    """
+    Split a stream-open payload into (tag, format, options, remaining bytes).
+    Legacy clients send just the tag with no terminator.
+    """
+    header, sep, rest = bytes(data).partition(b'\n')
+    tag, *fields = header.decode().strip().split(';')
+    fmt = fields[0] if fields and fields[0] else FORMAT_TEXT
+    if fmt not in FORMATS:
+        raise ValueError(f"Unsupported wire format: {fmt}")
+    options = {}
+    for field in fields[1:]:
+        key, eq, value = field.partition('=')
+        if not eq:
+            raise ValueError(f"Malformed header option: {field!r}")
+        options[key] = value
+    return tag, fmt, options, rest
+
+
+def parse_header(data):
+    """Split a stream-open payload into (tag, format, remaining bytes), ignoring options"""
+    tag, fmt, _, rest = parse_header_options(data)
+    return tag, fmt, rest
+
+
+def encode_text(sensor, data):
+    """Encode one sample in the legacy text format, `ACCEL:x,y,z` or `BARO:p`"""
+    channel = CHANNELS[sensor]
+    return (f"{channel.prefix}:" + ','.join(f"{value:.3f}" for value in data[:channel.dim]) + "\n").encode()
+
+
+def pad_axes(rows):
+    """Sample rows of any width up to three as (N, 3) float32 record axes"""
+    rows = np.asarray(rows, dtype=np.float32)
+    rows = rows.reshape(len(rows), -1) if rows.ndim != 1 else rows.reshape(-1, MAX_DIM)
+    if rows.shape[1] == MAX_DIM:
+        return rows
+    axes = np.zeros((len(rows), MAX_DIM), dtype=np.float32)
+    axes[:, :rows.shape[1]] = rows
+    return axes
+
+
+def encode_batch(sensor, seqs, timestamps, axes):
+    """Pack many samples into one contiguous binary payload"""
+    axes = pad_axes(axes)
+    records = np.empty(len(axes), dtype=RECORD_DTYPE)
+    records['type'] = sensor
+    records['seq'] = seqs
+    records['ts'] = timestamps
+    records['axes'] = axes
+    return records.tobytes()
+
+
+def encode_rate(sensor, rate, factor, mode):
+    """Pack a rate announcement record"""
+    return RECORD.pack(RECORD_RATE, sensor, time.time(), rate, factor, RATE_MODES.index(mode))
+
+
+def decode_rates(records):
+    """(sensor, rate, factor, mode) for every rate announcement in a batch of records"""
+    rates = records[records['type'] == RECORD_RATE]
+    return [(int(seq), float(rate), int(factor), RATE_MODES[int(mode)])
+            for seq, (rate, factor, mode) in zip(rates['seq'].tolist(), rates['axes'].tolist())]
+
+
+def encode_ack(sensor, seq):
+    """Pack an acknowledgement record for one channel"""
+    return RECORD.pack(RECORD_ACK, seq, time.time(), sensor, 0.0, 0.0)
+
+
+def decode_acks(records):
+    """(sensor, seq) for every acknowledgement in a batch of records"""
+    acks = records[records['type'] == RECORD_ACK]
+    return [(int(axes[0]), int(seq)) for seq, axes in zip(acks['seq'].tolist(), acks['axes'].tolist())]
+
+
+def decode_batch(buf):
+    """
+    Decode as many whole records as buf holds.
+    Returns (records, consumed) so callers can keep the trailing partial record.
+    """
+    count = len(buf) // RECORD.size
+    consumed = count * RECORD.size
+    records = np.frombuffer(buf, dtype=RECORD_DTYPE, count=count)
+    return records, consumed
+
+
+def group_by_type(types):
+    """
+    Positions of every record type in an array of types, as (type, index)
+    pairs. The index is a slice when all records share a type, else the
+    positions in arrival order. A stable sort of uint8 types is a radix sort,
+    so the cost per record does not grow with the number of channels.
+    """
+    if not len(types):
+        return []
+    first = types[0]
+    if (types == first).all():
+        return [(int(first), slice(None))]
+    order = np.argsort(types, kind='stable')
+    ordered = types[order]
+    bounds = (np.flatnonzero(ordered[1:] != ordered[:-1]) + 1).tolist()
+    return [(int(ordered[start]), order[start:end]) for start, end in zip([0] + bounds, bounds + [len(types)])]
+
+
+def split_by_type(records):
+    """A batch of records as (type, records of that type) pairs"""
+    return [(sensor, records[index]) for sensor, index in group_by_type(records['type'])]
+
+
+def zigzag(values):
+    """Map signed ints to unsigned so small magnitudes stay small: 0, -1, 1, -2 -> 0, 1, 2, 3"""
+    values = np.asarray(values, dtype=np.int32)
+    return ((values << 1) ^ (values >> 31)).astype(np.uint32)
+
+
+def unzigzag(values):
+    values = np.asarray(values, dtype=np.int32)
+    return (values >> 1) ^ -(values & 1)
+
+
+def encode_varints(values):
+    """LEB128 encode an array of unsigned ints below 2**21 in one pass"""
+    values = np.asarray(values, dtype=np.uint32)
+    if len(values) and values.max() >> (7 * VARINT_MAX_BYTES):
+        raise ValueError("Value too large for a delta varint")
+    if len(values) < VARINT_VECTOR_MIN:
+        return b''.join(map(pack_varint, values.tolist()))
+    lengths = 1 + (values >= 1 << 7) + (values >= 1 << 14)
+    ends = np.cumsum(lengths)
+    starts = ends - lengths
+    out = np.empty(int(ends[-1]) if len(ends) else 0, dtype=np.uint8)
+    for k in range(VARINT_MAX_BYTES):
+        has = lengths > k
+        more = np.where(lengths[has] > k + 1, 0x80, 0)
+        out[starts[has] + k] = ((values[has] >> (7 * k)) & 0x7F) | more
+    return out.tobytes()
+
+
+def decode_varints(data):
+    """Decode a buffer holding only whole varints, each at most VARINT_MAX_BYTES long"""
+    if len(data) < VARINT_VECTOR_MIN:
+        values = []
+        pos = 0
+        while pos < len(data):
+            field = read_varint(data, pos)
+            if field is None:
+                raise ValueError("Truncated varint")
+            if field[1] - pos > VARINT_MAX_BYTES:
+                raise ValueError("Varint too long")
+            value, pos = field
+            values.append(value)
+        return np.array(values, dtype=np.uint32)
+    data = np.frombuffer(data, dtype=np.uint8)
+    ends = np.flatnonzero(data < 0x80)
+    if len(data) and (not len(ends) or ends[-1] != len(data) - 1):
+        raise ValueError("Truncated varint")
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    lengths = ends - starts + 1
+    if len(lengths) and lengths.max() > VARINT_MAX_BYTES:
+        raise ValueError("Varint too long")
+    values = np.zeros(len(ends), dtype=np.uint32)
+    for k in range(VARINT_MAX_BYTES):
+        has = lengths > k
+        values[has] |= (data[starts[has] + k] & 0x7F).astype(np.uint32) << (7 * k)
+    return values
+
+
+def pack_varint(value):
+    """LEB128 encode a single unsigned int of any size"""
+    out = bytearray()
+    while value >= 0x80:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def read_varint(buf, pos):
+    """Read a varint at pos, returns (value, next pos) or None if buf ends first"""
+    value = shift = 0
+    while pos < len(buf):
+        byte = buf[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+    return None
+
+
+def encode_records_frame(records):
+    """Wrap whole binary records in a delta format frame"""
+    return bytes((FRAME_RECORDS, 0)) + pack_varint(len(records) // RECORD.size) + records
+
+
+class DeltaEncoder:
+    """
+    Encodes sample blocks as delta format frames. Every axis is quantized to
+    int16 at its sensor's scale and sent as the zigzag varint difference from
+    the previous sample, so a slowly changing channel costs about a byte per
+    axis. A key frame restarts the differences from zero and carries the
+    sequence number, timestamp and scale, so a receiver that missed earlier
+    frames can pick the channel up again. Delta frames carry no sequence
+    number, so a block that does not continue the previous one's sequence
+    numbers is sent as a key frame.
+    """
+    def __init__(self, scales=None, keyframe_interval=KEYFRAME_INTERVAL):
+        self.scales = dict(DEFAULT_SCALES) if scales is None else scales
+        self.keyframe_interval = keyframe_interval
+        self._last = {}
+        self._since_key = {}
+        # Per sensor, the sequence number the receiver expects next
+        self._next_seq = {}
+        # Per sensor, the timestamp and scale the receiver last reconstructed
+        self._timestamp = {}
+        self._scale = {}
+
+    def encode(self, sensor, seq, timestamp, rows):
+        """Encode an (N, dim) block whose first sample has sequence number seq, wider blocks are cut to dim"""
+        dim = CHANNELS[sensor].dim
+        rows = np.asarray(rows, dtype=np.float32)
+        rows = rows.reshape(len(rows), -1)[:, :dim] if rows.ndim > 1 else rows.reshape(-1, dim)
+        scale = float(np.float32(self.scales[sensor]))
+        quantized = np.clip(np.rint(rows / scale), INT16_MIN, INT16_MAX).astype(np.int32)
+        key = (sensor not in self._last or self._scale[sensor] != scale
+               or self._since_key[sensor] >= self.keyframe_interval or self._next_seq[sensor] != seq)
+        previous = np.zeros(dim, dtype=np.int32) if key else self._last[sensor]
+        body = encode_varints(zigzag(np.diff(quantized, axis=0, prepend=previous[None]).ravel()))
+        head = bytes((FRAME_KEY if key else FRAME_DELTA, sensor)) + pack_varint(len(rows))
+        if key:
+            head += KEY_HEADER.pack(seq, timestamp, scale)
+            self._timestamp[sensor] = timestamp
+            self._scale[sensor] = scale
+            self._since_key[sensor] = 0
+        else:
+            micros = round((timestamp - self._timestamp[sensor]) * 1e6)
+            # Track the receiver's rounded clock so rounding errors do not add up
+            self._timestamp[sensor] += micros / 1e6
+            head += pack_varint((micros << 1) ^ (micros >> 63))
+        self._last[sensor] = quantized[-1]
+        self._next_seq[sensor] = (seq + len(rows)) & SEQ_MASK
+        self._since_key[sensor] += len(rows)
+        return head + pack_varint(len(body)) + body
+
+
+class DeltaDecoder:
+    """
+    Turns delta format frames back into binary records, keeping each
+    channel's last sample between frames. Delta frames that arrive before
+    their channel's first key frame are counted in `skipped` and dropped.
+    Only the given channels, all registered ones by default, are accepted,
+    since a frame's length depends on its channel's dimension.
+    """
+    def __init__(self, channels=None):
+        self.dims = {channel.id: channel.dim for channel in (CHANNELS if channels is None else channels)}
+        # sensor -> (last quantized sample, next seq, timestamp, scale)
+        self._state = {}
+        self.skipped = 0
+
+    def decode(self, buf):
+        """
+        Decode as many whole frames as buf holds.
+        Returns (records, consumed) so callers can keep the trailing partial frame.
+        """
+        view = memoryview(buf)
+        pos = 0
+        batches = []
+        while True:
+            frame = self._decode_frame(view, pos)
+            if frame is None:
+                break
+            records, pos = frame
+            if records is not None and len(records):
+                batches.append(records)
+        if not batches:
+            return np.zeros(0, dtype=RECORD_DTYPE), pos
+        return (batches[0] if len(batches) == 1 else np.concatenate(batches)), pos
+
+    def _decode_frame(self, view, pos):
+        if pos + 2 > len(view):
+            return None
+        kind, sensor = view[pos], view[pos + 1]
+        field = read_varint(view, pos + 2)
+        if field is None:
+            return None
+        count, pos = field
+        if kind == FRAME_RECORDS:
+            end = pos + count * RECORD.size
+            if end > len(view):
+                return None
+            return np.frombuffer(view[pos:end], dtype=RECORD_DTYPE), end
+        if kind == FRAME_KEY:
+            if pos + KEY_HEADER.size > len(view):
+                return None
+            seq, timestamp, scale = KEY_HEADER.unpack_from(view, pos)
+            pos += KEY_HEADER.size
+        elif kind == FRAME_DELTA:
+            field = read_varint(view, pos)
+            if field is None:
+                return None
+            micros, pos = field
+            micros = (micros >> 1) ^ -(micros & 1)
+        else:
+            raise ValueError(f"Unknown delta frame kind {kind}")
+        field = read_varint(view, pos)
+        if field is None:
+            return None
+        length, pos = field
+        end = pos + length
+        if end > len(view):
+            return None
+
+        dim = self.dims.get(sensor)
+        if dim is None:
+            raise ValueError(f"Delta frame for channel {sensor}, which the stream did not announce")
+        if kind == FRAME_KEY:
+            previous = np.zeros(dim, dtype=np.int32)
+        elif sensor in self._state:
+            previous, seq, timestamp, scale = self._state[sensor]
+            timestamp += micros / 1e6
+        else:
+            self.skipped += count
+            return None, end
+        deltas = unzigzag(decode_varints(view[pos:end]))
+        if len(deltas) != dim * count:
+            raise ValueError(f"Delta frame holds {len(deltas)} values for {count} samples")
+        quantized = previous + np.cumsum(deltas.reshape(count, dim), axis=0, dtype=np.int32)
+        records = np.zeros(count, dtype=RECORD_DTYPE)
+        records['type'] = sensor
+        records['seq'] = (np.arange(seq, seq + count, dtype=np.uint64) & SEQ_MASK)
+        records['ts'] = timestamp
+        records['axes'][:, :dim] = quantized * np.float32(scale)
+        self._state[sensor] = (quantized[-1], (seq + count) & SEQ_MASK, timestamp, scale)
+        return records, end
+
+
+class SampleEncoder:
+    """Encodes samples for a client in its negotiated wire format"""
+    def __init__(self, fmt=FORMAT_BINARY, scales=None):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unsupported wire format: {fmt}")
+        self.format = fmt
+        # Quantization step per sensor for the delta format
+        self.scales = dict(DEFAULT_SCALES) if scales is None else scales
+        self.delta = DeltaEncoder(self.scales) if fmt == FORMAT_DELTA else None
+        # Next sequence number per sensor, every channel counts from zero
+        self._seq = {}
+        # Optional RateController that thins samples out before they are encoded
+        self.rate_control = None
+        # Extra stream header options, such as the id of a reliable session
+        self.options = {}
+
+    def header(self, tag, channels=None):
+        """Stream-open header for this encoder's format, announcing the channels the stream carries"""
+        if channels:
+            return encode_header(tag, self.format, **self.options, channels=channels_spec(channels))
+        return encode_header(tag, self.format, **self.options)
+
+    def reset_stream(self):
+        """Forget per-stream state so the next frames decode on a fresh stream"""
+        if self.delta:
+            self.delta = DeltaEncoder(self.scales, self.delta.keyframe_interval)
+
+    def encode(self, sensor, data):
+        """Encode one (x, y, z) sample"""
+        if self.format == FORMAT_TEXT:
+            return encode_text(sensor, data)
+        if self.delta:
+            return self.encode_many(sensor, [data])
+        seq = self._seq.get(sensor, 0)
+        self._seq[sensor] = (seq + 1) & SEQ_MASK
+        x, y, z = (tuple(data) + (0.0, 0.0))[:MAX_DIM]
+        return RECORD.pack(sensor, seq, time.time(), x, y, z)
+
+    def encode_items(self, sensor, items):
+        """
+        Encode a list of queued samples in one call. Items are either (x, y, z)
+        tuples or (N, 3) blocks from the bulk serial parser.
+        """
+        rows = self._reduce(sensor, items)
+        if rows is None:
+            return b''
+        return self.encode_many(sensor, rows)
+
+    def _reduce(self, sensor, items):
+        """Queued items as one block, thinned out by the rate controller, None when nothing is left"""
+        if not len(items):
+            return None
+        if isinstance(items[0], np.ndarray):
+            rows = np.concatenate(items) if len(items) > 1 else items[0]
+        else:
+            rows = items
+        if self.rate_control is not None and len(rows):
+            rows = self.rate_control.reduce(sensor, rows)
+        return rows if len(rows) else None
+
+    def stamp_items(self, sensor, items):
+        """
+        Number and timestamp queued samples as binary records without encoding
+        them, for senders that keep records around to retransmit
+        """
+        rows = self._reduce(sensor, items)
+        if rows is None:
+            return np.zeros(0, dtype=RECORD_DTYPE)
+        axes = pad_axes(rows)
+        count = len(axes)
+        start = self._seq.get(sensor, 0)
+        self._seq[sensor] = (start + count) & SEQ_MASK
+        records = np.empty(count, dtype=RECORD_DTYPE)
+        records['type'] = sensor
+        records['seq'] = np.arange(start, start + count, dtype=np.uint64) & SEQ_MASK
+        records['ts'] = time.time()
+        records['axes'] = axes
+        return records
+
+    def encode_records(self, records):
+        """
+        Encode stamped records of one sensor, keeping their sequence numbers
+        and timestamps. Delta frames carry one timestamp and consecutive
+        sequence numbers, so a block is split wherever the timestamp changes
+        or records were dropped, and a gap starts a key frame.
+        """
+        if not len(records):
+            return b''
+        if self.format == FORMAT_TEXT:
+            sensor = int(records['type'][0])
+            return b''.join(encode_text(sensor, row) for row in records['axes'])
+        if not self.delta:
+            return records.tobytes()
+        sensor = int(records['type'][0])
+        timestamps = records['ts']
+        seqs = records['seq']
+        splits = (timestamps[1:] != timestamps[:-1]) | (((seqs[1:] - seqs[:-1]) & SEQ_MASK) != 1)
+        bounds = np.concatenate(([0], np.flatnonzero(splits) + 1, [len(records)]))
+        return b''.join(self.delta.encode(sensor, int(records['seq'][start]), float(timestamps[start]),
+                                          records['axes'][start:end])
+                        for start, end in zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+
+    def encode_rate(self, sensor, rate, factor, mode):
+        """Rate announcement for a channel, text streams cannot carry one"""
+        if self.format == FORMAT_TEXT:
+            return b''
+        if self.delta:
+            return encode_records_frame(encode_rate(sensor, rate, factor, mode))
+        return encode_rate(sensor, rate, factor, mode)
+
+    def encode_many(self, sensor, rows):
+        """Encode an (N, 3) block of samples in one call"""
+        if self.format == FORMAT_TEXT:
+            return b''.join(encode_text(sensor, row) for row in rows)
+        count = len(rows)
+        start = self._seq.get(sensor, 0)
+        self._seq[sensor] = (start + count) & SEQ_MASK
+        if self.delta:
+            return self.delta.encode(sensor, start, time.time(), rows) if count else b''
+        seqs = (np.arange(start, start + count, dtype=np.uint64) & SEQ_MASK)
+        return encode_batch(sensor, seqs, time.time(), rows)
+
+
+def parse_rows(values, width=3):
+    """
+    Parse comma separated rows of width floats in one pass.
+    Returns (rows, keep) where keep lists the rows that parsed, or None if all did.
+    """
+    try:
+        return np.array(b','.join(values).split(b','), dtype=np.float32).reshape(-1, width), None
+    except ValueError:
+        pass
+    # Slow path: at least one row is corrupt, parse row by row
+    rows = []
+    keep = []
+    for i, value in enumerate(values):
+        try:
+            row = np.array(value.split(b','), dtype=np.float32)
+        except ValueError:
+            continue
+        if len(row) == width:
+            rows.append(row)
+            keep.append(i)
+    return np.array(rows, dtype=np.float32).reshape(-1, width), keep
+
+
+def decode_text(lines):
+    """
+    Parse complete `ACCEL:x,y,z` / `BARO:p` lines into binary records, skipping
+    unknown channels and lines with the wrong number of values. Lines are
+    parsed in one pass per channel dimension, so records come out grouped by
+    dimension. Text lines carry no sequence number or timestamp, those fields
+    are left at zero.
+    """
+    groups = {}
+    for line in lines:
+        prefix, _, axes = line.strip().partition(b':')
+        channel = CHANNELS.by_prefix(prefix)
+        if channel is None or axes.count(b',') != channel.dim - 1:
+            continue
+        types, values = groups.setdefault(channel.dim, ([], []))
+        types.append(channel.id)
+        values.append(axes)
+    if not groups:
+        return np.zeros(0, dtype=RECORD_DTYPE)
+    batches = []
+    for dim, (types, values) in groups.items():
+        axes, keep = parse_rows(values, width=dim)
+        if keep is not None:
+            types = [types[i] for i in keep]
+        records = np.zeros(len(types), dtype=RECORD_DTYPE)
+        records['type'] = types
+        records['axes'][:, :dim] = axes
+        batches.append(records)
+    return batches[0] if len(batches) == 1 else np.concatenate(batches)
@@ -0,0 +1,84 @@
+import numpy as np
+from .codec import RECORD, RECORD_DTYPE, FORMAT_BINARY, FORMAT_DELTA, DeltaDecoder, decode_text
+
+
+class StreamReassembler:
+    """
+    Per-stream receive buffer that turns arbitrary chunks of stream data into
+    whole sample records. Frames split across receive events are carried over
+    to the next chunk instead of being dropped. `channels` are the channels
+    the stream announced, by default any registered one. A corrupt delta
+    frame makes the stream `broken`: every later chunk raises ValueError,
+    and the caller is expected to close the stream.
+    """
+    def __init__(self, fmt, channels=None):
+        self.format = fmt
+        self._pending = bytearray()
+        self._decoder = DeltaDecoder(channels) if fmt == FORMAT_DELTA else None
+        self.broken = False
+
+    def __len__(self):
+        return len(self._pending)
+
+    def feed(self, data):
+        """Consume one chunk and return every record it completes as a single array"""
+        if self.format == FORMAT_BINARY:
+            return self._feed_binary(data)
+        if self._decoder:
+            return self._feed_delta(data)
+        return self._feed_text(data)
+
+    def _feed_binary(self, data):
+        view = memoryview(data)
+        head = None
+        if self._pending:
+            # Complete the record left over from the previous chunk
+            need = RECORD.size - len(self._pending)
+            self._pending += view[:need]
+            view = view[need:]
+            if len(self._pending) < RECORD.size:
+                return np.zeros(0, dtype=RECORD_DTYPE)
+            head = np.frombuffer(bytes(self._pending), dtype=RECORD_DTYPE)
+            self._pending.clear()
+
+        count = len(view) // RECORD.size
+        consumed = count * RECORD.size
+        # Records decode straight out of the received chunk without copying
+        body = np.frombuffer(view, dtype=RECORD_DTYPE, count=count)
+        if consumed < len(view):
+            self._pending += view[consumed:]
+        if head is None:
+            return body
+        return np.concatenate((head, body))
+
+    def _feed_delta(self, data):
+        if self.broken:
+            raise ValueError("Delta stream is unreadable after a corrupt frame")
+        if self._pending:
+            self._pending += data
+            data = bytes(self._pending)
+            self._pending.clear()
+        try:
+            records, consumed = self._decoder.decode(data)
+        except ValueError:
+            # A corrupt frame leaves no way to find the next one, and the decoder's
+            # last values and sequence numbers no longer match what the sender holds
+            self._pending.clear()
+            self.broken = True
+            raise
+        self._pending += memoryview(data)[consumed:]
+        return records
+
+    def _feed_text(self, data):
+        end = data.rfind(b'\n')
+        if end < 0:
+            self._pending += data
+            return np.zeros(0, dtype=RECORD_DTYPE)
+        if self._pending:
+            self._pending += data[:end]
+            complete = bytes(self._pending)
+            self._pending.clear()
+        else:
+            complete = data[:end]
+        self._pending += data[end + 1:]
+        return decode_text(complete.split(b'\n'))
@@ -1,28 +1,230 @@
-import serial
 import re
+import asyncio
+import threading
+import numpy as np
+from .codec import parse_rows, decode_text, RECORD_DTYPE
+from .channels import IMU_WIDTH
+from .ring import BLOCK
+from .sources import SerialSource, DEFAULT_SERIAL_PORT, DEFAULT_BAUDRATE
+
+NEWLINE, COMMA, DOT = ord('\n'), ord(','), ord('.')
+# Lines of extra channels start with the channel's prefix, e.g. `MAG:x,y,z`
+TAGGED_BYTES = np.zeros(256, dtype=bool)
+TAGGED_BYTES[list(b'ABCDEFGHIJKLMNOPQRSTUVWXYZ')] = True
+# Bytes allowed in a valid sample line
+LINE_BYTES = np.zeros(256, dtype=bool)
+LINE_BYTES[list(b'0123456789-.,\r\n ')] = True
+# Give up on a partial line that grows past this without a newline
+MAX_PENDING = 4096
+# Serial read timeout of the reader thread, bounds how long stop() takes
+READ_TIMEOUT = 0.1
+# Shortest sleep of the event loop reader on sources without a file descriptor
+MIN_POLL = 0.001
+
+def no_tagged():
+    return np.zeros(0, dtype=RECORD_DTYPE)
+
+
 class IMUParser:
-    """Parser for IMU data"""
-    def __init__(self):
-        self.pattern = re.compile(r'^(-?\d+\.\d+,){5}-?\d+\.\d+$')
-        self.serial_port = '/dev/ttyACM0'
-        self.baudrate = 921600
+    """
+    Parser for IMU data. Untagged lines hold one reading of every IMU channel,
+    `ax,ay,az,gx,gy,gz`. Extra channels arrive on lines tagged with their
+    prefix, `MAG:x,y,z` or `BARO:p`, which decode to records.
+    """
+    def __init__(self, bulk=False, source=None):
+        self.pattern = re.compile(rf'^(-?\d+\.\d+,){{{IMU_WIDTH - 1}}}-?\d+\.\d+$')
+        self.serial_port = DEFAULT_SERIAL_PORT
+        self.baudrate = DEFAULT_BAUDRATE
+        self.bulk = bulk
+        self.source = source
+        self.rejected = 0
+        self._stop = threading.Event()
 
     def match(self, line):
         """Check if the line matches the expected format"""
         return bool(self.pattern.match(line))
-    
-    def read_serial(self, accel_queue, gyro_queue):
-            """Thread function to read from serial port"""
-            ser = serial.Serial(self.serial_port, self.baudrate)
+
+    def parse_tagged(self, lines):
+        """Records of the tagged lines of extra channels, counting the ones that do not parse as rejected"""
+        if not lines:
+            return no_tagged()
+        records = decode_text(lines)
+        self.rejected += len(lines) - len(records)
+        return records
+
+    def parse_bulk(self, data):
+        """
+        Parse every complete line in data in one vectorized pass.
+        Returns ((N, 6) float32 array, records of tagged lines, trailing partial line).
+        """
+        end = data.rfind(b'\n')
+        if end < 0:
+            return np.empty((0, IMU_WIDTH), dtype=np.float32), no_tagged(), data
+        block = np.frombuffer(data, dtype=np.uint8, count=end + 1)
+        newlines = np.flatnonzero(block == NEWLINE)
+        starts = np.concatenate(([0], newlines[:-1] + 1))
+        lines = data[:end].split(b'\n')
+        tagged = TAGGED_BYTES[block[starts]]
+        records = self.parse_tagged([lines[i] for i in np.flatnonzero(tagged)]) if tagged.any() else no_tagged()
+
+        # Per-line counts from running totals instead of a regex per line
+        def per_line(mask):
+            total = np.concatenate(([0], np.cumsum(mask)))
+            return total[newlines + 1] - total[starts]
+        commas = per_line(block == COMMA)
+        dots = per_line(block == DOT)
+        invalid = per_line(~LINE_BYTES[block])
+        valid = (commas == IMU_WIDTH - 1) & (dots == IMU_WIDTH) & (invalid == 0)
+
+        good = [lines[i] for i in np.flatnonzero(valid)]
+        self.rejected += len(lines) - len(good) - int(tagged.sum())
+        if not good:
+            return np.empty((0, IMU_WIDTH), dtype=np.float32), records, data[end + 1:]
+        rows, keep = parse_rows(good, width=IMU_WIDTH)
+        if keep is not None:
+            self.rejected += len(good) - len(keep)
+        return rows, records, data[end + 1:]
+
+    def parse_chunk(self, data):
+        """
+        Parse every complete line in data, in one vectorized pass in bulk mode
+        or line by line otherwise. Returns ((N, 6) float32 array, records of
+        tagged lines, trailing partial line).
+        """
+        if self.bulk:
+            rows, records, rest = self.parse_bulk(data)
+        else:
+            end = data.rfind(b'\n')
+            good = []
+            tagged = []
+            for raw in (data[:end].split(b'\n') if end >= 0 else ()):
+                line = raw.decode(errors='replace').strip()
+                if self.pattern.match(line):
+                    good.append(line.split(','))
+                elif line[:1].isupper():
+                    tagged.append(raw)
+                elif line:
+                    self.rejected += 1
+            rows = np.array(good, dtype=np.float32).reshape(-1, IMU_WIDTH)
+            records = self.parse_tagged(tagged)
+            rest = data[end + 1:]
+        if len(rest) > MAX_PENDING:
+            rest = b''
+        return rows, records, rest
+
+    def stop(self):
+        """Make read_serial / read_serial_bulk return, within READ_TIMEOUT for a serial port"""
+        self._stop.set()
+
+    def open_source(self, timeout=None):
+        """Open the configured sample source, the serial port by default"""
+        source = self.source or SerialSource(self.serial_port, self.baudrate)
+        return source.open(timeout=timeout)
+
+    def read_serial(self, rings):
+            """Thread function to read from serial port into a client's ChannelRings"""
+            if self.bulk:
+                return self.read_serial_bulk(rings)
+            ser = self.open_source(timeout=READ_TIMEOUT)
             try:
-                while True:
-                    line = ser.readline().decode().strip()
+                while not self._stop.is_set():
+                    raw = ser.readline()
+                    if not raw and getattr(ser, 'exhausted', False):
+                        break
+                    line = raw.decode(errors='replace').strip()
                     if line and self.pattern.match(line):
                         try:
-                            ax, ay, az, gx, gy, gz = map(float, line.split(','))
-                            accel_queue.put((ax, ay, az))
-                            gyro_queue.put((gx, gy, gz))
+                            rings.imu.push_row(line.split(','))
                         except ValueError:
                             continue
+                    elif line[:1].isupper():
+                        for ring, rows in rings.route(self.parse_tagged([raw])):
+                            ring.push(rows)
+            finally:
+                ser.close()
+
+    def read_serial_bulk(self, rings):
+            """Thread function reading whatever bytes are available and pushing (N, 6) blocks"""
+            ser = self.open_source(timeout=READ_TIMEOUT)
+            pending = b''
+            try:
+                while not self._stop.is_set():
+                    chunk = ser.read(max(1, ser.in_waiting))
+                    if not chunk:
+                        if getattr(ser, 'exhausted', False):
+                            break
+                        continue
+                    rows, records, pending = self.parse_chunk(pending + chunk)
+                    if len(rows):
+                        rings.imu.push(rows)
+                    for ring, block in rings.route(records):
+                        ring.push(block)
             finally:
-                ser.close()
\ No newline at end of file
+                ser.close()
+
+    async def read_serial_async(self, rings):
+        """
+        Read the source on the running event loop into a client's ChannelRings, until the source
+        runs out or the task is cancelled. A serial port's file descriptor is
+        registered with loop.add_reader, so the loop only wakes when bytes
+        arrive, and each wakeup reads everything buffered. Generated and
+        replayed sources have no descriptor and are read whenever their next
+        bytes are due.
+        """
+        port = self.open_source(timeout=0)
+        try:
+            if hasattr(port, 'fileno'):
+                await self._read_fd(port, rings)
+            else:
+                await self._read_polled(port, rings)
+        finally:
+            port.close()
+
+    async def _read_fd(self, port, rings):
+        loop = asyncio.get_running_loop()
+        readable = asyncio.Event()
+        fd = port.fileno()
+        loop.add_reader(fd, readable.set)
+        pending = b''
+        try:
+            while True:
+                await readable.wait()
+                readable.clear()
+                chunk = port.read(port.in_waiting or 1)
+                if chunk:
+                    pending = await self._parse_into(rings, pending + chunk)
+        finally:
+            loop.remove_reader(fd)
+
+    async def _read_polled(self, port, rings):
+        pending = b''
+        while True:
+            chunk = port.read(port.in_waiting)
+            if chunk:
+                pending = await self._parse_into(rings, pending + chunk)
+                continue
+            delay = port.delay()
+            if delay is None:
+                break
+            await asyncio.sleep(max(delay, MIN_POLL))
+
+    async def _parse_into(self, rings, data):
+        """Parse data into the rings of its channels, returns the trailing partial line"""
+        rows, records, pending = self.parse_chunk(data)
+        await self._push(rings.imu, rows)
+        for ring, block in rings.route(records):
+            await self._push(ring, block)
+        return pending
+
+    async def _push(self, ring, rows):
+        """Push rows into ring, under BLOCK wait for the consumer to make room instead of blocking the loop it runs on"""
+        if ring.overflow != BLOCK:
+            ring.push(rows)
+            return
+        while len(rows):
+            free = ring.capacity - len(ring)
+            if free:
+                ring.push(rows[:free])
+                rows = rows[free:]
+            else:
+                await ring.wait_for_space_async()
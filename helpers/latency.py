@@ -0,0 +1,221 @@
+import time
+import numpy as np
+from .codec import group_by_type
+from .channels import CHANNELS
+from .sequence import SequenceTracker
+
+# Values are integer microseconds. 2**PRECISION_BITS sub-buckets per power of two
+# keep every bucket within ~3% of the values it holds.
+PRECISION_BITS = 5
+MAX_VALUE_US = 60_000_000
+# Sliding window reported by the percentiles, split into slots that expire one at a time
+DEFAULT_WINDOW = 10.0
+DEFAULT_SLOTS = 10
+REPORT_PERCENTILES = (50, 99, 99.9)
+# Values a histogram's scratch buffers hold before they grow
+SCRATCH_SIZE = 1024
+
+
+def bucket_index(value):
+    """Bucket of a non-negative integer value"""
+    shift = max(0, value.bit_length() - PRECISION_BITS)
+    return (shift << (PRECISION_BITS - 1)) + (value >> shift)
+
+
+def bucket_indices(values):
+    """bucket_index() for an integer array"""
+    # frexp's exponent is the bit length for integers below 2**53
+    shift = np.maximum(np.frexp(values)[1] - PRECISION_BITS, 0)
+    return (shift << (PRECISION_BITS - 1)) + (values >> shift)
+
+
+def bucket_bounds(index):
+    """Smallest value in a bucket and the bucket's width"""
+    if index < 1 << PRECISION_BITS:
+        return index, 1
+    shift = (index >> (PRECISION_BITS - 1)) - 1
+    return (index - (shift << (PRECISION_BITS - 1))) << shift, 1 << shift
+
+
+BUCKETS = bucket_index(MAX_VALUE_US) + 1
+
+
+class WindowedHistogram:
+    """
+    Log-bucketed (HDR-style) histogram over a sliding time window.
+    Counts live in a preallocated (slots, buckets) array, each slot covering
+    window / slots seconds. Recording touches one counter per value and
+    expired slots are zeroed in place, so memory stays fixed however long
+    the stream runs. A lifetime histogram is kept alongside. Batches are
+    bucketed in preallocated scratch buffers, which only grow when a batch
+    outgrows them.
+    """
+    def __init__(self, window=DEFAULT_WINDOW, slots=DEFAULT_SLOTS):
+        self.window = window
+        self.slot_duration = window / slots
+        self._slots = np.zeros((slots, BUCKETS), dtype=np.int64)
+        self.lifetime = np.zeros(BUCKETS, dtype=np.int64)
+        self._tick = None
+        self.started = time.monotonic()
+        self._grow(SCRATCH_SIZE)
+
+    def _grow(self, size):
+        self._values = np.empty(size, dtype=np.float64)
+        self._exponents = np.empty(size, dtype=np.int32)
+        self._indices = np.empty(size, dtype=np.int64)
+
+    def _scratch(self, count):
+        """Value buffer for a batch of count values"""
+        if count > len(self._values):
+            self._grow(max(count, 2 * len(self._values)))
+        return self._values[:count]
+
+    def _slot(self, now):
+        """Counters for the slot covering now, clearing slots that expired since the last call"""
+        tick = int(now / self.slot_duration)
+        slots = len(self._slots)
+        if self._tick is None:
+            self._tick = tick
+        elif tick != self._tick:
+            for expired in range(self._tick + 1, min(tick, self._tick + slots) + 1):
+                self._slots[expired % slots] = 0
+            self._tick = tick
+        return self._slots[tick % slots]
+
+    def record(self, value, now=None):
+        """Record one value in microseconds"""
+        index = bucket_index(min(max(int(value), 0), MAX_VALUE_US))
+        self._slot(time.monotonic() if now is None else now)[index] += 1
+        self.lifetime[index] += 1
+
+    def record_many(self, values, now=None):
+        """Record an array of values in microseconds"""
+        if not len(values):
+            return
+        scratch = self._scratch(len(values))
+        scratch[:] = values
+        self._record_scratch(scratch, now)
+
+    def record_elapsed(self, stamps, until, now=None):
+        """Record until - stamp in microseconds for an array of timestamps in seconds"""
+        if not len(stamps):
+            return
+        scratch = self._scratch(len(stamps))
+        np.subtract(until, stamps, out=scratch)
+        np.multiply(scratch, 1e6, out=scratch)
+        self._record_scratch(scratch, now)
+
+    def _record_scratch(self, values, now):
+        """bucket_indices() of the values, computed in the scratch buffers, then counted"""
+        count = len(values)
+        indices = self._indices[:count]
+        shift = self._exponents[:count]
+        np.clip(values, 0, MAX_VALUE_US, out=values)
+        np.floor(values, out=values)
+        indices[:] = values
+        # frexp's exponent is the bit length for integers below 2**53
+        np.frexp(values, out=(values, shift))
+        np.subtract(shift, PRECISION_BITS, out=shift)
+        np.maximum(shift, 0, out=shift)
+        np.right_shift(indices, shift, out=indices)
+        np.left_shift(shift, PRECISION_BITS - 1, out=shift)
+        np.add(indices, shift, out=indices)
+        counts = np.bincount(indices, minlength=BUCKETS)
+        self._slot(time.monotonic() if now is None else now)[:] += counts
+        self.lifetime += counts
+
+    def counts(self, windowed=True, now=None):
+        if not windowed:
+            return self.lifetime
+        # Advance first so slots that expired while idle are not counted
+        self._slot(time.monotonic() if now is None else now)
+        return self._slots.sum(axis=0)
+
+    def count(self, windowed=True, now=None):
+        return int(self.counts(windowed, now).sum())
+
+    def span(self, now=None):
+        """Seconds of data the window currently covers"""
+        now = time.monotonic() if now is None else now
+        # The older slots plus the elapsed part of the current one
+        covered = (len(self._slots) - 1) * self.slot_duration + now % self.slot_duration
+        return min(covered, now - self.started)
+
+    def percentiles(self, percentiles=REPORT_PERCENTILES, windowed=True, now=None):
+        """Values in microseconds at the given percentiles, None when nothing was recorded"""
+        counts = self.counts(windowed, now)
+        cumulative = np.cumsum(counts)
+        total = cumulative[-1]
+        if not total:
+            return [None] * len(percentiles)
+        values = []
+        for p in percentiles:
+            index = int(np.searchsorted(cumulative, max(1, np.ceil(total * p / 100))))
+            low, width = bucket_bounds(index)
+            values.append(low + (width - 1) / 2)
+        return values
+
+
+def format_ms(values):
+    return '/'.join('-' if v is None else f"{v / 1000:.2f}" for v in values)
+
+
+class StreamStats:
+    """
+    Latency, inter-arrival and sequence accounting for one stream.
+    Latency is the receive time minus the send timestamp in each record,
+    inter-arrival the gap between receive events on the stream.
+    """
+    def __init__(self, window=DEFAULT_WINDOW, slots=DEFAULT_SLOTS):
+        self.latency = WindowedHistogram(window, slots)
+        self.interarrival = WindowedHistogram(window, slots)
+        # One tracker per channel seen on the stream
+        self.sequences = {}
+        self.received = 0
+        # Receive events, their payload bytes and how many failed to decode, counted by the server
+        self.messages = 0
+        self.bytes = 0
+        self.parse_errors = 0
+        self._last_arrival = None
+
+    def observe(self, records):
+        """Account for a batch of records received now"""
+        now = time.monotonic()
+        if self._last_arrival is not None:
+            self.interarrival.record((now - self._last_arrival) * 1e6, now)
+        self._last_arrival = now
+        self.received += len(records)
+        # Text records carry no sequence number or timestamp
+        if not len(records) or records['ts'][0] == 0:
+            return
+        self.latency.record_elapsed(records['ts'], time.time(), now)
+        seqs = records['seq']
+        for sensor, index in group_by_type(records['type']):
+            if sensor not in CHANNELS:
+                # Control records number something else than samples
+                continue
+            tracker = self.sequences.get(sensor)
+            if tracker is None:
+                tracker = self.sequences[sensor] = SequenceTracker()
+            tracker.update(seqs[index])
+
+    @property
+    def lost(self):
+        return sum(tracker.lost for tracker in self.sequences.values())
+
+    @property
+    def out_of_order(self):
+        return sum(tracker.out_of_order for tracker in self.sequences.values())
+
+    def summary(self, windowed=True):
+        """One log line of rate, latency and inter-arrival percentiles"""
+        now = time.monotonic()
+        scope = f"last {self.latency.span(now):.1f}s" if windowed else "lifetime"
+        samples = self.latency.count(windowed, now)
+        line = (f"{scope}: {samples} timed samples"
+                f" | latency p50/p99/p99.9={format_ms(self.latency.percentiles(windowed=windowed, now=now))} ms"
+                f" | inter-arrival p50/p99/p99.9={format_ms(self.interarrival.percentiles(windowed=windowed, now=now))} ms"
+                f" | lost={self.lost} out_of_order={self.out_of_order}")
+        if windowed and samples:
+            line = f"{line} | rate={samples / max(self.latency.span(now), 1e-9):.2f} samples/sec"
+        return line
@@ -0,0 +1,263 @@
+import math
+import asyncio
+import logging
+from bisect import bisect_left
+import numpy as np
+from .latency import BUCKETS, bucket_bounds
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+DEFAULT_METRICS_HOST = '127.0.0.1'
+# How often the event loop is checked for lag, in seconds
+LAG_INTERVAL = 0.1
+# Upper bounds in seconds of the latency-like histograms
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Largest request head the endpoint reads before giving up
+MAX_REQUEST = 8192
+REQUEST_TIMEOUT = 5.0
+
+# Lowest value and midpoint in microseconds of every WindowedHistogram bucket
+_LOG_LOW, _LOG_WIDTH = np.array([bucket_bounds(index) for index in range(BUCKETS)], dtype=np.float64).T
+_LOG_MID = _LOG_LOW + (_LOG_WIDTH - 1) / 2
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{escape(value)}"' for key, value in labels.items()) + '}'
+
+
+def format_value(value):
+    if isinstance(value, float):
+        if math.isinf(value):
+            return '+Inf' if value > 0 else '-Inf'
+        return repr(value)
+    return str(value)
+
+
+class MetricFamily:
+    """
+    One metric name with its labelled samples, in Prometheus text format.
+    Families are built from live state when the endpoint is scraped, so the
+    hot path only ever bumps the plain counters they are read from.
+    """
+    def __init__(self, name, kind, help):
+        self.name = name
+        self.kind = kind
+        self.help = help
+        self.samples = []
+
+    def add(self, value, **labels):
+        self.samples.append((self.name, labels, value))
+
+    def add_histogram(self, buckets, total, count, **labels):
+        """Add one histogram from (upper bound, cumulative count) pairs, its sum and its count"""
+        for bound, cumulative in buckets:
+            self.samples.append((f'{self.name}_bucket', dict(labels, le=format_value(float(bound))), cumulative))
+        self.samples.append((f'{self.name}_bucket', dict(labels, le='+Inf'), count))
+        self.samples.append((f'{self.name}_sum', labels, total))
+        self.samples.append((f'{self.name}_count', labels, count))
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        lines.extend(f'{name}{format_labels(labels)} {format_value(value)}' for name, labels, value in self.samples)
+        return lines
+
+
+class Histogram:
+    """Fixed-bucket histogram for values recorded as they happen, one list update per value"""
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def buckets(self):
+        """(upper bound, cumulative count) pairs, without the +Inf bucket"""
+        cumulative = np.cumsum(self.counts[:-1]).tolist()
+        return list(zip(self.bounds, cumulative))
+
+
+def log_histogram_buckets(counts, bounds=LATENCY_BUCKETS):
+    """
+    Fold the microsecond buckets of a WindowedHistogram into Prometheus
+    buckets in seconds. Returns (buckets, sum, count), the sum taken from
+    bucket midpoints.
+    """
+    cumulative = np.cumsum(counts)
+    # A log bucket counts towards a bound once its highest value is within it
+    highest = _LOG_LOW + _LOG_WIDTH - 1
+    indices = np.searchsorted(highest, np.asarray(bounds) * 1e6, side='right') - 1
+    buckets = [(bound, int(cumulative[i]) if i >= 0 else 0) for bound, i in zip(bounds, indices)]
+    return buckets, float(np.dot(counts, _LOG_MID)) / 1e6, int(cumulative[-1])
+
+
+class StreamMetrics:
+    """Families for the per-stream counters a StreamStats keeps, filled in one stream at a time"""
+    def __init__(self):
+        self.messages = MetricFamily('imu_stream_messages_total', 'counter', 'Receive events on the stream')
+        self.bytes = MetricFamily('imu_stream_bytes_total', 'counter', 'Payload bytes received on the stream')
+        self.samples = MetricFamily('imu_stream_samples_total', 'counter', 'Samples decoded from the stream')
+        self.lost = MetricFamily('imu_stream_samples_lost_total', 'counter', 'Samples missing from the sequence numbers')
+        self.out_of_order = MetricFamily('imu_stream_samples_out_of_order_total', 'counter', 'Samples that arrived behind a later one')
+        self.parse_errors = MetricFamily('imu_stream_parse_errors_total', 'counter', 'Payloads that failed to decode')
+        self.queue_depth = MetricFamily('imu_stream_queue_depth', 'gauge', 'Decoded batches waiting to be processed')
+        self.latency = MetricFamily('imu_stream_latency_seconds', 'histogram', 'Receive time minus the send timestamp of each sample')
+
+    def add(self, stats, queue_depth=None, **labels):
+        self.messages.add(stats.messages, **labels)
+        self.bytes.add(stats.bytes, **labels)
+        self.samples.add(stats.received, **labels)
+        self.lost.add(stats.lost, **labels)
+        self.out_of_order.add(stats.out_of_order, **labels)
+        self.parse_errors.add(stats.parse_errors, **labels)
+        if queue_depth is not None:
+            self.queue_depth.add(queue_depth, **labels)
+        self.latency.add_histogram(*log_histogram_buckets(stats.latency.lifetime), **labels)
+
+    def families(self):
+        return [self.messages, self.bytes, self.samples, self.lost, self.out_of_order,
+                self.parse_errors, self.queue_depth, self.latency]
+
+
+def track_lost_packets(quic):
+    """
+    Keep a running total of packets a QuicConnection declares lost in
+    `quic._loss.packets_lost`. aioquic only reports losses to its congestion
+    controller and qlog, so the recovery's loss hook is wrapped.
+    """
+    loss = quic._loss
+    loss.packets_lost = 0
+    on_packets_lost = loss._on_packets_lost
+
+    def count_lost(*args, packets, **kwargs):
+        loss.packets_lost += len(packets)
+        on_packets_lost(*args, packets=packets, **kwargs)
+
+    loss._on_packets_lost = count_lost
+
+
+class QuicMetrics:
+    """Families for the recovery state of QUIC connections: RTT, congestion window and losses"""
+    def __init__(self):
+        self.rtt = MetricFamily('imu_quic_rtt_seconds', 'gauge', 'Round-trip time estimates of the connection')
+        self.cwnd = MetricFamily('imu_quic_cwnd_bytes', 'gauge', 'Congestion window of the connection')
+        self.in_flight = MetricFamily('imu_quic_bytes_in_flight', 'gauge', 'Bytes sent and not yet acknowledged')
+        self.lost = MetricFamily('imu_quic_packets_lost_total', 'counter', 'Packets declared lost by loss detection')
+
+    def add(self, quic, **labels):
+        loss = quic._loss
+        if loss._rtt_initialized:
+            for kind, value in (('smoothed', loss._rtt_smoothed), ('latest', loss._rtt_latest), ('min', loss._rtt_min)):
+                self.rtt.add(value, kind=kind, **labels)
+        self.cwnd.add(loss.congestion_window, **labels)
+        self.in_flight.add(loss.bytes_in_flight, **labels)
+        self.lost.add(getattr(loss, 'packets_lost', 0), **labels)
+
+    def families(self):
+        return [self.rtt, self.cwnd, self.in_flight, self.lost]
+
+
+class LoopLagMonitor:
+    """Measures how late the event loop wakes a sleeping task, which is how long callbacks hold it up"""
+    def __init__(self, interval=LAG_INTERVAL):
+        self.interval = interval
+        self.histogram = Histogram()
+        self.last = 0.0
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            self.last = max(loop.time() - start - self.interval, 0.0)
+            self.histogram.observe(self.last)
+
+    def collect(self):
+        lag = MetricFamily('imu_event_loop_lag_seconds', 'histogram', 'Delay of the event loop in waking a timer')
+        lag.add_histogram(self.histogram.buckets(), self.histogram.sum, self.histogram.count)
+        last = MetricFamily('imu_event_loop_lag_last_seconds', 'gauge', 'Event loop delay at the last check')
+        last.add(self.last)
+        return [lag, last]
+
+
+class MetricsRegistry:
+    """Collectors called on every scrape, each returning a list of MetricFamily"""
+    def __init__(self):
+        self.collectors = []
+
+    def register(self, collector):
+        self.collectors.append(collector)
+
+    def render(self):
+        lines = []
+        for collector in self.collectors:
+            try:
+                for family in collector():
+                    if family.samples:
+                        lines.extend(family.render())
+            except Exception as e:
+                logging.error(f"Metrics collector {collector!r} failed: {e}")
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsServer:
+    """
+    Minimal HTTP endpoint serving the registry at /metrics in Prometheus
+    text format, on the server's own event loop. Rendering only happens
+    when scraped, so it costs nothing between scrapes.
+    """
+    def __init__(self, host=DEFAULT_METRICS_HOST, port=9100):
+        self.host = host
+        self.port = port
+        self.registry = MetricsRegistry()
+        self.lag = LoopLagMonitor()
+        self.registry.register(self.lag.collect)
+        self._server = None
+        self._lag_task = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port, limit=MAX_REQUEST)
+        self._lag_task = asyncio.create_task(self.lag.run())
+        logging.info(f"Metrics at http://{self.host}:{self.port}/metrics")
+
+    async def _handle(self, reader, writer):
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), REQUEST_TIMEOUT)
+            method, path, _ = head.split(b'\r\n', 1)[0].decode('latin-1').split(' ', 2)
+            if method not in ('GET', 'HEAD'):
+                status, body = '405 Method Not Allowed', b''
+            elif path.split('?', 1)[0] in ('/', '/metrics'):
+                status, body = '200 OK', self.registry.render().encode()
+            else:
+                status, body = '404 Not Found', b''
+            writer.write(f'HTTP/1.1 {status}\r\nContent-Type: {CONTENT_TYPE}\r\n'
+                         f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode('latin-1'))
+            if method != 'HEAD':
+                writer.write(body)
+            await writer.drain()
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def close(self):
+        if self._lag_task:
+            self._lag_task.cancel()
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+
+
+def add_metrics_arguments(parser):
+    """Add the metrics endpoint options shared by the server CLIs"""
+    parser.add_argument('--metrics-port', type=int, default=None, help='Serve Prometheus metrics over HTTP on this port')
+    parser.add_argument('--metrics-host', type=str, default=DEFAULT_METRICS_HOST, help='Address the metrics endpoint binds to')
@@ -0,0 +1,128 @@
+import socket
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+from aioquic.asyncio.protocol import QuicConnectionProtocol
+from aioquic.quic.configuration import QuicConfiguration
+from aioquic.quic.connection import QuicConnection, QuicTokenHandler
+from .quic_priority import PriorityManager
+
+
+class PrioritizedQuicConnection(QuicConnection):
+    """
+    QuicConnection that applies stream weights when packets are assembled.
+
+    aioquic serves streams round robin from `_streams_queue`, one packet at a
+    time, so every stream with data gets an equal share of the congestion
+    window. Here that queue is re-sorted before each packet by the start tag
+    of a PriorityManager, and every STREAM frame written is charged to its
+    stream in bytes. Streams without a weight sort as if they had just become
+    backlogged.
+    """
+    def __init__(self, *args, **kwargs):
+        self.scheduler = PriorityManager()
+        self._service_order = []
+        super().__init__(*args, **kwargs)
+
+    @property
+    def _streams_queue(self):
+        # aioquic reads this once per packet, so this is where each packet's service order is decided
+        scheduler = self.scheduler
+        for stream in self._service_order:
+            if stream.stream_id not in scheduler:
+                continue
+            if stream.sender.buffer_is_empty:
+                scheduler.deactivate(stream.stream_id)
+            else:
+                scheduler.activate(stream.stream_id)
+        self._service_order.sort(key=lambda stream: scheduler.start_tag(stream.stream_id))
+        return self._service_order
+
+    @_streams_queue.setter
+    def _streams_queue(self, streams):
+        self._service_order = streams
+
+    def set_stream_weight(self, stream_id: int, weight: int):
+        """Weight a stream's share of the bandwidth, relative to the other weighted streams"""
+        if stream_id in self.scheduler:
+            self.scheduler.set_weight(stream_id, weight)
+        else:
+            self.scheduler.add_stream(stream_id, weight)
+
+    def _write_stream_frame(self, builder, space, stream, max_offset):
+        before = builder.remaining_flight_space
+        used = super()._write_stream_frame(builder, space, stream, max_offset)
+        written = before - builder.remaining_flight_space
+        if written > 0 and stream.stream_id in self.scheduler:
+            self.scheduler.update_after_send(stream.stream_id, written, backlogged=not stream.sender.buffer_is_empty)
+        return used
+
+    def send_buffer_occupancy(self) -> Dict[int, Dict[str, int]]:
+        """
+        Per stream, bytes written by the application but not sent yet
+        (`unsent`, including data queued for retransmission) and bytes
+        not acknowledged by the peer yet (`unacked`)
+        """
+        occupancy = {}
+        for stream_id, stream in self._streams.items():
+            sender = stream.sender
+            occupancy[stream_id] = dict(
+                unsent=sum(r.stop - r.start for r in sender._pending),
+                unacked=sender._buffer_stop - sender._buffer_start,
+            )
+        return occupancy
+
+
+@asynccontextmanager
+async def connect_prioritized(
+    host: str,
+    port: int,
+    *,
+    configuration: Optional[QuicConfiguration] = None,
+    create_protocol=QuicConnectionProtocol,
+    stream_handler=None,
+    session_ticket_handler=None,
+    token_handler: Optional[QuicTokenHandler] = None,
+    local_port: int = 0,
+    wait_connected: bool = True,
+):
+    """
+    aioquic's connect(), but the connection is a PrioritizedQuicConnection.
+    aioquic builds the QuicConnection inside connect() with no hook to swap the class.
+    """
+    # Copied from aioquic 1.2.0 aioquic/asyncio/client.py connect(), recheck it when upgrading aioquic
+    loop = asyncio.get_running_loop()
+
+    infos = await loop.getaddrinfo(host, port, type=socket.SOCK_DGRAM)
+    addr = infos[0][4]
+    if len(addr) == 2:
+        addr = ("::ffff:" + addr[0], addr[1], 0, 0)
+
+    if configuration is None:
+        configuration = QuicConfiguration(is_client=True)
+    if configuration.server_name is None:
+        configuration.server_name = host
+    connection = PrioritizedQuicConnection(configuration=configuration, session_ticket_handler=session_ticket_handler,
+                                           token_handler=token_handler)
+
+    # Dual stack socket, like aioquic
+    sock = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM)
+    try:
+        sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, 0)
+        sock.bind(("::", local_port, 0, 0))
+    except Exception:
+        sock.close()
+        raise
+    transport, protocol = await loop.create_datagram_endpoint(
+        lambda: create_protocol(connection, stream_handler=stream_handler),
+        sock=sock,
+    )
+    try:
+        protocol.connect(addr, transmit=wait_connected)
+        if wait_connected:
+            await protocol.wait_connected()
+        yield protocol
+    finally:
+        protocol.close()
+        await protocol.wait_closed()
+        transport.close()
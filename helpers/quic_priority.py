@@ -1,59 +1,171 @@
 from dataclasses import dataclass
-from typing import Optional, Dict
+from typing import Optional, Dict, Iterable
+import heapq
+import itertools
 import time
 
+# Stale heap entries tolerated before the heap is rebuilt
+HEAP_SLACK = 64
+
 @dataclass
 class StreamPriority:
     """
     Pure application-level stream priority implementation
     """
     weight: int = 256          # Relative priority weight (higher = more important)
-    last_sent: float = 0       # Timestamp of last send
-    no_of_sends: int = 0        # Total bytes sent
+    last_sent: float = 0       # Monotonic timestamp of last send
+    no_of_sends: int = 0       # Total messages sent
+    bytes_sent: int = 0        # Total bytes sent
+    start_tag: float = 0.0     # Virtual time the stream's next message starts at
+    finish_tag: float = 0.0    # Virtual time its last message finished at
+    active: bool = False       # Whether the stream is backlogged (in the heap)
+    entry: int = -1            # Order of the stream's live heap entry, older entries are stale
     dependent_on: Optional[int] = None  # Not used in basic implementation
     exclusive: bool = False    # Not used in basic implementation
 
 class PriorityManager:
     """
-    Manages stream priorities with application-level scheduling
+    Manages stream priorities with start-time fair queueing (SFQ).
+    Every backlogged stream sits in a heap keyed by the virtual start tag
+    of its next message. The stream with the smallest tag sends next, and
+    sending n bytes moves its tag forward by n / weight. Over time each
+    backlogged stream gets a byte share proportional to its weight.
+    Picking the next stream and accounting a send are O(log n).
     """
     def __init__(self):
         self._streams: Dict[int, StreamPriority] = {}
-        
+        self._heap = []
+        self._active = set()
+        self._order = itertools.count()
+        # Virtual time, the start tag of the message last picked
+        self.virtual_time = 0.0
+
+    def __len__(self):
+        return len(self._streams)
+
+    def __contains__(self, stream_id: int) -> bool:
+        return stream_id in self._streams
+
     def add_stream(self, stream_id: int, weight: int = 256):
         """Register a new stream with priority weight"""
-        self._streams[stream_id] = StreamPriority(weight=weight)
-        
-    def update_after_send(self, stream_id: int):
-        """Update tracking after data is sent"""
-        if stream_id in self._streams:
-            self._streams[stream_id].last_sent = time.time()
-            self._streams[stream_id].no_of_sends += 1
-            #print(f"Stream {stream_id} total sent: {self._streams[stream_id].bytes_sent}")
-            
-    def get_next_stream(self, ready_streams: list[int]) -> Optional[int]:
+        if weight <= 0:
+            raise ValueError(f"Stream weight must be positive, got {weight}")
+        self._streams[stream_id] = StreamPriority(weight=weight, finish_tag=self.virtual_time)
+
+    def remove_stream(self, stream_id: int):
+        """Forget a stream, its heap entry is dropped lazily"""
+        self._streams.pop(stream_id, None)
+        self._active.discard(stream_id)
+
+    def set_weight(self, stream_id: int, weight: int):
+        """Change a stream's weight, applies from its next send"""
+        if weight <= 0:
+            raise ValueError(f"Stream weight must be positive, got {weight}")
+        self._streams[stream_id].weight = weight
+
+    def _push(self, stream_id: int, priority: StreamPriority):
+        priority.entry = next(self._order)
+        heapq.heappush(self._heap, (priority.start_tag, priority.entry, stream_id))
+        if len(self._heap) > 2 * len(self._active) + HEAP_SLACK:
+            # Streams flapping between idle and backlogged leave stale entries behind
+            self._heap = [item for item in self._heap if self._live(item)]
+            heapq.heapify(self._heap)
+
+    def _live(self, item) -> bool:
+        _, entry, stream_id = item
+        priority = self._streams.get(stream_id)
+        return priority is not None and priority.active and priority.entry == entry
+
+    def activate(self, stream_id: int):
+        """Mark a stream backlogged, it competes for sends until deactivated"""
+        priority = self._streams[stream_id]
+        if priority.active:
+            return
+        priority.active = True
+        self._active.add(stream_id)
+        # A stream returning from idle starts now, it gets no credit for the time it had nothing to send
+        priority.start_tag = max(self.virtual_time, priority.finish_tag)
+        self._push(stream_id, priority)
+
+    def deactivate(self, stream_id: int):
+        """Mark a stream idle, its heap entry is dropped lazily"""
+        priority = self._streams.get(stream_id)
+        if priority is not None:
+            priority.active = False
+        self._active.discard(stream_id)
+
+    def _top(self) -> Optional[int]:
+        """Backlogged stream with the smallest start tag, discarding stale heap entries"""
+        heap = self._heap
+        while heap:
+            if self._live(heap[0]):
+                return heap[0][2]
+            heapq.heappop(heap)
+        return None
+
+    def start_tag(self, stream_id: int) -> float:
+        """Virtual time a stream's next message would start at, lower sends sooner"""
+        priority = self._streams.get(stream_id)
+        if priority is None:
+            return self.virtual_time
+        if priority.active:
+            return priority.start_tag
+        return max(self.virtual_time, priority.finish_tag)
+
+    def next_stream(self) -> Optional[int]:
+        """Stream that should send next among the backlogged ones"""
+        return self._top()
+
+    def update_after_send(self, stream_id: int, nbytes: int = 1, backlogged: bool = True):
         """
-        Determine which stream should send next using Weighted Fair Queueing (WFQ)
+        Account nbytes sent on stream_id. The stream stays in the running
+        unless backlogged is False.
         """
-        t = time.time()
-        if not ready_streams:
+        priority = self._streams.get(stream_id)
+        if priority is None:
+            return
+        if priority.active and self._top() == stream_id:
+            heapq.heappop(self._heap)
+        elif not priority.active:
+            # Sent while idle, charge it as if it had just become backlogged
+            priority.start_tag = max(self.virtual_time, priority.finish_tag)
+        self.virtual_time = max(self.virtual_time, priority.start_tag)
+        priority.finish_tag = priority.start_tag + nbytes / priority.weight
+        priority.last_sent = time.monotonic()
+        priority.no_of_sends += 1
+        priority.bytes_sent += nbytes
+        priority.active = backlogged
+        if backlogged:
+            self._active.add(stream_id)
+            priority.start_tag = priority.finish_tag
+            self._push(stream_id, priority)
+        else:
+            self._active.discard(stream_id)
+
+    def get_next_stream(self, ready_streams: Iterable[int]) -> Optional[int]:
+        """
+        Determine which of ready_streams should send next.
+        Streams missing from ready_streams are treated as idle, so this costs
+        O(k log n) for k streams; callers that track readiness themselves can
+        use activate()/deactivate() and next_stream() instead.
+        """
+        ready = set(ready_streams)
+        if not ready:
             return None
-            
-        # Calculate which stream is most "behind" its fair share
-        min_score = float('inf')
-        selected_stream = ready_streams[0]
-        current_time = time.time()
-        for stream_id in ready_streams:
-            if stream_id not in self._streams:
-                continue
-                
-            priority = self._streams[stream_id]
-            # Calculate how much this stream "deserves" to have sent
-            deserved_sends = priority.weight * (current_time - priority.last_sent)
-            # Score is actual bytes sent minus deserved bytes (lower is better)
-            score = priority.no_of_sends - deserved_sends
-            
-            if score < min_score:
-                min_score = score
-                selected_stream = stream_id
-        return selected_stream
\ No newline at end of file
+        for stream_id in self._active - ready:
+            self.deactivate(stream_id)
+        for stream_id in ready:
+            if stream_id in self._streams:
+                self.activate(stream_id)
+        selected = self._top()
+        if selected is None:
+            # None of the ready streams are registered
+            return next(iter(ready))
+        return selected
+
+    def shares(self) -> Dict[int, float]:
+        """Fraction of all bytes sent that went to each stream"""
+        total = sum(priority.bytes_sent for priority in self._streams.values())
+        if not total:
+            return {stream_id: 0.0 for stream_id in self._streams}
+        return {stream_id: priority.bytes_sent / total for stream_id, priority in self._streams.items()}
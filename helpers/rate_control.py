@@ -0,0 +1,169 @@
+import time
+from dataclasses import dataclass
+import numpy as np
+from .channels import CHANNELS
+from .codec import SENSOR_ACCEL, SENSOR_GYRO, RATE_FULL, RATE_DECIMATE, RATE_AVERAGE
+
+# A channel counts as congested when any of these is exceeded
+QUEUE_HIGH = 0.5            # Fraction of a sample ring in use
+WAIT_HIGH = 0.05            # Seconds the oldest buffered sample has waited to be popped
+RTT_INFLATION = 2.0         # Smoothed RTT over the minimum RTT seen...
+RTT_SLACK = 0.02            # ...plus this many seconds, so jitter on a fast link does not count
+CWND_FULL = 0.9             # Bytes in flight over the congestion window
+# Step down at most once per DEGRADE_INTERVAL, step back up after RECOVER_HOLD quiet seconds
+DEGRADE_INTERVAL = 0.5
+RECOVER_HOLD = 5.0
+# How often input rates are measured and the effective rates re-announced
+RATE_INTERVAL = 1.0
+ANNOUNCE_INTERVAL = 5.0
+
+
+@dataclass
+class ChannelPolicy:
+    """
+    Output steps a channel walks through as congestion rises, as (mode, factor).
+    Level 0 uses the first step, higher levels the later ones, and the last step
+    holds for any level beyond it.
+    """
+    steps: tuple = ((RATE_FULL, 1), (RATE_DECIMATE, 2), (RATE_AVERAGE, 4))
+
+    def step(self, level):
+        return self.steps[min(level, len(self.steps) - 1)]
+
+
+# Accel keeps full rate one level longer than the lower priority gyro
+DEFAULT_POLICIES = {
+    SENSOR_ACCEL: ChannelPolicy(((RATE_FULL, 1), (RATE_FULL, 1), (RATE_AVERAGE, 2), (RATE_AVERAGE, 4), (RATE_AVERAGE, 8))),
+    SENSOR_GYRO: ChannelPolicy(((RATE_FULL, 1), (RATE_AVERAGE, 2), (RATE_AVERAGE, 4), (RATE_AVERAGE, 8), (RATE_DECIMATE, 16))),
+}
+
+
+class ChannelReducer:
+    """
+    Thins an (N, dim) sample stream by a factor, keeping the first sample of
+    every window (decimate) or the window's mean (average). Partial windows
+    carry over to the next batch.
+    """
+    def __init__(self, dim=3):
+        self.dim = dim
+        self.mode = RATE_FULL
+        self.factor = 1
+        self._carry = np.zeros((0, dim), dtype=np.float32)
+        self.received = 0
+
+    def set_step(self, mode, factor):
+        if (mode, factor) == (self.mode, self.factor):
+            return
+        self.mode = RATE_FULL if factor == 1 else mode
+        self.factor = factor
+        # A window started under the old step is dropped rather than mixed into the new one
+        self._carry = self._carry[:0]
+
+    def reduce(self, rows):
+        rows = np.asarray(rows, dtype=np.float32).reshape(-1, self.dim)
+        self.received += len(rows)
+        if self.factor == 1:
+            return rows
+        if len(self._carry):
+            rows = np.concatenate((self._carry, rows))
+        whole = len(rows) - len(rows) % self.factor
+        self._carry = rows[whole:].copy()
+        if self.mode == RATE_DECIMATE:
+            return rows[:whole:self.factor]
+        return rows[:whole].reshape(-1, self.factor, self.dim).mean(axis=1)
+
+
+class RateController:
+    """
+    Picks a congestion level from the client's sample rings and the QUIC connection
+    state and reduces each channel according to its policy at that level.
+    Degrades quickly and recovers only after a quiet period, so the rate
+    does not oscillate on a marginal link.
+    """
+    def __init__(self, policies=None):
+        self.policies = policies or DEFAULT_POLICIES
+        self.reducers = {sensor: ChannelReducer(CHANNELS[sensor].dim) for sensor in self.policies}
+        self.max_level = max(len(policy.steps) for policy in self.policies.values()) - 1
+        self.level = 0
+        self.rings = []
+        self.quic = None
+        self.reasons = []
+        self.input_rates = {sensor: 0.0 for sensor in self.policies}
+        self._last_change = 0.0
+        self._last_congested = 0.0
+        self._rate_at = time.monotonic()
+        self._rate_counts = {sensor: 0 for sensor in self.policies}
+        # Servers assume full rate until told otherwise
+        self._announced = {sensor: (RATE_FULL, 1) for sensor in self.policies}
+        self._announced_at = time.monotonic()
+
+    def attach(self, rings, quic=None):
+        """Watch these sample rings and, for QUIC clients, the connection's loss recovery state"""
+        self.rings = list(rings)
+        self.quic = quic
+
+    def congestion(self):
+        """Reasons the client currently counts as congested, empty when it is not"""
+        reasons = []
+        if any(len(ring) >= QUEUE_HIGH * ring.capacity for ring in self.rings):
+            reasons.append('queue')
+        if any(ring.waited() >= WAIT_HIGH for ring in self.rings):
+            reasons.append('wait')
+        if self.quic is not None:
+            loss = self.quic._loss
+            if loss._rtt_initialized and loss._rtt_smoothed > RTT_INFLATION * loss._rtt_min + RTT_SLACK:
+                reasons.append('rtt')
+            if loss.bytes_in_flight >= CWND_FULL * loss.congestion_window:
+                reasons.append('cwnd')
+        return reasons
+
+    def update(self, now=None):
+        """Re-evaluate the congestion level, call once per send loop iteration before draining"""
+        now = time.monotonic() if now is None else now
+        self.reasons = self.congestion()
+        level = self.level
+        if self.reasons:
+            self._last_congested = now
+            if now - self._last_change >= DEGRADE_INTERVAL:
+                level = min(self.level + 1, self.max_level)
+        elif self.level and now - max(self._last_change, self._last_congested) >= RECOVER_HOLD:
+            level = self.level - 1
+        if level != self.level:
+            self.level = level
+            self._last_change = now
+        for sensor, reducer in self.reducers.items():
+            reducer.set_step(*self.policies[sensor].step(self.level))
+
+        elapsed = now - self._rate_at
+        if elapsed >= RATE_INTERVAL:
+            for sensor, reducer in self.reducers.items():
+                self.input_rates[sensor] = (reducer.received - self._rate_counts[sensor]) / elapsed
+                self._rate_counts[sensor] = reducer.received
+            self._rate_at = now
+
+    def reduce(self, sensor, rows):
+        reducer = self.reducers.get(sensor)
+        return rows if reducer is None else reducer.reduce(rows)
+
+    def effective_rate(self, sensor):
+        """Samples per second the channel is sending at its current step"""
+        return self.input_rates[sensor] / self.reducers[sensor].factor
+
+    def announcements(self, encoder, now=None):
+        """
+        Encoded rate announcements to send, as (sensor, bytes): for every channel
+        whose step changed, and for all of them every ANNOUNCE_INTERVAL
+        """
+        now = time.monotonic() if now is None else now
+        periodic = now - self._announced_at >= ANNOUNCE_INTERVAL
+        if periodic:
+            self._announced_at = now
+        messages = []
+        for sensor, reducer in self.reducers.items():
+            step = (reducer.mode, reducer.factor)
+            if periodic or self._announced.get(sensor) != step:
+                self._announced[sensor] = step
+                msg = encoder.encode_rate(sensor, self.effective_rate(sensor), reducer.factor, reducer.mode)
+                if msg:
+                    messages.append((sensor, msg))
+        return messages
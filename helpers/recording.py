@@ -0,0 +1,286 @@
+import os
+import re
+import mmap
+import time
+import struct
+import logging
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from .codec import RECORD, RECORD_DTYPE
+
+# magic, version, record size, record count, first timestamp, last timestamp
+HEADER = struct.Struct('<8sIIQdd')
+HEADER_SIZE = 64
+MAGIC = b'IMULOG01'
+VERSION = 1
+
+# 1M records (25 MB) per segment, one index entry every 1024 records
+DEFAULT_SEGMENT_RECORDS = 1 << 20
+DEFAULT_INDEX_EVERY = 1024
+INDEX_DTYPE = np.dtype([('ts', '<f8'), ('rec', '<u8')])
+
+# When to force mapped pages to disk
+FSYNC_NONE = 'none'             # Leave it to the OS
+FSYNC_INTERVAL = 'interval'     # At most every fsync_interval seconds
+FSYNC_ALWAYS = 'always'         # After every appended batch
+FSYNC_POLICIES = (FSYNC_NONE, FSYNC_INTERVAL, FSYNC_ALWAYS)
+
+# Device names become directory names, so they are kept to a safe alphabet
+DEVICE_NAME = re.compile(r'[A-Za-z0-9_.-]{1,64}')
+
+
+class Segment:
+    """One preallocated, memory-mapped file of fixed-size records"""
+    def __init__(self, path, capacity=None, readonly=False):
+        self.path = path
+        if capacity is not None and not os.path.exists(path):
+            with open(path, 'wb') as f:
+                f.truncate(HEADER_SIZE + capacity * RECORD.size)
+                f.write(HEADER.pack(MAGIC, VERSION, RECORD.size, 0, 0.0, 0.0))
+        self._file = open(path, 'rb' if readonly else 'r+b')
+        access = mmap.ACCESS_READ if readonly else mmap.ACCESS_WRITE
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=access)
+        magic, version, record_size, self.count, self.first_ts, self.last_ts = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or record_size != RECORD.size:
+            self.close()
+            raise ValueError(f"Not a recording segment: {path}")
+        self.capacity = (len(self._mmap) - HEADER_SIZE) // RECORD.size
+        self.records = np.ndarray(self.capacity, dtype=RECORD_DTYPE, buffer=self._mmap, offset=HEADER_SIZE)
+
+    @property
+    def full(self):
+        return self.count >= self.capacity
+
+    def append(self, records):
+        """Copy as many records as fit into the mapped file, return how many were written"""
+        n = min(len(records), self.capacity - self.count)
+        if not n:
+            return 0
+        self.records[self.count:self.count + n] = records[:n]
+        if not self.count:
+            self.first_ts = float(records['ts'][0])
+        self.last_ts = float(records['ts'][n - 1])
+        self.count += n
+        HEADER.pack_into(self._mmap, 0, MAGIC, VERSION, RECORD.size, self.count, self.first_ts, self.last_ts)
+        return n
+
+    def flush(self):
+        self._mmap.flush()
+
+    def close(self):
+        # The array exports the map's buffer, drop it before unmapping
+        self.records = None
+        self._mmap.close()
+        self._file.close()
+
+
+class SegmentLog:
+    """
+    Append-only recording of one device/channel as a directory of segments.
+    Segments are named after the number of their first record and each has a
+    sparse .idx file of (timestamp, record number) every index_every records,
+    so range reads only scan the blocks at the edges of the range.
+
+    Given a single-threaded `executor`, msync, fsync and closing retired
+    segments run on it, so appending only copies records into the map. Its
+    tasks run in order, so a segment is synced before it is closed.
+    """
+    def __init__(self, directory, segment_records=DEFAULT_SEGMENT_RECORDS, fsync=FSYNC_INTERVAL,
+                 fsync_interval=1.0, index_every=DEFAULT_INDEX_EVERY, executor=None):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy: {fsync}")
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.segment_records = segment_records
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.index_every = index_every
+        self.executor = executor
+        self._sync_future = None
+        self._last_sync = time.monotonic()
+        self.segments = sorted(name[:-4] for name in os.listdir(directory) if name.endswith('.seg'))
+        self._active = None
+        self._index_file = None
+        if self.segments:
+            self._open_active(self.segments[-1])
+        else:
+            self._rotate()
+
+    def _path(self, name, ext):
+        return os.path.join(self.directory, name + ext)
+
+    def _open_active(self, name):
+        self._active = Segment(self._path(name, '.seg'), self.segment_records)
+        self._active_name = name
+        self._index_file = open(self._path(name, '.idx'), 'ab')
+        self.total = int(name) + self._active.count
+
+    def _rotate(self):
+        """Close the active segment and start a new one"""
+        first = 0
+        if self._active is not None:
+            first = self.total
+            self._close_active()
+        name = f"{first:020d}"
+        self.segments.append(name)
+        self._open_active(name)
+
+    def _close_active(self):
+        self._index_file.flush()
+        self._run(close_files, self._active, self._index_file)
+        self._active = None
+        self._index_file = None
+
+    def _run(self, function, *args):
+        if self.executor is None:
+            function(*args)
+            return None
+        future = self.executor.submit(function, *args)
+        future.add_done_callback(log_failure)
+        return future
+
+    def _index(self, start, records):
+        """Append index entries for records that land on an index stride"""
+        first = -start % self.index_every
+        if first >= len(records):
+            return
+        entries = np.empty(len(range(first, len(records), self.index_every)), dtype=INDEX_DTYPE)
+        entries['ts'] = records['ts'][first::self.index_every]
+        entries['rec'] = np.arange(start + first, start + len(records), self.index_every)
+        self._index_file.write(entries.tobytes())
+
+    def append(self, records):
+        """Append a batch of records (RECORD_DTYPE), rotating segments as they fill"""
+        while len(records):
+            start = self._active.count
+            written = self._active.append(records)
+            self._index(start, records[:written])
+            self.total += written
+            records = records[written:]
+            if self._active.full:
+                self._rotate()
+        self._maybe_sync()
+
+    def _maybe_sync(self):
+        if self.fsync == FSYNC_NONE:
+            return
+        now = time.monotonic()
+        if self.fsync == FSYNC_ALWAYS or now - self._last_sync >= self.fsync_interval:
+            self.sync()
+            self._last_sync = now
+
+    def sync(self):
+        """Force the active segment and its index to disk, on the executor if there is one"""
+        self._index_file.flush()
+        pending = self._sync_future
+        if pending is not None and not pending.running() and not pending.done():
+            # A sync still waiting to start will cover this batch too
+            return
+        self._sync_future = self._run(sync_files, self._active, self._index_file.fileno())
+
+    def _read_segment(self, segment, name, t0, t1):
+        if not segment.count or segment.last_ts < t0 or segment.first_ts >= t1:
+            return None
+        path = self._path(name, '.idx')
+        index = np.fromfile(path, dtype=INDEX_DTYPE) if os.path.exists(path) else np.zeros(0, INDEX_DTYPE)
+        # Narrow down to the index blocks around t0 and t1, then search within them
+        i = np.searchsorted(index['ts'], t0, side='right') - 1
+        j = np.searchsorted(index['ts'], t1, side='left')
+        start = int(index['rec'][i]) if i >= 0 else 0
+        stop = int(index['rec'][j]) if j < len(index) else segment.count
+        window = segment.records[start:stop]
+        ts = window['ts']
+        return window[np.searchsorted(ts, t0, side='left'):np.searchsorted(ts, t1, side='left')].copy()
+
+    def read_range(self, t0, t1):
+        """Copy out every recorded sample with t0 <= ts < t1"""
+        if self._index_file is not None:
+            self._index_file.flush()
+        out = []
+        for name in self.segments:
+            if name == self._active_name:
+                chunk = self._read_segment(self._active, name, t0, t1)
+            else:
+                segment = Segment(self._path(name, '.seg'), readonly=True)
+                try:
+                    chunk = self._read_segment(segment, name, t0, t1)
+                finally:
+                    segment.close()
+            if chunk is not None and len(chunk):
+                out.append(chunk)
+        if not out:
+            return np.zeros(0, dtype=RECORD_DTYPE)
+        return np.concatenate(out)
+
+    def close(self):
+        if self._active is not None:
+            self._close_active()
+
+
+def device_name(options, peer):
+    """
+    Name a client's recording and metrics after the `device` its stream
+    headers announce, else its reliable session, so reconnects and new
+    source ports keep writing to the same logs. Clients that announce
+    neither are named after their address.
+    """
+    for key in ('device', 'session'):
+        name = options.get(key)
+        if name is None:
+            continue
+        if not DEVICE_NAME.fullmatch(name) or name in ('.', '..'):
+            raise ValueError(f"Invalid {key} name: {name!r}")
+        return name
+    return peer
+
+
+def sync_files(segment, index_fd):
+    segment.flush()
+    os.fsync(index_fd)
+
+
+def close_files(segment, index_file):
+    segment.flush()
+    segment.close()
+    index_file.close()
+
+
+def log_failure(future):
+    if not future.cancelled() and future.exception() is not None:
+        logging.error(f"Recording sync failed: {future.exception()}")
+
+
+class Recorder:
+    """
+    Hands out one SegmentLog per (device, channel) under a root directory.
+    The logs share one background thread for syncing and closing segments,
+    so disk flushes never hold up the caller's event loop.
+    """
+    def __init__(self, root, **log_options):
+        self.root = root
+        self.log_options = log_options
+        self.logs = {}
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='recorder')
+
+    def log(self, device, channel):
+        key = (device, channel)
+        log = self.logs.get(key)
+        if log is None:
+            log = self.logs[key] = SegmentLog(os.path.join(self.root, device, str(channel)), executor=self.executor,
+                                              **self.log_options)
+        return log
+
+    def append(self, device, channel, records):
+        self.log(device, channel).append(records)
+
+    def close_device(self, device):
+        """Close every log of a device, e.g. when its connection ends"""
+        for key in [key for key in self.logs if key[0] == device]:
+            self.logs.pop(key).close()
+
+    def close(self):
+        for log in self.logs.values():
+            log.close()
+        self.logs.clear()
+        # Let the queued syncs and closes finish before the process exits
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,187 @@
+import time
+import asyncio
+import threading
+import numpy as np
+
+# What push() does with rows that do not fit
+DROP_OLDEST = 'drop-oldest'     # Overwrite the oldest unread rows, the consumer skips them
+DROP_NEWEST = 'drop-newest'     # Discard the rows being pushed
+BLOCK = 'block'                 # Wait for the consumer to make room
+OVERFLOW_POLICIES = (DROP_OLDEST, DROP_NEWEST, BLOCK)
+
+# Rows of (ax, ay, az, gx, gy, gz)
+SAMPLE_WIDTH = 6
+DEFAULT_CAPACITY = 1024
+
+
+class SampleRing:
+    """
+    Preallocated single-producer/single-consumer ring of float32 sample rows
+    between the serial reader thread and the sender.
+
+    Neither side takes a lock. Positions are row counters that only grow: the
+    producer owns `_tail` and `_reserved`, the consumer owns `_head`, and each
+    only reads the other's. Under DROP_OLDEST the producer never waits. It
+    raises `_reserved` before overwriting rows, so the consumer can tell which
+    of the rows it just copied were replaced mid-copy and discard them.
+    """
+    def __init__(self, capacity=DEFAULT_CAPACITY, overflow=DROP_OLDEST, width=SAMPLE_WIDTH, notify=None):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow}")
+        if capacity <= 0:
+            raise ValueError(f"Ring capacity must be positive, got {capacity}")
+        self.capacity = capacity
+        self.overflow = overflow
+        self.width = width
+        self._rows = np.zeros((capacity, width), dtype=np.float32)
+        self._notify = notify
+        self._head = 0
+        self._tail = 0
+        self._reserved = 0
+        self._space = threading.Event()
+        # (loop, asyncio.Event) of a producer on an event loop waiting for room under BLOCK
+        self._space_waiter = None
+        self._nonempty_since = 0.0
+        # Overflow counters, in rows except blocked which counts pushes that had to wait
+        self.pushed = 0
+        self.dropped_newest = 0
+        self.blocked = 0
+        # Rows dropped as oldest, counted apart by the side that drops them so neither writes the other's counter
+        self._truncated = 0     # producer, rows of a push longer than the ring
+        self._overwritten = 0   # consumer, rows the producer overwrote before they were read
+
+    def __len__(self):
+        return min(self._tail - self._head, self.capacity)
+
+    @property
+    def dropped_oldest(self):
+        return self._truncated + self._overwritten
+
+    def empty(self):
+        return self._tail == self._head
+
+    def waited(self):
+        """Seconds since the ring last went from empty to holding rows, 0 when empty"""
+        if self.empty():
+            return 0.0
+        return time.monotonic() - self._nonempty_since
+
+    def push_row(self, row):
+        """Producer side: append one row, anything NumPy can convert to float32 (numbers or numeric strings)"""
+        tail = self._tail
+        if tail - self._head >= self.capacity:
+            if self.overflow == DROP_NEWEST:
+                self.dropped_newest += 1
+                return
+            if self.overflow == BLOCK:
+                self._wait_for_space(1)
+        self._reserved = tail + 1
+        self._rows[tail % self.capacity] = row
+        if tail == self._head:
+            self._nonempty_since = time.monotonic()
+        self._tail = tail + 1
+        self.pushed += 1
+        if self._notify:
+            self._notify()
+
+    def push(self, rows):
+        """Producer side: append an (N, width) block and wake the consumer"""
+        rows = np.asarray(rows, dtype=np.float32).reshape(-1, self.width)
+        capacity = self.capacity
+        if self.overflow == DROP_NEWEST:
+            free = capacity - (self._tail - self._head)
+            if len(rows) > free:
+                self.dropped_newest += len(rows) - free
+                rows = rows[:free]
+        elif self.overflow == BLOCK:
+            for start in range(0, len(rows), capacity):
+                self._wait_for_space(len(rows[start:start + capacity]))
+                self._write(rows[start:start + capacity])
+            return
+        elif len(rows) > capacity:
+            # Only the newest capacity rows would survive the write anyway
+            self._truncated += len(rows) - capacity
+            rows = rows[-capacity:]
+        self._write(rows)
+
+    def _wait_for_space(self, count):
+        if self.capacity - (self._tail - self._head) >= count:
+            return
+        self.blocked += 1
+        while self.capacity - (self._tail - self._head) < count:
+            self._space.clear()
+            # Re-check so a pop between the first check and clear() is not missed
+            if self.capacity - (self._tail - self._head) >= count:
+                break
+            self._space.wait()
+
+    async def wait_for_space_async(self):
+        """Producer side on an event loop: wait until pop() leaves room for a row, without blocking the loop"""
+        if self._tail - self._head < self.capacity:
+            return
+        self.blocked += 1
+        event = asyncio.Event()
+        self._space_waiter = (asyncio.get_running_loop(), event)
+        try:
+            # Checked after registering, so a pop in between still wakes us
+            while self._tail - self._head >= self.capacity:
+                await event.wait()
+                event.clear()
+        finally:
+            self._space_waiter = None
+
+    def _write(self, rows):
+        count = len(rows)
+        if not count:
+            return
+        tail = self._tail
+        was_empty = tail == self._head
+        self._reserved = tail + count
+        start = tail % self.capacity
+        first = min(count, self.capacity - start)
+        self._rows[start:start + first] = rows[:first]
+        if first < count:
+            self._rows[:count - first] = rows[first:]
+        if was_empty:
+            self._nonempty_since = time.monotonic()
+        # Publishing the new tail is what hands the rows to the consumer
+        self._tail = tail + count
+        self.pushed += count
+        if self._notify:
+            self._notify()
+
+    def pop(self, max_rows=None):
+        """Consumer side: copy out and remove up to max_rows of the oldest rows as one (N, width) array"""
+        capacity = self.capacity
+        head = self._head
+        tail = self._tail
+        if tail - head > capacity:
+            # The producer lapped the consumer, the overwritten rows are gone
+            self._overwritten += tail - capacity - head
+            head = tail - capacity
+        count = tail - head if max_rows is None else min(max_rows, tail - head)
+        if count <= 0:
+            return np.zeros((0, self.width), dtype=np.float32)
+        start = head % capacity
+        first = min(count, capacity - start)
+        if first == count:
+            rows = self._rows[start:start + count].copy()
+        else:
+            rows = np.concatenate((self._rows[start:], self._rows[:count - first]))
+        # Rows the producer began overwriting while they were being copied are stale
+        lost = min(self._reserved - capacity - head, count)
+        if lost > 0:
+            self._overwritten += lost
+            rows = rows[lost:]
+        self._head = head + count
+        if self.overflow == BLOCK:
+            self._space.set()
+            waiter = self._space_waiter
+            if waiter is not None:
+                waiter[0].call_soon_threadsafe(waiter[1].set)
+        return rows
+
+    def stats(self):
+        """Overflow counters"""
+        return dict(pushed=self.pushed, dropped_oldest=self.dropped_oldest,
+                    dropped_newest=self.dropped_newest, blocked=self.blocked)
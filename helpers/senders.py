@@ -0,0 +1,157 @@
+import asyncio
+from collections import deque
+import numpy as np
+from .batching import next_flush_timeout
+from .bridge import IDLE_TIMEOUT
+from .ring import DEFAULT_CAPACITY, DROP_OLDEST, DROP_NEWEST
+
+# One feeder hands samples to every sender, so a sender that made it wait would hold up all streams
+SENDER_POLICIES = (DROP_OLDEST, DROP_NEWEST)
+
+
+class StreamSender:
+    """
+    Sends one channel on its own stream from its own task. The connection's
+    loop hands it stamped records with `put`; the task encodes them, batches
+    them and waits out the stream's backpressure without holding up the
+    other streams. Records that do not fit in `capacity` are handled by the
+    client's overflow policy, and since they are already numbered, what a
+    stalled stream drops shows up as loss at the server. The block policy is
+    not supported, as a put that waits would stall the feeder and with it
+    every stream. With a reliable session the records are kept in the
+    session's backlog instead, and the task sends what the backlog releases
+    for its channel.
+    """
+    def __init__(self, sensor, batcher, encode, capacity=DEFAULT_CAPACITY, overflow=DROP_OLDEST, session=None):
+        check_overflow(overflow)
+        self.sensor = sensor
+        self.batcher = batcher
+        self.encode = encode
+        self.capacity = capacity
+        self.overflow = overflow
+        self.session = session
+        self._blocks = deque()
+        self._rows = 0
+        # Encoded messages such as rate announcements, sent ahead of the next samples
+        self._messages = deque()
+        self._wakeup = asyncio.Event()
+        self._finishing = False
+        # Overflow counters, in records
+        self.dropped_oldest = 0
+        self.dropped_newest = 0
+
+    def __len__(self):
+        return self._rows
+
+    def put(self, block):
+        """Queue a block of stamped records for the stream, never waiting"""
+        count = len(block)
+        if not count:
+            return
+        if self._rows + count > self.capacity:
+            if self.overflow == DROP_NEWEST:
+                self.dropped_newest += count
+                return
+            self._drop_oldest(self._rows + count - self.capacity)
+            if count > self.capacity:
+                self.dropped_oldest += count - self.capacity
+                block = block[-self.capacity:]
+        self._blocks.append(block)
+        self._rows += len(block)
+        self._wakeup.set()
+
+    def _drop_oldest(self, count):
+        while count > 0 and self._blocks:
+            oldest = self._blocks[0]
+            if len(oldest) <= count:
+                self._blocks.popleft()
+                dropped = len(oldest)
+            else:
+                self._blocks[0] = oldest[count:]
+                dropped = count
+            self._rows -= dropped
+            self.dropped_oldest += dropped
+            count -= dropped
+
+    def send(self, message):
+        """Queue an already encoded message, e.g. a rate announcement"""
+        if message:
+            self._messages.append(message)
+            self._wakeup.set()
+
+    def wake(self):
+        """Let the task check the session backlog, after the loop stamped new samples into it"""
+        self._wakeup.set()
+
+    def finish(self):
+        """Send what is still queued, then end the stream"""
+        self._finishing = True
+        self._wakeup.set()
+
+    def idle(self):
+        if self._blocks or self._messages:
+            return False
+        return not self.session or not self.session.backlog(self.sensor).unsent
+
+    async def run(self):
+        """Send until finish() is called and nothing is left, then close the stream"""
+        while True:
+            self._wakeup.clear()
+            while self._messages:
+                await self.batcher.write(self._messages.popleft())
+            if self._blocks:
+                records = np.concatenate(self._blocks) if len(self._blocks) > 1 else self._blocks[0]
+                self._blocks.clear()
+                self._rows = 0
+                await self.batcher.write(self.encode(records))
+            if self.session:
+                # Live samples and paced replays alike come out of the backlog
+                await self.batcher.write(self.session.encode_ready(self.sensor))
+            await self.batcher.flush_if_due()
+            if self._finishing and self.idle():
+                break
+            idle = self.session.timeout(sensor=self.sensor) if self.session else IDLE_TIMEOUT
+            # A timer rather than wait_for, which can swallow the group's cancel when a wakeup races it
+            timer = asyncio.get_running_loop().call_later(next_flush_timeout([self.batcher], idle), self._wakeup.set)
+            try:
+                await self._wakeup.wait()
+            finally:
+                timer.cancel()
+        await self.batcher.close()
+
+    def stats(self):
+        """Overflow counters"""
+        return dict(queued=self._rows, dropped_oldest=self.dropped_oldest, dropped_newest=self.dropped_newest)
+
+
+def check_overflow(overflow):
+    """Raise ValueError unless the overflow policy can be used with stream senders"""
+    if overflow not in SENDER_POLICIES:
+        raise ValueError(f"Overflow policy {overflow!r} is not supported with per-stream senders, "
+                         f"use one of {', '.join(SENDER_POLICIES)}")
+
+
+async def run_senders(feed, senders):
+    """
+    Run the feed coroutine, which hands samples to the senders, next to a
+    task per sender. Once the feed returns the senders finish what they
+    hold. If any of them fails, the rest are cancelled and the error is
+    raised, so a lost connection ends the whole group at once.
+    """
+    senders = list(senders)
+    feeder = asyncio.ensure_future(feed)
+    tasks = [asyncio.ensure_future(sender.run()) for sender in senders]
+    pending = {feeder, *tasks}
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if not task.cancelled() and task.exception() is not None:
+                    raise task.exception()
+            if feeder in done:
+                for sender in senders:
+                    sender.finish()
+    finally:
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
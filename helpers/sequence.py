@@ -0,0 +1,36 @@
+import numpy as np
+
+
+class SequenceTracker:
+    """
+    Tracks loss and reordering from per-sample sequence numbers.
+    A jump forward counts the skipped numbers as lost; a number at or below
+    the highest seen so far is a late (out-of-order) arrival and is taken
+    back out of the lost count.
+    """
+    def __init__(self):
+        self.highest = None
+        self.received = 0
+        self.lost = 0
+        self.out_of_order = 0
+
+    def update(self, seqs):
+        """Account for a batch of sequence numbers in arrival order"""
+        seqs = np.asarray(seqs, dtype=np.int64)
+        if not len(seqs):
+            return
+        if self.highest is None:
+            self.highest = int(seqs[0]) - 1
+        # Highest sequence number seen before each sample arrived
+        prior = np.maximum.accumulate(np.concatenate(([self.highest], seqs[:-1])))
+        late = seqs <= prior
+        gaps = np.where(late, 0, seqs - prior - 1)
+        n_late = int(late.sum())
+        self.received += len(seqs)
+        self.lost = max(0, self.lost + int(gaps.sum()) - n_late)
+        self.out_of_order += n_late
+        self.highest = max(self.highest, int(seqs.max()))
+
+    def __repr__(self):
+        return (f"SequenceTracker(received={self.received}, lost={self.lost}, "
+                f"out_of_order={self.out_of_order})")
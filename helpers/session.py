@@ -0,0 +1,577 @@
+import os
+import time
+import uuid
+import random
+import asyncio
+import logging
+from collections import OrderedDict
+import numpy as np
+from .codec import (RECORD_DTYPE, SEQ_MASK, SEQ_HALF, FORMAT_TEXT, FORMAT_BINARY, encode_ack, decode_acks,
+                    group_by_type)
+from .channels import CHANNELS
+from .framing import StreamReassembler
+from .bridge import IDLE_TIMEOUT
+from .metrics import MetricFamily
+
+# Records per channel kept in memory until acknowledged, about a minute at 1 kHz
+DEFAULT_WINDOW = 1 << 16
+# Records per channel a disk spool holds once the window is full (50 MB, about 35 minutes at 1 kHz)
+DEFAULT_SPOOL_RECORDS = 1 << 21
+# Records per second and channel replayed after a reconnect, must exceed the sensor rate to catch up
+DEFAULT_CATCHUP_RATE = 5000
+# Seconds of catch-up rate a paced channel may send at once
+CATCHUP_BURST = 0.02
+# Seconds without packets from the server before a reliable client gives the connection up
+DEFAULT_IDLE_TIMEOUT = 5.0
+# Reconnect delay bounds in seconds, doubling after every failed attempt
+RECONNECT_MIN = 0.5
+RECONNECT_MAX = 30.0
+# Errors that end a connection attempt or a live connection and are worth retrying
+RECONNECT_ERRORS = (ConnectionError, OSError, asyncio.TimeoutError)
+
+# Server side: longest a channel's acknowledgement waits for more records
+ACK_INTERVAL = 0.05
+# Reliable sessions a server process remembers for deduplication
+DEFAULT_MAX_SESSIONS = 10000
+
+
+class RecordQueue:
+    """
+    Fixed-capacity FIFO of binary records, in memory or, with a path, in a
+    memory-mapped spool file. Positions are counters that only grow, as in
+    SampleRing.
+    """
+    def __init__(self, capacity, path=None):
+        self.capacity = capacity
+        self.path = path
+        if path:
+            self.records = np.memmap(path, dtype=RECORD_DTYPE, mode='w+', shape=(capacity,))
+        else:
+            self.records = np.zeros(capacity, dtype=RECORD_DTYPE)
+        self._head = 0
+        self._tail = 0
+
+    def __len__(self):
+        return self._tail - self._head
+
+    @property
+    def free(self):
+        return self.capacity - len(self)
+
+    def push(self, records):
+        """Append records, the caller makes sure they fit"""
+        count = len(records)
+        start = self._tail % self.capacity
+        first = min(count, self.capacity - start)
+        self.records[start:start + first] = records[:first]
+        if first < count:
+            self.records[:count - first] = records[first:]
+        self._tail += count
+
+    def peek(self, offset, count):
+        """Copy of `count` records starting `offset` records after the oldest"""
+        start = (self._head + offset) % self.capacity
+        first = min(count, self.capacity - start)
+        if first == count:
+            return self.records[start:start + count].copy()
+        return np.concatenate((self.records[start:], self.records[:count - first]))
+
+    def drop(self, count):
+        """Remove the oldest `count` records"""
+        self._head += count
+
+    def pop(self, count):
+        records = self.peek(0, count)
+        self.drop(count)
+        return records
+
+    def front_seq(self):
+        return int(self.records[self._head % self.capacity]['seq'])
+
+    def close(self):
+        if self.path:
+            # The array holds the mapping, drop it before removing the file
+            self.records = None
+            os.remove(self.path)
+
+
+class ChannelBacklog:
+    """
+    Records of one channel that the server has not acknowledged, oldest
+    first. New records go to the in-memory window; what overflows it moves to
+    the disk spool, and once that is full too the oldest records are dropped.
+    `sent` counts the records at the front that went out on the current
+    connection. Sequence numbers in the backlog are consecutive, so an ack
+    maps straight to a record count.
+    """
+    def __init__(self, window=DEFAULT_WINDOW, spool_path=None, spool_records=DEFAULT_SPOOL_RECORDS,
+                 catchup_rate=DEFAULT_CATCHUP_RATE):
+        self.window = RecordQueue(window)
+        self.spool = RecordQueue(spool_records, spool_path) if spool_path else None
+        self.catchup_rate = catchup_rate
+        self.sent = 0
+        # Replays are paced until the channel has caught up with the live samples
+        self.catching_up = False
+        self._tokens = 0.0
+        self._refilled = 0.0
+        self.appended = 0
+        self.acked = 0
+        self.replayed = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self.window) + (len(self.spool) if self.spool is not None else 0)
+
+    @property
+    def unsent(self):
+        return len(self) - self.sent
+
+    def append(self, records):
+        self.appended += len(records)
+        excess = len(self.window) + len(records) - self.window.capacity
+        if excess > 0:
+            moved = min(excess, len(self.window))
+            self._spill(self.window.pop(moved))
+            if excess > moved:
+                self._spill(records[:excess - moved])
+                records = records[excess - moved:]
+        self.window.push(records)
+
+    def _spill(self, records):
+        """Move records that left the window to the spool, dropping the oldest when it is full or absent"""
+        if self.spool is None:
+            self._discard(len(records))
+            return
+        excess = len(self.spool) + len(records) - self.spool.capacity
+        if excess > 0:
+            dropped = min(excess, len(self.spool))
+            self.spool.drop(dropped)
+            self._discard(dropped)
+            if excess > dropped:
+                self._discard(excess - dropped)
+                records = records[excess - dropped:]
+        self.spool.push(records)
+
+    def _discard(self, count):
+        self.dropped += count
+        self.sent = max(0, self.sent - count)
+
+    def _read(self, offset, count):
+        """Copy `count` records starting `offset` after the oldest, across spool and window"""
+        spooled = len(self.spool) if self.spool is not None else 0
+        parts = []
+        if offset < spooled:
+            n = min(count, spooled - offset)
+            parts.append(self.spool.peek(offset, n))
+            offset, count = spooled, count - n
+        if count:
+            parts.append(self.window.peek(offset - spooled, count))
+        return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+    def take(self, now):
+        """Records to send now: everything unsent, or what the catch-up rate allows while replaying"""
+        count = self._allowance(now)
+        if not count:
+            return np.zeros(0, dtype=RECORD_DTYPE)
+        records = self._read(self.sent, count)
+        self.sent += count
+        return records
+
+    def _allowance(self, now):
+        unsent = self.unsent
+        if not self.catching_up or not self.catchup_rate:
+            return unsent
+        burst = max(1.0, self.catchup_rate * CATCHUP_BURST)
+        self._tokens = min(self._tokens + (now - self._refilled) * self.catchup_rate, burst)
+        self._refilled = now
+        count = min(unsent, int(self._tokens))
+        self._tokens -= count
+        if count == unsent:
+            self.catching_up = False
+        return count
+
+    def wait_time(self, now):
+        """Seconds until a paced channel may send again, None when it is not waiting"""
+        if not self.catching_up or not self.unsent or not self.catchup_rate:
+            return None
+        return max(0.0, (1.0 - self._tokens) / self.catchup_rate - (now - self._refilled))
+
+    def ack(self, seq):
+        """Drop every record up to and including seq"""
+        if not len(self):
+            return
+        front = self.spool.front_seq() if self.spool is not None and len(self.spool) else self.window.front_seq()
+        ahead = (seq - front) & SEQ_MASK
+        if ahead >= SEQ_HALF:
+            # Acknowledges records that are already gone
+            return
+        count = min(ahead + 1, len(self))
+        spooled = min(count, len(self.spool)) if self.spool is not None else 0
+        if spooled:
+            self.spool.drop(spooled)
+        self.window.drop(count - spooled)
+        self.acked += count
+        self.sent = max(0, self.sent - count)
+
+    def rewind(self, now):
+        """Mark everything unacknowledged as unsent, for a new connection"""
+        self.replayed += self.sent
+        self.sent = 0
+        self.catching_up = len(self) > 0
+        self._tokens = max(1.0, self.catchup_rate * CATCHUP_BURST) if self.catchup_rate else 0.0
+        self._refilled = now
+
+    def close(self):
+        self.window.close()
+        if self.spool is not None:
+            self.spool.close()
+
+
+class Backoff:
+    """Exponential reconnect delay with jitter, reset once a connection is up"""
+    def __init__(self, initial=RECONNECT_MIN, maximum=RECONNECT_MAX):
+        self.initial = initial
+        self.maximum = maximum
+        self._delay = initial
+
+    def next(self):
+        delay = self._delay * random.uniform(0.5, 1.0)
+        self._delay = min(self._delay * 2, self.maximum)
+        return delay
+
+    def reset(self):
+        self._delay = self.initial
+
+
+class ReliableSession:
+    """
+    Client side of a reliable session. Every sample is numbered and kept in
+    its channel's backlog until the server acknowledges it. When the
+    connection drops, `run` reconnects with backoff while the samples that
+    keep arriving are buffered, then the unacknowledged ones are replayed at
+    `catchup_rate` records per second and channel. The session id goes out in
+    every stream header, so the server can drop what it already has.
+    """
+    def __init__(self, window=DEFAULT_WINDOW, spool_dir=None, spool_records=DEFAULT_SPOOL_RECORDS,
+                 catchup_rate=DEFAULT_CATCHUP_RATE, idle_timeout=DEFAULT_IDLE_TIMEOUT):
+        self.id = uuid.uuid4().hex[:16]
+        self.idle_timeout = idle_timeout
+        self.backoff = Backoff()
+        if spool_dir:
+            os.makedirs(spool_dir, exist_ok=True)
+        self.window = window
+        self.spool_dir = spool_dir
+        self.spool_records = spool_records
+        self.catchup_rate = catchup_rate
+        # sensor -> ChannelBacklog, created when a channel first sends
+        self.channels = {}
+        self.encoder = None
+        # Called when acknowledgements arrive, to wake a sender waiting for them
+        self.wakeup = None
+        self.connections = 0
+        self._acks = {}
+        self._ack_tasks = set()
+        self._holding = None
+
+    def bind(self, encoder, wakeup=None):
+        """Number samples with encoder and announce the session in its stream headers"""
+        if encoder.format == FORMAT_TEXT:
+            raise ValueError("A reliable session needs sequence numbers, use the bin1 or dq1 format")
+        self.encoder = encoder
+        encoder.options['session'] = self.id
+        self.wakeup = wakeup
+
+    def pending(self):
+        """Whether any sample is still waiting to be acknowledged"""
+        return any(len(channel) for channel in self.channels.values())
+
+    def backlog(self, sensor):
+        """A channel's backlog, created on first use"""
+        channel = self.channels.get(sensor)
+        if channel is None:
+            spool = os.path.join(self.spool_dir, f"{self.id}-{CHANNELS[sensor].name}.spool") if self.spool_dir else None
+            channel = self.channels[sensor] = ChannelBacklog(self.window, spool, self.spool_records, self.catchup_rate)
+        return channel
+
+    def buffer(self, blocks):
+        """Stamp (sensor, block) pairs from ChannelRings.pop into the backlogs without sending anything"""
+        for sensor, block in blocks:
+            records = self.encoder.stamp_items(sensor, [block])
+            if len(records):
+                self.backlog(sensor).append(records)
+
+    def encode_items(self, sensor, items):
+        """SampleEncoder.encode_items through the backlog: stamp the samples, encode what may be sent now"""
+        records = self.encoder.stamp_items(sensor, items)
+        if len(records):
+            self.backlog(sensor).append(records)
+        return self.encode_ready(sensor)
+
+    def encode_ready(self, sensor):
+        """Encode the records a channel may send now, e.g. the next slice of a paced replay"""
+        self._apply_acks()
+        channel = self.channels.get(sensor)
+        if channel is None:
+            return b''
+        return self.encoder.encode_records(channel.take(time.monotonic()))
+
+    def timeout(self, idle=IDLE_TIMEOUT, sensor=None):
+        """How long a send loop may sleep before a paced channel, or the given one, may send again"""
+        now = time.monotonic()
+        channels = self.channels.values() if sensor is None else [self.backlog(sensor)]
+        waits = [wait for wait in (channel.wait_time(now) for channel in channels) if wait is not None]
+        return min([idle] + waits)
+
+    def check(self, protocol):
+        """Raise ConnectionError once a QUIC connection has terminated"""
+        if protocol._closed.is_set():
+            raise ConnectionError("Connection lost")
+
+    def connected(self):
+        """A new connection is up: stop buffering, and replay the backlogs from their oldest record"""
+        self.connections += 1
+        self.backoff.reset()
+        self._stop_holding()
+        if self.encoder is None:
+            return
+        self._apply_acks()
+        self.encoder.reset_stream()
+        now = time.monotonic()
+        for channel in self.channels.values():
+            channel.rewind(now)
+        if self.connections > 1:
+            logging.warning(f"Reconnected, replaying {sum(map(len, self.channels.values()))} unacknowledged samples")
+
+    def stream_handler(self, reader, writer):
+        """connect() stream_handler: read acknowledgements from the stream the server opens"""
+        # The stream is receive-only, keep the writer from trying to end it when it is collected
+        writer.transport._closing = True
+        task = asyncio.ensure_future(self._read_acks(reader))
+        self._ack_tasks.add(task)
+        task.add_done_callback(self._ack_tasks.discard)
+
+    async def _read_acks(self, reader):
+        reassembler = StreamReassembler(FORMAT_BINARY)
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                return
+            self.receive(reassembler.feed(data))
+
+    def receive(self, records):
+        """Take in acknowledgement records, safe to call from another thread than the sender's"""
+        for sensor, seq in decode_acks(records):
+            self._acks[sensor] = seq
+        if self._acks and self.wakeup:
+            self.wakeup()
+
+    def _apply_acks(self):
+        for sensor in list(self._acks):
+            channel = self.channels.get(sensor)
+            seq = self._acks.pop(sensor)
+            if channel is not None:
+                channel.ack(seq)
+
+    async def run(self, connect_once, bridge=None, rings=None):
+        """
+        Await connect_once() until it returns, reconnecting with backoff after
+        connection errors. With a client's ChannelRings, samples they receive
+        in the meantime are stamped into the backlogs so none are lost to ring
+        overflow.
+        """
+        try:
+            while True:
+                try:
+                    return await connect_once()
+                except RECONNECT_ERRORS as e:
+                    delay = self.backoff.next()
+                    logging.warning(f"Connection failed ({e!r}), reconnecting in {delay:.1f}s")
+                if rings is not None and self.encoder is not None and self._holding is None:
+                    self._holding = asyncio.create_task(self._hold(bridge, rings))
+                await asyncio.sleep(delay)
+        finally:
+            self._stop_holding()
+
+    async def _hold(self, bridge, rings):
+        while True:
+            await bridge.wait(IDLE_TIMEOUT)
+            self.buffer(rings.pop())
+
+    def _stop_holding(self):
+        if self._holding is not None:
+            self._holding.cancel()
+            self._holding = None
+
+    def stats(self):
+        """Per channel counts of samples appended, acknowledged, replayed and dropped"""
+        return {CHANNELS[sensor].name: dict(appended=channel.appended, acked=channel.acked, replayed=channel.replayed,
+                                            dropped=channel.dropped, unacked=len(channel))
+                for sensor, channel in self.channels.items()}
+
+    def close(self):
+        for task in self._ack_tasks:
+            task.cancel()
+        self._stop_holding()
+        logging.info(f"Session {self.id} after {self.connections} connections: {self.stats()}")
+        for channel in self.channels.values():
+            channel.close()
+
+
+def session_options(session, configuration):
+    """
+    connect() keyword arguments for a reliable session: a short idle timeout
+    so a dead link is noticed, and a handler for the acknowledgement stream
+    """
+    if session is None:
+        return {}
+    configuration.idle_timeout = session.idle_timeout
+    return dict(stream_handler=session.stream_handler)
+
+
+def add_session_arguments(parser):
+    """Add the reliable session options shared by the client CLIs"""
+    parser.add_argument('--reliable', action='store_true', help='Reconnect after outages and replay unacknowledged samples')
+    parser.add_argument('--window', type=int, default=DEFAULT_WINDOW, help='Unacknowledged samples per channel kept in memory')
+    parser.add_argument('--spool', type=str, default=None, help='Directory to spool unacknowledged samples to once the window is full')
+    parser.add_argument('--spool-records', type=int, default=DEFAULT_SPOOL_RECORDS, help='Samples per channel the spool holds')
+    parser.add_argument('--catchup-rate', type=float, default=DEFAULT_CATCHUP_RATE, help='Samples per second and channel replayed after a reconnect')
+
+
+def session_from_args(args):
+    """The ReliableSession the command line asks for, None without --reliable"""
+    if not args.reliable:
+        return None
+    return ReliableSession(args.window, args.spool, args.spool_records, args.catchup_rate)
+
+
+class SessionTable:
+    """
+    Server side: per reliable session and channel, the highest sequence
+    number taken in, for deduplication, and the highest processed, which is
+    what gets acknowledged. A sample is only acknowledged once recorded and
+    handed to the sinks, so one still queued when the server dies is
+    replayed. The table outlives connections so the replay of a reconnecting
+    client can be deduplicated, and keeps the `max_sessions` most recently
+    active sessions. It lives in one process only: with several workers a
+    reconnect can land on another worker, which does not know the session
+    and takes the replay in again as new samples.
+    """
+    def __init__(self, max_sessions=DEFAULT_MAX_SESSIONS):
+        self.max_sessions = max_sessions
+        # session -> ({sensor: highest seq taken in}, {sensor: highest seq processed})
+        self.sessions = OrderedDict()
+        self.accepted = 0
+        self.duplicates = 0
+
+    def processed(self, session):
+        """Highest processed sequence number per sensor of a session, None when unknown"""
+        state = self.sessions.get(session)
+        return state[1] if state is not None else None
+
+    def commit(self, session, records):
+        """Mark processed records, in arrival order, as ready to acknowledge"""
+        state = self.sessions.get(session)
+        if state is None:
+            return
+        seqs = records['seq']
+        for sensor, index in group_by_type(records['type']):
+            if sensor in CHANNELS:
+                state[1][sensor] = int(seqs[index][-1])
+
+    def rewind(self, session, sensors=None):
+        """
+        Forget what was taken in but not processed on the given channels, or
+        on all of them, so those samples are taken in again when replayed
+        """
+        state = self.sessions.get(session)
+        if state is None:
+            return
+        taken, processed = state
+        for sensor in list(taken) if sensors is None else sensors:
+            if sensor in processed:
+                taken[sensor] = processed[sensor]
+            else:
+                taken.pop(sensor, None)
+
+    def accept(self, session, records):
+        """Drop the records at or behind the highest sequence number already taken in on their channel"""
+        state = self.sessions.get(session)
+        if state is None:
+            state = self.sessions[session] = ({}, {})
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+        else:
+            self.sessions.move_to_end(session)
+        channels = state[0]
+        keep = None
+        for sensor, index in group_by_type(records['type']):
+            if sensor not in CHANNELS:
+                continue
+            seqs = records['seq'][index].astype(np.int64)
+            last = channels.get(sensor)
+            if last is not None:
+                fresh = ((seqs - last - 1) & SEQ_MASK) < SEQ_HALF
+                if not fresh.all():
+                    if keep is None:
+                        keep = np.ones(len(records), dtype=bool)
+                    keep[np.arange(len(records))[index][~fresh]] = False
+                    seqs = seqs[fresh]
+            if len(seqs):
+                channels[sensor] = int(seqs[-1])
+        if keep is None:
+            self.accepted += len(records)
+            return records
+        kept = int(keep.sum())
+        self.accepted += kept
+        self.duplicates += len(records) - kept
+        return records[keep]
+
+    def collect(self):
+        """Metric families for the metrics endpoint"""
+        sessions = MetricFamily('imu_sessions', 'gauge', 'Reliable sessions remembered for deduplication')
+        sessions.add(len(self.sessions))
+        records = MetricFamily('imu_session_records_total', 'counter', 'Records received on reliable sessions, by outcome')
+        records.add(self.accepted, outcome='accepted')
+        records.add(self.duplicates, outcome='duplicate')
+        return [sessions, records]
+
+
+class AckTimer:
+    """
+    Sends one connection's acknowledgements at most every `interval`
+    seconds, and only when they moved, by calling send(bytes of ack records).
+    Keeps checking while samples of the session wait to be processed.
+    """
+    def __init__(self, table, session, send, interval=ACK_INTERVAL):
+        self.table = table
+        self.session = session
+        self.send = send
+        self.interval = interval
+        self._sent = None
+        self._handle = None
+
+    def schedule(self):
+        if self._handle is None:
+            self._handle = asyncio.get_running_loop().call_later(self.interval, self.flush)
+
+    def flush(self):
+        """Send the current acknowledgements now"""
+        self._handle = None
+        state = self.table.sessions.get(self.session)
+        if state is None:
+            return
+        taken, processed = state
+        if processed and processed != self._sent:
+            self._sent = dict(processed)
+            try:
+                self.send(b''.join(encode_ack(sensor, seq) for sensor, seq in processed.items()))
+            except Exception as e:
+                logging.error(f"Error sending acknowledgements: {e}")
+        if processed != taken:
+            # Samples taken in are still queued, acknowledge them once processed
+            self.schedule()
+
+    def cancel(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
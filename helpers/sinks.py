@@ -0,0 +1,286 @@
+import os
+import sys
+import asyncio
+import logging
+import importlib
+from collections import deque
+import numpy as np
+from .timeseries import RingSeries, DEFAULT_HISTORY
+from .metrics import MetricFamily
+from .channels import CHANNELS
+
+# Records held between flushes before the oldest batches are dropped
+DEFAULT_MAX_PENDING = 65536
+# Pending records that trigger a flush before the interval is up
+FLUSH_RECORDS = 4096
+# Seconds between flushes
+FLUSH_INTERVAL = 0.1
+
+SINK_TYPES = ('null', 'stdout', 'file', 'ring', 'callback')
+DEFAULT_SINKS = ['stdout']
+
+
+def format_block(template, *columns):
+    """Format every row of the given columns with a %-template in one call instead of one per sample"""
+    rows = np.column_stack(columns)
+    return (template * len(rows)) % tuple(rows.ravel().tolist())
+
+
+class Sink:
+    """
+    Receives decoded samples a batch at a time. `write` gets every record a
+    device sent on one sensor since the last flush, as one RECORD_DTYPE array.
+    Sinks that block on I/O set `blocking` so the pipeline runs them off the
+    event loop.
+    """
+    blocking = False
+
+    def write(self, device, sensor, records):
+        raise NotImplementedError
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class NullSink(Sink):
+    """Discards everything, for when only recording or stats are wanted"""
+    def write(self, device, sensor, records):
+        pass
+
+
+class StdoutSink(Sink):
+    """Prints samples in the servers' `Accel: X=.. Y=.. Z=..` format, or `Baro: 1013.25` for one-axis channels, one write per batch"""
+    blocking = True
+
+    def __init__(self):
+        self._templates = {}
+
+    def _template(self, sensor):
+        template = self._templates.get(sensor)
+        if template is None:
+            channel = CHANNELS.get(sensor)
+            dim = channel.dim if channel is not None else 3
+            values = ' '.join(f"{axis}=%.2f" for axis in 'XYZ'[:dim]) if dim > 1 else '%.2f'
+            template = self._templates[sensor] = (f"{sensor.capitalize()}: {values}\n", dim)
+        return template
+
+    def write(self, device, sensor, records):
+        template, dim = self._template(sensor)
+        # Looked up on every write so a redirected sys.stdout is honoured
+        sys.stdout.write(format_block(template, records['axes'][:, :dim]))
+
+    def flush(self):
+        sys.stdout.flush()
+
+
+class FileSink(Sink):
+    """
+    Appends samples to a CSV file of device,sensor,ts,x,y,z rows. Each batch
+    goes out as a single O_APPEND write, so worker processes can share a file
+    without interleaving rows.
+    """
+    blocking = True
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        if not os.fstat(self._fd).st_size:
+            os.write(self._fd, b'device,sensor,ts,x,y,z\n')
+
+    def write(self, device, sensor, records):
+        data = format_block(f"{device},{sensor},%.6f,%.6f,%.6f,%.6f\n", records['ts'], records['axes']).encode()
+        view = memoryview(data)
+        while view:
+            view = view[os.write(self._fd, view):]
+
+    def close(self):
+        os.close(self._fd)
+
+
+class RingSink(Sink):
+    """Keeps the newest samples of every device and sensor in memory"""
+    def __init__(self, capacity=DEFAULT_HISTORY):
+        self.capacity = capacity
+        self.series = {}
+
+    def write(self, device, sensor, records):
+        key = (device, sensor)
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = RingSeries(self.capacity)
+        series.append(records)
+
+    def latest(self, device, sensor, n=None):
+        """View of the newest n samples of one device and sensor, oldest first"""
+        series = self.series.get((device, sensor))
+        return series.latest(n) if series is not None else None
+
+
+class CallbackSink(Sink):
+    """Hands every batch to callback(device, sensor, records) on the event loop"""
+    def __init__(self, callback):
+        self.callback = callback
+
+    def write(self, device, sensor, records):
+        self.callback(device, sensor, records)
+
+
+def sink_from_spec(spec):
+    """
+    Build a sink from a command line spec: `null`, `stdout`, `file:PATH`,
+    `ring[:CAPACITY]` or `callback:MODULE:FUNCTION`.
+    """
+    kind, _, arg = spec.partition(':')
+    if kind == 'null':
+        return NullSink()
+    if kind == 'stdout':
+        return StdoutSink()
+    if kind == 'file':
+        if not arg:
+            raise ValueError("file sink needs a path, e.g. file:samples.csv")
+        return FileSink(arg)
+    if kind == 'ring':
+        return RingSink(int(arg)) if arg else RingSink()
+    if kind == 'callback':
+        module, _, name = arg.rpartition(':')
+        if not module or not name:
+            raise ValueError("callback sink needs MODULE:FUNCTION, e.g. callback:mypkg.hooks:on_samples")
+        return CallbackSink(getattr(importlib.import_module(module), name))
+    raise ValueError(f"Unknown sink {spec!r}, expected one of {', '.join(SINK_TYPES)}")
+
+
+class SinkPipeline:
+    """
+    Chain of sinks fed from the receive path. `submit` only queues a batch;
+    a background task groups what is queued by device and sensor and hands
+    it to every sink once per flush. At most `max_pending` records wait
+    between flushes, beyond that the oldest batches are dropped so a slow
+    sink never stalls receiving.
+    """
+    def __init__(self, sinks, max_pending=DEFAULT_MAX_PENDING, flush_records=FLUSH_RECORDS,
+                 flush_interval=FLUSH_INTERVAL):
+        self.sinks = list(sinks)
+        self.max_pending = max_pending
+        self.flush_records = min(flush_records, max_pending)
+        self.flush_interval = flush_interval
+        self._pending = deque()
+        self._pending_records = 0
+        self._wake = None
+        self._task = None
+        self._closing = False
+        self.submitted = 0
+        self.written = 0
+        self.dropped = 0
+
+    @property
+    def pending(self):
+        """Records waiting for the next flush"""
+        return self._pending_records
+
+    def start(self):
+        """Start the flush task on the running event loop"""
+        if self._task is None:
+            self._wake = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    def submit(self, device, sensor, records):
+        """Queue a batch of records without waiting for any sink"""
+        count = len(records)
+        if not count:
+            return
+        if self._task is None:
+            self.start()
+        self._pending.append((device, sensor, records))
+        self._pending_records += count
+        self.submitted += count
+        while self._pending_records > self.max_pending and len(self._pending) > 1:
+            _, _, oldest = self._pending.popleft()
+            self._pending_records -= len(oldest)
+            self.dropped += len(oldest)
+        if self._pending_records >= self.flush_records:
+            self._wake.set()
+
+    def _take(self):
+        """Remove everything queued, merged into one array per device and sensor"""
+        grouped = {}
+        while self._pending:
+            device, sensor, records = self._pending.popleft()
+            grouped.setdefault((device, sensor), []).append(records)
+        self._pending_records = 0
+        return {key: chunks[0] if len(chunks) == 1 else np.concatenate(chunks) for key, chunks in grouped.items()}
+
+    def _write(self, sinks, batches):
+        for sink in sinks:
+            try:
+                for (device, sensor), records in batches.items():
+                    sink.write(device, sensor, records)
+                sink.flush()
+            except Exception as e:
+                logging.error(f"{type(sink).__name__} failed: {e}")
+
+    async def flush(self):
+        """Write everything queued to every sink"""
+        batches = self._take()
+        if not batches:
+            return
+        self._write([sink for sink in self.sinks if not sink.blocking], batches)
+        blocking = [sink for sink in self.sinks if sink.blocking]
+        if blocking:
+            await asyncio.to_thread(self._write, blocking, batches)
+        self.written += sum(map(len, batches.values()))
+
+    async def _run(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    def collect(self):
+        """Metric families for the metrics endpoint"""
+        samples = MetricFamily('imu_sink_samples_total', 'counter', 'Samples handed to the sinks, by outcome')
+        samples.add(self.submitted, outcome='submitted')
+        samples.add(self.written, outcome='written')
+        samples.add(self.dropped, outcome='dropped')
+        pending = MetricFamily('imu_sink_pending_samples', 'gauge', 'Samples waiting for the next sink flush')
+        pending.add(self.pending)
+        return [samples, pending]
+
+    async def close(self):
+        """Stop the flush task, write what is still queued and close every sink"""
+        self._closing = True
+        if self._task is not None:
+            # Let a flush in progress finish instead of cancelling it mid-write
+            self._wake.set()
+            await self._task
+            self._task = None
+        await self.flush()
+        for sink in self.sinks:
+            sink.close()
+        logging.info(f"Sinks wrote {self.written} of {self.submitted} samples, dropped {self.dropped}")
+
+
+def add_sink_arguments(parser):
+    """Add the sample sink options shared by the server CLIs"""
+    parser.add_argument('--sink', type=str, action='append', default=None,
+                        help='Where received samples go: null, stdout, file:PATH, ring[:CAPACITY] or '
+                             'callback:MODULE:FUNCTION. Repeat to chain several (default stdout)')
+    parser.add_argument('--sink-buffer', type=int, default=DEFAULT_MAX_PENDING, help='Samples buffered for the sinks before the oldest are dropped')
+    parser.add_argument('--sink-interval', type=float, default=FLUSH_INTERVAL, help='Seconds between sink flushes')
+
+
+def sink_options(args):
+    """Picklable sink settings from the command line, for pipeline_from_options in each server process"""
+    return dict(sinks=args.sink or DEFAULT_SINKS, sink_buffer=args.sink_buffer, sink_interval=args.sink_interval)
+
+
+def pipeline_from_options(sinks=None, sink_buffer=DEFAULT_MAX_PENDING, sink_interval=FLUSH_INTERVAL):
+    """Build the sink pipeline for a list of sink specs, None when there are none"""
+    if not sinks:
+        return None
+    return SinkPipeline([sink_from_spec(spec) for spec in sinks], max_pending=sink_buffer, flush_interval=sink_interval)
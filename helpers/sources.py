@@ -0,0 +1,312 @@
+import math
+import time
+import struct
+import numpy as np
+import serial
+from .channels import CHANNELS, EXTRA_CHANNELS, IMU_CHANNELS
+
+DEFAULT_SERIAL_PORT = '/dev/ttyACM0'
+DEFAULT_BAUDRATE = 921600
+
+# Recorded session chunk: seconds since start, chunk length, then the raw bytes
+CHUNK = struct.Struct('<dI')
+RECORDING_MAGIC = b'IMUREC01'
+
+WAVEFORMS = ('sine', 'square', 'noise', 'constant')
+GRAVITY = 9.81
+# Resting value and waveform gain per axis of the generated extra channels:
+# a tilted 50 uT field, sea level pressure and room temperature
+SYNTHETIC_LEVELS = {
+    'mag': ((20.0, 0.0, -45.0), (5.0, -5.0, 2.0)),
+    'baro': ((1013.25,), (0.5,)),
+    'temp': ((25.0,), (0.2,)),
+}
+
+
+class SamplePort:
+    """
+    Serial-port-like reader over a generated or replayed byte stream.
+    Provides the subset of serial.Serial that IMUParser uses.
+    """
+    def __init__(self):
+        self._buffer = bytearray()
+        self.exhausted = False
+
+    def _poll(self):
+        """Append whatever bytes are due now without blocking"""
+        raise NotImplementedError
+
+    def delay(self):
+        """Seconds until more bytes may be due, None once there are none left"""
+        raise NotImplementedError
+
+    def _wait(self):
+        """Block until more bytes may be due, set exhausted when there are none left"""
+        delay = self.delay()
+        if delay is None:
+            self.exhausted = True
+            return
+        time.sleep(delay)
+
+    @property
+    def in_waiting(self):
+        self._poll()
+        return len(self._buffer)
+
+    def _fill(self):
+        self._poll()
+        while not self._buffer and not self.exhausted:
+            self._wait()
+            self._poll()
+
+    def read(self, size=1):
+        if len(self._buffer) < size:
+            self._fill()
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    def readline(self):
+        while b'\n' not in self._buffer and not self.exhausted:
+            self._wait()
+            self._poll()
+        end = self._buffer.find(b'\n') + 1 or len(self._buffer)
+        line = bytes(self._buffer[:end])
+        del self._buffer[:end]
+        return line
+
+    def close(self):
+        self.exhausted = True
+
+
+class SyntheticPort(SamplePort):
+    """
+    Generates `ax,ay,az,gx,gy,gz` lines at a fixed rate, and tagged lines
+    such as `MAG:x,y,z` for each extra channel at the channel's own rate
+    """
+    def __init__(self, rate, waveform, frequency, amplitude, duration, channels=()):
+        super().__init__()
+        self.rate = rate
+        self.waveform = waveform
+        self.frequency = frequency
+        self.amplitude = amplitude
+        self.duration = duration
+        self.limit = self._limit(rate)
+        self.generated = 0
+        # Extra channels with their line template and samples generated so far
+        self.channels = [channel for channel in channels if channel not in IMU_CHANNELS and channel.rate]
+        self._templates = {channel.id: channel.prefix.encode() + b':' + b','.join([b'%.4f'] * channel.dim) + b'\n'
+                           for channel in self.channels}
+        self._generated = {channel.id: 0 for channel in self.channels}
+        self._start = time.monotonic()
+        self._rng = np.random.default_rng(0)
+
+    def _wave(self, n, start, rate):
+        t = (start + np.arange(n)) / rate
+        phase = 2 * math.pi * self.frequency * t
+        if self.waveform == 'sine':
+            wave = np.sin(phase)
+        elif self.waveform == 'square':
+            wave = np.sign(np.sin(phase))
+        elif self.waveform == 'noise':
+            wave = self._rng.standard_normal(n)
+        else:
+            wave = np.zeros(n)
+        return self.amplitude * wave
+
+    def _rows(self, n):
+        wave = self._wave(n, self.generated, self.rate)
+        rows = np.empty((n, 6))
+        # Accelerometer sits on gravity, the gyro axes are phase shifted copies
+        rows[:, 0] = wave
+        rows[:, 1] = -wave
+        rows[:, 2] = GRAVITY + wave
+        rows[:, 3] = wave / 2
+        rows[:, 4] = -wave / 2
+        rows[:, 5] = wave / 4
+        return rows
+
+    def _channel_rows(self, channel, n):
+        level, gain = SYNTHETIC_LEVELS.get(channel.name, ((0.0,) * channel.dim, (1.0,) * channel.dim))
+        return np.asarray(level) + np.outer(self._wave(n, self._generated[channel.id], channel.rate), gain)
+
+    def _limit(self, rate):
+        return None if self.duration is None else int(self.duration * rate)
+
+    def _poll(self):
+        elapsed = time.monotonic() - self._start
+        due = int(elapsed * self.rate) - self.generated
+        if self.limit is not None:
+            due = min(due, self.limit - self.generated)
+        if due > 0:
+            for row in self._rows(due).tolist():
+                self._buffer += b'%.4f,%.4f,%.4f,%.4f,%.4f,%.4f\n' % tuple(row)
+            self.generated += due
+        for channel in self.channels:
+            generated = self._generated[channel.id]
+            due = int(elapsed * channel.rate) - generated
+            limit = self._limit(channel.rate)
+            if limit is not None:
+                due = min(due, limit - generated)
+            if due <= 0:
+                continue
+            template = self._templates[channel.id]
+            for row in self._channel_rows(channel, due).tolist():
+                self._buffer += template % tuple(row)
+            self._generated[channel.id] = generated + due
+
+    def delay(self):
+        pending = [(self.rate, self.generated, self.limit)]
+        pending += [(channel.rate, self._generated[channel.id], self._limit(channel.rate)) for channel in self.channels]
+        due = [self._start + (generated + 1) / rate for rate, generated, limit in pending
+               if limit is None or generated < limit]
+        if not due:
+            return None
+        return max(0.0, min(due) - time.monotonic())
+
+
+class ReplayPort(SamplePort):
+    """Replays a recorded serial session, at original timing scaled by speed"""
+    def __init__(self, path, speed):
+        super().__init__()
+        self.speed = speed
+        self._file = open(path, 'rb')
+        if self._file.read(len(RECORDING_MAGIC)) != RECORDING_MAGIC:
+            self._file.close()
+            raise ValueError(f"Not a serial recording: {path}")
+        self._start = time.monotonic()
+        self._next = self._read_chunk()
+
+    def _read_chunk(self):
+        header = self._file.read(CHUNK.size)
+        if len(header) < CHUNK.size:
+            return None
+        offset, length = CHUNK.unpack(header)
+        return offset, self._file.read(length)
+
+    def _due_at(self, offset):
+        if self.speed <= 0:
+            return self._start
+        return self._start + offset / self.speed
+
+    def _poll(self):
+        now = time.monotonic()
+        while self._next is not None and self._due_at(self._next[0]) <= now:
+            self._buffer += self._next[1]
+            self._next = self._read_chunk()
+
+    def delay(self):
+        if self._next is None:
+            return None
+        return max(0.0, self._due_at(self._next[0]) - time.monotonic())
+
+    def close(self):
+        super().close()
+        self._file.close()
+
+
+class RecordingPort:
+    """Wraps a serial port and writes every chunk read from it, with its arrival time, to a file"""
+    def __init__(self, port, path):
+        self.port = port
+        self._file = open(path, 'wb')
+        self._file.write(RECORDING_MAGIC)
+        self._start = time.monotonic()
+
+    def _record(self, data):
+        if data:
+            self._file.write(CHUNK.pack(time.monotonic() - self._start, len(data)))
+            self._file.write(data)
+        return data
+
+    @property
+    def in_waiting(self):
+        return self.port.in_waiting
+
+    def fileno(self):
+        return self.port.fileno()
+
+    def read(self, size=1):
+        return self._record(self.port.read(size))
+
+    def readline(self):
+        return self._record(self.port.readline())
+
+    def close(self):
+        self._file.close()
+        self.port.close()
+
+
+class SerialSource:
+    """The real IMU on a serial port, optionally recording the session to a file"""
+    def __init__(self, port=DEFAULT_SERIAL_PORT, baudrate=DEFAULT_BAUDRATE, record_to=None):
+        self.port = port
+        self.baudrate = baudrate
+        self.record_to = record_to
+
+    def open(self, timeout=None):
+        ser = serial.Serial(self.port, self.baudrate, timeout=timeout)
+        if self.record_to:
+            return RecordingPort(ser, self.record_to)
+        return ser
+
+
+class ReplaySource:
+    """Replays a session recorded by SerialSource(record_to=...); speed=2 is twice as fast, 0 is unthrottled"""
+    def __init__(self, path, speed=1.0):
+        self.path = path
+        self.speed = speed
+
+    def open(self, timeout=None):
+        return ReplayPort(self.path, self.speed)
+
+
+class SyntheticSource:
+    """
+    Generates samples at a configurable rate and waveform, forever or for
+    duration seconds. Extra channels are generated at their nominal rates.
+    """
+    def __init__(self, rate=1000, waveform='sine', frequency=1.0, amplitude=1.0, duration=None, channels=()):
+        if waveform not in WAVEFORMS:
+            raise ValueError(f"Unknown waveform: {waveform}")
+        self.rate = rate
+        self.waveform = waveform
+        self.frequency = frequency
+        self.amplitude = amplitude
+        self.duration = duration
+        self.channels = tuple(channels)
+
+    def open(self, timeout=None):
+        return SyntheticPort(self.rate, self.waveform, self.frequency, self.amplitude, self.duration, self.channels)
+
+
+def add_source_arguments(parser):
+    """Add the sample source options shared by the client CLIs"""
+    parser.add_argument('--source', type=str, default='serial', choices=('serial', 'replay', 'synthetic'), help='Where IMU samples come from')
+    parser.add_argument('--serial-port', type=str, default=DEFAULT_SERIAL_PORT, help='Serial device for --source serial')
+    parser.add_argument('--record-serial', type=str, default=None, help='Also record the serial session to this file')
+    parser.add_argument('--replay', type=str, default=None, help='Recorded session file for --source replay')
+    parser.add_argument('--speed', type=float, default=1.0, help='Replay speed multiplier, 0 replays as fast as possible')
+    parser.add_argument('--rate', type=float, default=1000, help='Samples per second for --source synthetic')
+    parser.add_argument('--waveform', type=str, default='sine', choices=WAVEFORMS, help='Waveform for --source synthetic')
+    parser.add_argument('--duration', type=float, default=None, help='Stop the synthetic source after this many seconds')
+    parser.add_argument('--device', type=str, default=None, help='Name the server records this sensor under, kept across reconnects')
+    parser.add_argument('--channels', type=str, nargs='*', default=[], choices=[channel.name for channel in EXTRA_CHANNELS],
+                        help='Extra channels to read and send besides accel and gyro')
+
+
+def source_from_args(args):
+    """Build the sample source selected on the command line"""
+    if args.source == 'replay':
+        if not args.replay:
+            raise ValueError("--source replay needs --replay FILE")
+        return ReplaySource(args.replay, args.speed)
+    if args.source == 'synthetic':
+        return SyntheticSource(rate=args.rate, waveform=args.waveform, duration=args.duration,
+                               channels=channels_from_args(args))
+    return SerialSource(args.serial_port, record_to=args.record_serial)
+
+
+def channels_from_args(args):
+    """Extra channels selected on the command line"""
+    return tuple(CHANNELS[name] for name in args.channels)
@@ -0,0 +1,145 @@
+import os
+import json
+import logging
+import datetime
+import dataclasses
+from collections import OrderedDict
+from aioquic.tls import SessionTicket, CipherSuite
+from .metrics import MetricFamily
+
+# Tickets a server process holds before the oldest are evicted
+DEFAULT_MAX_TICKETS = 10000
+
+
+class SessionTicketStore:
+    """
+    Server side: TLS session tickets issued by this process, for aioquic's
+    session_ticket_handler / session_ticket_fetcher hooks. Holds at most
+    `max_tickets`, evicting the oldest first, skips expired tickets, and hands
+    each ticket out once so a captured 0-RTT flight cannot resume twice.
+    """
+    def __init__(self, max_tickets=DEFAULT_MAX_TICKETS):
+        self.max_tickets = max_tickets
+        self.tickets = OrderedDict()
+        self.issued = 0
+        self.resumed = 0
+
+    def add(self, ticket):
+        self._expire()
+        self.tickets[ticket.ticket] = ticket
+        self.issued += 1
+        while len(self.tickets) > self.max_tickets:
+            self.tickets.popitem(last=False)
+
+    def pop(self, label):
+        ticket = self.tickets.pop(label, None)
+        if ticket is None or not ticket.is_valid:
+            return None
+        self.resumed += 1
+        return ticket
+
+    def collect(self):
+        """Metric families for the metrics endpoint"""
+        held = MetricFamily('imu_tls_tickets', 'gauge', 'Session tickets held for resumption')
+        held.add(len(self.tickets))
+        counts = MetricFamily('imu_tls_tickets_total', 'counter', 'Session tickets issued and redeemed')
+        counts.add(self.issued, outcome='issued')
+        counts.add(self.resumed, outcome='resumed')
+        return [held, counts]
+
+    def _expire(self):
+        # Every ticket gets the same lifetime, so insertion order is expiry order
+        while self.tickets:
+            oldest = next(iter(self.tickets.values()))
+            if oldest.is_valid:
+                break
+            self.tickets.popitem(last=False)
+
+
+def ticket_to_dict(ticket):
+    fields = {}
+    for field in dataclasses.fields(ticket):
+        value = getattr(ticket, field.name)
+        if isinstance(value, bytes):
+            value = value.hex()
+        elif isinstance(value, datetime.datetime):
+            value = value.isoformat()
+        elif field.name == 'other_extensions':
+            value = [[ext_type, data.hex()] for ext_type, data in value]
+        elif field.name == 'cipher_suite':
+            value = int(value)
+        fields[field.name] = value
+    return fields
+
+
+def ticket_from_dict(fields):
+    values = {}
+    for field in dataclasses.fields(SessionTicket):
+        value = fields[field.name] if field.name in fields else None
+        if field.name in ('resumption_secret', 'ticket'):
+            value = bytes.fromhex(value)
+        elif field.name in ('not_valid_before', 'not_valid_after'):
+            value = datetime.datetime.fromisoformat(value)
+        elif field.name == 'other_extensions':
+            value = [(ext_type, bytes.fromhex(data)) for ext_type, data in value or []]
+        elif field.name == 'cipher_suite':
+            value = CipherSuite(value)
+        values[field.name] = value
+    return SessionTicket(**values)
+
+
+class SessionTicketCache:
+    """
+    Client side: the newest session ticket per server name, kept across
+    reconnects and, with a path, across runs in a small JSON file.
+    """
+    def __init__(self, path=None):
+        self.path = path
+        self.tickets = {}
+        if path and os.path.exists(path):
+            try:
+                with open(path) as f:
+                    for fields in json.load(f):
+                        ticket = ticket_from_dict(fields)
+                        self.tickets[ticket.server_name] = ticket
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                logging.warning(f"Ignoring unreadable session ticket file {path}: {e}")
+
+    def store(self, ticket):
+        """session_ticket_handler for connect()"""
+        self.tickets[ticket.server_name] = ticket
+        if self.path:
+            self._save()
+
+    def _save(self):
+        tickets = [ticket_to_dict(ticket) for ticket in self.tickets.values() if ticket.is_valid]
+        tmp = f"{self.path}.tmp"
+        # Tickets hold resumption secrets, keep them private to the user
+        with open(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as f:
+            json.dump(tickets, f)
+        os.replace(tmp, self.path)
+
+    def load(self, server_name):
+        """The cached ticket for a server, None when there is none or it expired"""
+        ticket = self.tickets.get(server_name)
+        return ticket if ticket is not None and ticket.is_valid else None
+
+    def prepare(self, configuration, host):
+        """Put the cached ticket for host into a client configuration, True when it allows 0-RTT"""
+        if configuration.server_name is None:
+            configuration.server_name = host
+        ticket = self.load(configuration.server_name)
+        configuration.session_ticket = ticket
+        return ticket is not None and ticket.max_early_data_size is not None
+
+
+def resume_options(cache, configuration, host):
+    """
+    connect() keyword arguments for resuming a cached session. With a 0-RTT
+    ticket connect() returns before the handshake completes, so the stream
+    headers and first samples written go out as early data.
+    """
+    if cache is None:
+        return {}
+    early_data = cache.prepare(configuration, host)
+    return dict(session_ticket_handler=cache.store, wait_connected=not early_data)
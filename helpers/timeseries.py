@@ -0,0 +1,78 @@
+import numpy as np
+from .codec import RECORD_DTYPE
+
+# 10 s of history at 1 kHz per channel
+DEFAULT_HISTORY = 10000
+
+
+class RingSeries:
+    """
+    Fixed-capacity ring buffer of sample records for one channel.
+    Every record is written twice, at i and i + capacity, so the newest
+    `capacity` samples are always one contiguous slice and window queries
+    can return views instead of copies.
+    """
+    def __init__(self, capacity=DEFAULT_HISTORY, dtype=RECORD_DTYPE):
+        self.capacity = capacity
+        self._data = np.zeros(2 * capacity, dtype=dtype)
+        self._head = 0          # Next write position in [0, capacity)
+        self.count = 0          # Samples currently held
+        self.total = 0          # Samples ever appended
+
+    def __len__(self):
+        return self.count
+
+    def _write(self, pos, chunk):
+        end = pos + len(chunk)
+        self._data[pos:end] = chunk
+        self._data[pos + self.capacity:end + self.capacity] = chunk
+
+    def append(self, records):
+        """Append a batch of records, overwriting the oldest once full"""
+        n = len(records)
+        if not n:
+            return
+        self.total += n
+        if n > self.capacity:
+            records = records[-self.capacity:]
+            n = self.capacity
+        first = min(n, self.capacity - self._head)
+        self._write(self._head, records[:first])
+        if first < n:
+            self._write(0, records[first:])
+        self._head = (self._head + n) % self.capacity
+        self.count = min(self.count + n, self.capacity)
+
+    def latest(self, n=None):
+        """View of the newest n samples (all held samples by default), oldest first"""
+        n = self.count if n is None else min(n, self.count)
+        end = self._head + self.capacity
+        return self._data[end - n:end]
+
+    def time_range(self, t0, t1):
+        """View of held samples with t0 <= ts < t1, assuming timestamps arrive in order"""
+        view = self.latest()
+        ts = view['ts']
+        start = np.searchsorted(ts, t0, side='left')
+        stop = np.searchsorted(ts, t1, side='left')
+        return view[start:stop]
+
+
+class SeriesStore:
+    """Ring buffers for every sensor channel of one connection"""
+    def __init__(self, capacity=DEFAULT_HISTORY):
+        self.capacity = capacity
+        self.channels = {}
+
+    def channel(self, sensor):
+        """Ring buffer for a sensor type, created on first use"""
+        series = self.channels.get(sensor)
+        if series is None:
+            series = self.channels[sensor] = RingSeries(self.capacity)
+        return series
+
+    def append(self, sensor, records):
+        self.channel(sensor).append(records)
+
+    def nbytes(self):
+        return sum(series._data.nbytes for series in self.channels.values())
@@ -61,10 +61,7 @@ class HttpServerProtocol(QuicConnectionProtocol):
         try:
             queue = self.data_queues.get(stream_id)
             while True:
-                if queue.empty():
-                    await asyncio.sleep(0)
-                    continue
-                data = queue.get_nowait()
+                data = await queue.get()
                 
                 if sensor_type == 'accel':
                     await self.process_accel_data(data)
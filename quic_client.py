@@ -1,23 +1,52 @@
-from client_files import IMUClient, IMUClientSingleStream, IMUClientNoPriority,IMUClientNoPriorityV2
+from client_files import IMUClient, IMUClientSingleStream, IMUClientNoPriority,IMUClientNoPriorityV2, IMUClientDatagram
 import argparse
 import asyncio
+from helpers.sources import add_source_arguments, source_from_args, channels_from_args
+from helpers.rate_control import RateController
+from helpers.codec import SENSOR_ACCEL, SENSOR_GYRO
+from helpers.ring import DROP_OLDEST, OVERFLOW_POLICIES
+from helpers.tickets import SessionTicketCache
+from helpers.session import add_session_arguments, session_from_args
 SERVER = "172.190.228.31"
 
 if __name__ == '__main__':
     argparse = argparse.ArgumentParser(description="QUIC Client for IMU Data")
     argparse.add_argument('--host', type=str, help='Host to connect to: local,server')
-    argparse.add_argument('--stream', type=str, help='Stream type: single, multi, no_priority')
+    argparse.add_argument('--stream', type=str, help='Stream type: single, multi, no_priority, no_priority_v2, datagram')
+    argparse.add_argument('--format', type=str, default='bin1', help='Wire format: text, bin1, dq1')
+    argparse.add_argument('--scales', type=float, nargs=2, metavar=('ACCEL', 'GYRO'), help='Units per int16 step for the dq1 format')
+    argparse.add_argument('--batch-bytes', type=int, default=1200, help='Flush a stream batch once it holds this many bytes')
+    argparse.add_argument('--linger-ms', type=float, default=2.0, help='Max time a sample waits in a batch (0 sends every sample)')
+    argparse.add_argument('--overflow', type=str, default=DROP_OLDEST, choices=OVERFLOW_POLICIES, help='What the serial reader does when the sender falls behind')
+    argparse.add_argument('--adaptive', action='store_true', help='Decimate or average samples when the link cannot keep up')
+    argparse.add_argument('--bulk-parse', action='store_true', help='Parse serial input in vectorized blocks instead of line by line')
+    argparse.add_argument('--session-file', type=str, default=None, help='Keep TLS session tickets in this file to resume later runs with 0-RTT')
+    add_source_arguments(argparse)
+    add_session_arguments(argparse)
     #get args 
     args = argparse.parse_args()
     if args.host == 'local':
         host= 'localhost'
     else:
         host = SERVER
+    options = dict(wire_format=args.format, max_batch_bytes=args.batch_bytes, max_linger=args.linger_ms / 1000,
+                   source=source_from_args(args), rate_control=RateController() if args.adaptive else None, overflow=args.overflow,
+                   session_cache=SessionTicketCache(args.session_file) if args.session_file else None,
+                   session=session_from_args(args), channels=channels_from_args(args))
     if args.stream == 'single':
-        client = IMUClientSingleStream()
+        client = IMUClientSingleStream(**options)
     elif args.stream == 'multi':
-        client = IMUClient()
+        client = IMUClient(**options)
     elif args.stream == 'no_priority':
-        client = IMUClientNoPriority()
+        client = IMUClientNoPriority(**options)
+    elif args.stream == 'no_priority_v2':
+        client = IMUClientNoPriorityV2(**options)
+    elif args.stream == 'datagram':
+        client = IMUClientDatagram(**options)
+    client.imu_parser.bulk = args.bulk_parse
+    if args.device:
+        client.encoder.options['device'] = args.device
+    if args.scales:
+        client.encoder.scales.update({SENSOR_ACCEL: args.scales[0], SENSOR_GYRO: args.scales[1]})
     print(client)
     asyncio.run(client.start(host))
\ No newline at end of file
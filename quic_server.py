@@ -1,13 +1,32 @@
 from aioquic.asyncio import QuicConnectionProtocol, serve
+from aioquic.asyncio.server import QuicServer
 from aioquic.quic.configuration import QuicConfiguration
 import asyncio
 from typing import Optional
 from aioquic.h3.connection import H3_ALPN, H3Connection
-from aioquic.quic.events import StreamDataReceived
-import time
+from aioquic.quic.events import StreamDataReceived, DatagramFrameReceived, ConnectionTerminated, StreamReset, HandshakeCompleted
 import argparse
 import logging
 import signal
+import socket
+import multiprocessing
+import multiprocessing.connection
+from collections import Counter
+from helpers.codec import parse_header_options, decode_batch, decode_rates, split_by_type, FORMAT_TEXT, RECORD_RATE
+from helpers.channels import CHANNELS
+from helpers.framing import StreamReassembler
+from helpers.latency import StreamStats
+from helpers.timeseries import SeriesStore, DEFAULT_HISTORY
+from helpers.recording import Recorder, device_name, FSYNC_INTERVAL, FSYNC_POLICIES
+from helpers.sinks import (SinkPipeline, DEFAULT_MAX_PENDING, FLUSH_INTERVAL, add_sink_arguments, sink_options,
+                           pipeline_from_options)
+from helpers.metrics import (MetricFamily, MetricsRegistry, MetricsServer, StreamMetrics, QuicMetrics, track_lost_packets,
+                             add_metrics_arguments, DEFAULT_METRICS_HOST)
+from helpers.tickets import SessionTicketStore, DEFAULT_MAX_TICKETS
+from helpers.session import SessionTable, AckTimer, DEFAULT_MAX_SESSIONS
+
+DATAGRAM_QUEUE = 'datagram'
+STATS_INTERVAL = 5
 
 # Set up logging
 import os
@@ -17,83 +36,214 @@ logging.basicConfig(level=logging.INFO,
                     format='%(asctime)s - %(levelname)s - %(message)s', 
                     filename='logs/quic_server.log')
 
+class ConnectionRegistry:
+    """Tracks every live connection so they can be reaped and shut down together"""
+    def __init__(self):
+        self.protocols = set()
+        self.total_connections = 0
+        # Samples per channel name from connections that have already been released
+        self.closed_counts = Counter()
+
+    def __len__(self):
+        return len(self.protocols)
+
+    def add(self, protocol):
+        self.protocols.add(protocol)
+        self.total_connections += 1
+        protocol.connection_number = self.total_connections
+        logging.info(f"Connection opened ({len(self.protocols)} active, {self.total_connections} total)")
+
+    def discard(self, protocol):
+        if protocol in self.protocols:
+            self.protocols.discard(protocol)
+            self.closed_counts.update(protocol.sample_counts)
+            logging.info(f"Connection released ({len(self.protocols)} active)")
+
+    def sample_counts(self):
+        """Samples processed per channel name, by live and released connections"""
+        counts = Counter(self.closed_counts)
+        for protocol in self.protocols:
+            counts.update(protocol.sample_counts)
+        return counts
+
+    def log_stats(self):
+        """Log connection and sample totals for this process"""
+        counts = self.sample_counts()
+        samples = ' '.join(f"{channel.name} samples={counts[channel.name]}" for channel in CHANNELS if channel.name in counts)
+        logging.info(f"Stats: {len(self.protocols)} active connections, {self.total_connections} total | "
+                     f"{samples or 'no samples'}")
+        for protocol in self.protocols:
+            protocol.process_rate_logging()
+
+    def collect_metrics(self):
+        """Metric families for every live connection and its streams"""
+        connections = MetricFamily('imu_connections', 'gauge', 'Open connections')
+        connections.add(len(self.protocols))
+        opened = MetricFamily('imu_connections_total', 'counter', 'Connections accepted')
+        opened.add(self.total_connections)
+        samples = MetricFamily('imu_samples_total', 'counter', 'Samples processed, by sensor')
+        for sensor, count in sorted(self.sample_counts().items()):
+            samples.add(count, sensor=sensor)
+        dropped = MetricFamily('imu_datagrams_dropped_total', 'counter', 'Datagrams dropped on a full queue')
+        batches = MetricFamily('imu_batches_dropped_total', 'counter', 'Stream batches dropped on a full queue')
+        headers = MetricFamily('imu_invalid_headers_total', 'counter', 'Streams opened with a header that failed to parse')
+        quic = QuicMetrics()
+        streams = StreamMetrics()
+        # A device that reconnected before its old connection timed out is reported through its newest one
+        latest = {}
+        for protocol in sorted(self.protocols, key=lambda protocol: protocol.connection_number):
+            latest[protocol.device_id] = protocol
+        for device, protocol in latest.items():
+            dropped.add(protocol.datagrams_dropped, device=device)
+            batches.add(protocol.batches_dropped, device=device)
+            headers.add(protocol.invalid_headers, device=device)
+            quic.add(protocol._quic, device=device)
+            for stream_id, stats in list(protocol.stream_stats.items()):
+                queue = protocol.data_queues.get(stream_id)
+                streams.add(stats, queue.qsize() if queue is not None else None, device=device,
+                            stream=stream_id, tag=protocol.stream_tags.get(stream_id, ''))
+        return [connections, opened, samples, dropped, batches, headers] + quic.families() + streams.families()
+
+    async def report_stats(self, interval=STATS_INTERVAL):
+        """Periodically log stats until cancelled"""
+        while True:
+            await asyncio.sleep(interval)
+            self.log_stats()
+
+    async def shutdown(self):
+        """Shut down every registered connection in parallel"""
+        protocols = list(self.protocols)
+        results = await asyncio.gather(*(protocol.shutdown() for protocol in protocols), return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                logging.error(f"Error shutting down connection: {result}")
+
 class HttpServerProtocol(QuicConnectionProtocol):
-    def __init__(self, *args, **kwargs) -> None:
+    def __init__(self, *args, registry: Optional[ConnectionRegistry] = None, history: int = DEFAULT_HISTORY,
+                 recorder: Optional[Recorder] = None, sink: Optional[SinkPipeline] = None,
+                 sessions: Optional[SessionTable] = None, **kwargs) -> None:
         super().__init__(*args, **kwargs)
         self._http: Optional[H3Connection] = None
+        self.registry = registry
+        # Recent samples per sensor channel, readable through registry.protocols
+        self.series = SeriesStore(history)
+        self.recorder = recorder
+        # Where decoded samples go, shared by every connection of the process
+        self.sink = sink
+        # Reliable sessions of the process, for dropping replayed samples the server already has
+        self.sessions = sessions
+        self.session_id = None
+        self._acks = None
+        self._ack_stream = None
+        self._device_id = None
         self.data_queues = {}
-        self.accel_queue = None
-        self.gyro_queue = None
-        self.dual_queue = None
-        self.accel_count = 0
-        self.gyro_count = 0
-        self.accel_last_log = time.time()
-        self.gyro_last_log = time.time()
-        self._start_time = time.time()
+        self.reassemblers = {}
+        # Latency, inter-arrival and loss per stream, with the tag each stream opened with
+        self.stream_stats = {}
+        self.stream_tags = {}
+        # Channel ids each stream carries, so a stopped handler only rewinds its own channels
+        self.stream_sensors = {}
+        # Streams whose stop sentinel did not fit, their handler stops once its queue is drained
+        self._ending = set()
+        self.datagrams_dropped = 0
+        # Stream batches dropped because their handler fell 1000 batches behind
+        self.batches_dropped = 0
+        # Set once data was dropped that a later batch must not be acknowledged past, nothing more is taken in
+        self._abandoned = False
+        self.invalid_headers = 0
+        # Rate each sensor is sent at, as announced by clients that reduce it under congestion
+        self.effective_rates = {}
+        # Samples processed per channel name
+        self.sample_counts = Counter()
         self._shutdown = False
-        self._processing_task = None
-    def process_rate_logging(self, sensor_type):
-        """Log the rate of incoming data"""
-        now = time.time()
-        if sensor_type == 'accel' or sensor_type == 'both':
-            rate = self.accel_count / (now - self._start_time)
-            logging.info(f"Accel rate: {rate:.2f} msgs/sec over {now - self._start_time:.2f} seconds")
-        elif sensor_type == 'gyro' or sensor_type == 'both':
-            rate = self.gyro_count / (now - self._start_time)
-            logging.info(f"Gyro rate: {rate:.2f} msgs/sec over {now - self._start_time:.2f} seconds")
-    async def process_accel_data(self, data):
-        """Process accelerometer data"""
-        try:
-            accel = list(map(float, data.split(":")[1].split(",")))
-            self.accel_count += 1
-            now = time.time()
-            if now - self.accel_last_log >= 5:
-                self.accel_last_log = now
-                self.process_rate_logging('accel')
-            print(f"Accel: X={accel[0]:.2f} Y={accel[1]:.2f} Z={accel[2]:.2f}")
-        except Exception as e:
-            logging.error(f"Error processing accel data: {e}")
+        self._processing_tasks = {}
+        self._closing_task = None
+        track_lost_packets(self._quic)
+        if self.registry is not None:
+            self.registry.add(self)
+    @property
+    def device_id(self):
+        """Name under which this connection's data is recorded, set by its first stream header"""
+        if self._device_id is None:
+            self._device_id = self.peer_name()
+        return self._device_id
+
+    def device_connected(self, device):
+        """Whether another live connection records under the same device name, e.g. after a reconnect"""
+        return self.registry is not None and any(protocol._device_id == device for protocol in self.registry.protocols)
+
+    def peer_name(self):
+        host, port = self._quic._network_paths[0].addr[:2]
+        return f"{host}_{port}"
 
-    async def process_gyro_data(self, data):
-        """Process gyroscope data"""
+    def process_rate_logging(self, stream_id=None, windowed=True):
+        """Log sliding-window (or lifetime) rate, latency, inter-arrival and loss for one stream or all of them"""
+        stream_ids = list(self.stream_stats) if stream_id is None else [stream_id]
+        for sid in stream_ids:
+            stats = self.stream_stats.get(sid)
+            if stats is not None:
+                logging.info(f"{self.stream_tags[sid].capitalize()} stream {sid} {stats.summary(windowed)}")
+        if DATAGRAM_QUEUE in stream_ids and self.datagrams_dropped:
+            logging.info(f"Datagrams dropped on full queue={self.datagrams_dropped}")
+    async def process_channel_data(self, channel, records):
+        """Process a block of decoded records of one channel"""
+        self.sample_counts[channel.name] += len(records)
+        if self.sink:
+            self.sink.submit(self.device_id, channel.name, records)
+
+    def process_rate_announcements(self, records):
+        """Track the send rate a client announced for each sensor, logging changes"""
+        for sensor, rate, factor, mode in decode_rates(records):
+            previous = self.effective_rates.get(sensor)
+            self.effective_rates[sensor] = (rate, factor, mode)
+            if previous is None or previous[1:] != (factor, mode):
+                name = CHANNELS[sensor].name if sensor in CHANNELS else f"channel {sensor}"
+                logging.info(f"Client sends {name} at {rate:.1f} samples/sec ({mode}, factor {factor})")
+
+    async def process_records(self, records):
+        """Dispatch a batch of binary records by sensor type, through the channel registry"""
         try:
-            gyro = list(map(float, data.split(":")[1].split(",")))
-            self.gyro_count += 1
-            now = time.time()
-            if now - self.gyro_last_log >= 5:
-                self.gyro_last_log = now
-                self.process_rate_logging('gyro')
-            print(f"Gyro: X={gyro[0]:.2f} Y={gyro[1]:.2f} Z={gyro[2]:.2f}")
+            for sensor, block in split_by_type(records):
+                channel = CHANNELS.get(sensor)
+                if channel is None:
+                    if sensor == RECORD_RATE:
+                        self.process_rate_announcements(block)
+                    continue
+                self.series.append(sensor, block)
+                if self.recorder:
+                    self.recorder.append(self.device_id, channel.name, block)
+                await self.process_channel_data(channel, block)
+            if self.session_id is not None:
+                # Only now may the client forget these samples
+                self.sessions.commit(self.session_id, records)
         except Exception as e:
-            logging.error(f"Error processing gyro data: {e}")
+            logging.error(f"Error processing binary records: {e}")
 
     async def handle_stream(self, stream_id, sensor_type):
         """Handle data stream processing"""
+        queue = self.data_queues.get(stream_id)
+        cancelled = False
         try:
             logging.info(f"Starting to handle {sensor_type} stream")
-            queue = self.data_queues.get(stream_id)
             if queue is None:
                 return
 
             while not self._shutdown or not queue.empty():
                 try:
                     data = await queue.get()
-                    if data == '0':  # Sentinel value for shutdown
-                        self.process_rate_logging(sensor_type)
+                    if isinstance(data, str) and data == '0':  # Sentinel value for shutdown
+                        self.process_rate_logging(stream_id, windowed=False)
                         break
 
-                    if sensor_type == 'accel':
-                        await self.process_accel_data(data)
-                    elif sensor_type == 'gyro':
-                        await self.process_gyro_data(data)
-                    elif sensor_type == 'both':
-                        if data.startswith("ACCEL:"):
-                            await self.process_accel_data(data)
-                        elif data.startswith("GYRO:"):
-                            await self.process_gyro_data(data)
+                    # Every queue item is a batch of records, whatever the wire format
+                    await self.process_records(data)
 
                     queue.task_done()
+                    if stream_id in self._ending and queue.empty():
+                        self.process_rate_logging(stream_id, windowed=False)
+                        break
                 except asyncio.CancelledError:
+                    cancelled = True
                     break
                 except Exception as e:
                     logging.error(f"Error in stream handler: {e}")
@@ -102,53 +252,185 @@ class HttpServerProtocol(QuicConnectionProtocol):
             logging.info(f"Finished processing {sensor_type} stream")
         except Exception as e:
             logging.error(f"Stream handler error: {e}")
+        finally:
+            if self.session_id is not None and (cancelled or (queue is not None and not queue.empty())):
+                # Batches taken in but never processed have to be taken in again when the client replays them
+                self.sessions.rewind(self.session_id, self.stream_sensors.get(stream_id, ()))
+            # The handler owns its stream's state, release it once it stops
+            self.data_queues.pop(stream_id, None)
+            self.reassemblers.pop(stream_id, None)
+            self.stream_stats.pop(stream_id, None)
+            self.stream_tags.pop(stream_id, None)
+            self.stream_sensors.pop(stream_id, None)
+            self._ending.discard(stream_id)
+            self._processing_tasks.pop(stream_id, None)
+
+    def open_stream(self, stream_id, sensor_type, channels=()):
+        """Create the queue and handler task for a new stream, tagged with a channel name, `both` or `datagram`"""
+        queue = asyncio.Queue(maxsize=1000)
+        self.data_queues[stream_id] = queue
+        self.stream_stats[stream_id] = StreamStats()
+        self.stream_tags[stream_id] = sensor_type
+        self.stream_sensors[stream_id] = [channel.id for channel in channels]
+        self._processing_tasks[stream_id] = asyncio.create_task(
+            self.handle_stream(stream_id, sensor_type)
+        )
+        return queue
+
+    def close_stream(self, stream_id):
+        """Ask a stream's handler to finish what is queued and stop"""
+        self.reassemblers.pop(stream_id, None)
+        queue = self.data_queues.get(stream_id)
+        if queue is None:
+            return
+        try:
+            queue.put_nowait('0')  # Sentinel value to stop processing
+        except asyncio.QueueFull:
+            # A full queue keeps its handler busy, it stops once it has worked through what it has taken in
+            # and shutdown() cancels it if that takes too long
+            self._ending.add(stream_id)
 
     def quic_event_received(self, event) -> None:
         if self._shutdown:
             return
 
-        if isinstance(event, StreamDataReceived):
+        if isinstance(event, DatagramFrameReceived):
+            self.receive_datagram(event.data)
+
+        elif isinstance(event, StreamDataReceived):
             stream_id = event.stream_id
             queue = self.data_queues.get(stream_id)
             
             if queue is None:
                 try:
-                    data = event.data.decode().strip()
-                except UnicodeDecodeError:
-                    logging.error("Received non-decodable data")
+                    tag, fmt, options, rest = parse_header_options(event.data)
+                    # The channels the stream carries, checked against ours
+                    channels = CHANNELS.stream_channels(tag, options)
+                    device = device_name(options, self.peer_name())
+                except (UnicodeDecodeError, ValueError) as e:
+                    self.invalid_headers += 1
+                    logging.error(f"Received invalid stream header: {e}")
                     return
 
-                if data.startswith("accel"):
-                    self.accel_queue = asyncio.Queue(maxsize=1000)
-                    self.data_queues[stream_id] = self.accel_queue
-                    logging.info("Accel stream connected")
-                    self._processing_task = asyncio.create_task(
-                        self.handle_stream(stream_id, 'accel')
-                    )
-                    
-                elif data.startswith("gyro"):
-                    self.gyro_queue = asyncio.Queue(maxsize=1000)
-                    self.data_queues[stream_id] = self.gyro_queue
-                    logging.info("Gyro stream connected")
-                    self._processing_task = asyncio.create_task(
-                        self.handle_stream(stream_id, 'gyro')
-                    )
-
-                elif data.startswith("both"):
-                    self.dual_queue = asyncio.Queue(maxsize=1000)
-                    self.data_queues[stream_id] = self.dual_queue
-                    logging.info("Dual stream connected")
-                    self._processing_task = asyncio.create_task(
-                        self.handle_stream(stream_id, 'both')
-                    )
+                if self._device_id is None:
+                    self._device_id = device
+                self.open_stream(stream_id, tag, channels)
+                logging.info(f"{tag.capitalize()} stream connected ({fmt}, {', '.join(channel.name for channel in channels)})")
+                self.reassemblers[stream_id] = StreamReassembler(fmt, channels)
+                self.join_session(options.get('session'), fmt)
+                if rest:
+                    self.receive_payload(stream_id, self.data_queues[stream_id], rest)
             else:
-                try:
-                    data = event.data.decode()
-                    while '\n' in data:
-                        line, data = data.split('\n', 1)
-                        queue.put_nowait(line)
-                except Exception as e:
-                    logging.error(f"Error processing incoming data: {e}")
+                self.receive_payload(stream_id, queue, event.data)
+
+            if event.end_stream:
+                self.close_stream(stream_id)
+
+        elif isinstance(event, StreamReset):
+            logging.info(f"Stream {event.stream_id} reset by peer (code {event.error_code})")
+            self.close_stream(event.stream_id)
+
+        elif isinstance(event, HandshakeCompleted):
+            if event.session_resumed:
+                logging.info(f"Session resumed (early data {'accepted' if event.early_data_accepted else 'not used'})")
+
+        elif isinstance(event, ConnectionTerminated):
+            logging.info(f"Connection terminated (code {event.error_code}, reason {event.reason_phrase!r})")
+            self._closing_task = asyncio.create_task(self.shutdown())
+
+    def join_session(self, session, fmt):
+        """Deduplicate and acknowledge this connection's streams under a client's reliable session id"""
+        if not session or self.sessions is None or fmt == FORMAT_TEXT or session == self.session_id:
+            return
+        self.session_id = session
+        if self._acks is not None:
+            self._acks.cancel()
+        self._acks = AckTimer(self.sessions, session, self.send_acks)
+        # Tell a reconnecting client right away what it no longer needs to replay
+        self._acks.flush()
+        logging.info(f"Stream joined reliable session {session}")
+
+    def send_acks(self, data):
+        """Send acknowledgement records on a stream of our own, opened on first use"""
+        if self._shutdown:
+            return
+        if self._ack_stream is None:
+            self._ack_stream = self._quic.get_next_available_stream_id(is_unidirectional=True)
+        self._quic.send_stream_data(self._ack_stream, data)
+        self.transmit()
+
+    def receive_datagram(self, payload):
+        """Decode a datagram of binary records and track loss and reordering"""
+        queue = self.data_queues.get(DATAGRAM_QUEUE)
+        if queue is None:
+            queue = self.open_stream(DATAGRAM_QUEUE, 'both')
+            logging.info("Datagram channel connected")
+        stats = self.stream_stats[DATAGRAM_QUEUE]
+        stats.messages += 1
+        stats.bytes += len(payload)
+        try:
+            records, _ = decode_batch(payload)
+            stats.observe(records)
+            queue.put_nowait(records)
+        except asyncio.QueueFull:
+            # Stale samples are not worth buffering, drop rather than stall
+            self.datagrams_dropped += 1
+        except Exception as e:
+            stats.parse_errors += 1
+            logging.error(f"Error processing datagram: {e}")
+
+    def receive_payload(self, stream_id, queue, payload):
+        """Reassemble stream data and queue the completed records as one batch"""
+        stats = self.stream_stats.get(stream_id)
+        if self._abandoned:
+            return
+        try:
+            stats.messages += 1
+            stats.bytes += len(payload)
+            records = self.reassemblers[stream_id].feed(payload)
+            if len(records) and queue.full():
+                self.drop_batch(stream_id)
+                return
+            if len(records) and self._acks is not None:
+                # Replayed samples this session already delivered are dropped before anything counts them
+                records = self.sessions.accept(self.session_id, records)
+                self._acks.schedule()
+            if len(records):
+                stats.observe(records)
+                queue.put_nowait(records)
+        except ValueError as e:
+            if stats is not None:
+                stats.parse_errors += 1
+            reassembler = self.reassemblers.get(stream_id)
+            if reassembler is not None and reassembler.broken:
+                # Undecodable data leaves no way to resynchronise with the stream
+                self.abandon(f"Stream {stream_id} is corrupt: {e}")
+            else:
+                logging.error(f"Error processing incoming data: {e}")
+        except Exception as e:
+            if stats is not None:
+                stats.parse_errors += 1
+            logging.error(f"Error processing incoming data: {e}")
+
+    def drop_batch(self, stream_id):
+        """
+        Drop a batch the stream's handler has no room for. On a reliable
+        session the batch is never taken in, and since acknowledgements are
+        cumulative no later batch may be either: the connection is closed
+        and the client replays from its last acknowledged sample.
+        """
+        self.batches_dropped += 1
+        if self._acks is None:
+            logging.warning(f"Stream {stream_id} queue full, dropping a batch")
+            return
+        self.abandon(f"Stream {stream_id} queue full, session {self.session_id} has to replay")
+
+    def abandon(self, reason):
+        """Take in nothing more and close the connection, a reliable client then replays what was not acknowledged"""
+        self._abandoned = True
+        logging.error(f"Closing the connection: {reason}")
+        self._quic.close(error_code=0, reason_phrase=reason[:100])
+        self.transmit()
 
     async def shutdown(self):
         """Gracefully shutdown the protocol"""
@@ -157,70 +439,115 @@ class HttpServerProtocol(QuicConnectionProtocol):
             
         self._shutdown = True
         logging.info("Starting protocol shutdown")
+        if self._acks is not None:
+            self._acks.cancel()
         
-        # Signal queues to stop
-        for queue in self.data_queues.values():
-            try:
-                await queue.put('0')  # Sentinel value to stop processing
-            except Exception as e:
-                logging.error(f"Error putting sentinel to queue: {e}")
+        # Signal every stream handler to stop
+        for stream_id in list(self.data_queues):
+            self.close_stream(stream_id)
             
-        # Wait for processing task to complete
-        if self._processing_task:
-            try:
-                await asyncio.wait_for(self._processing_task, timeout=5.0)
-            except asyncio.TimeoutError:
-                self._processing_task.cancel()
-                try:
-                    await self._processing_task
-                except asyncio.CancelledError:
-                    pass
-            except Exception as e:
-                logging.error(f"Error during shutdown: {e}")
+        # Wait for all processing tasks to complete
+        tasks = list(self._processing_tasks.values())
+        if tasks:
+            done, pending = await asyncio.wait(tasks, timeout=5.0)
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+        if self.registry is not None:
+            self.registry.discard(self)
+        if self.recorder and self._device_id and not self.device_connected(self._device_id):
+            self.recorder.close_device(self._device_id)
                 
         logging.info("Protocol shutdown complete")
 
+async def serve_reuseport(host, port, configuration, create_protocol, session_ticket_fetcher=None, session_ticket_handler=None):
+    """
+    Same as aioquic's serve(), but binds the UDP socket with SO_REUSEPORT so
+    several worker processes can share the port. The kernel picks a socket by
+    hashing the packet's address 4-tuple, so a client's packets keep landing
+    on the same worker for the lifetime of its connection.
+    """
+    family, type_, proto, _, addr = socket.getaddrinfo(host, port, type=socket.SOCK_DGRAM)[0]
+    sock = socket.socket(family, type_, proto)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind(addr)
+    loop = asyncio.get_running_loop()
+    _, protocol = await loop.create_datagram_endpoint(
+        lambda: QuicServer(configuration=configuration, create_protocol=create_protocol,
+                           session_ticket_fetcher=session_ticket_fetcher, session_ticket_handler=session_ticket_handler),
+        sock=sock,
+    )
+    return protocol
+
 async def run_server(
     host: str,
     port: int,
     configuration: QuicConfiguration,
-    shutdown_event: asyncio.Event
+    shutdown_event: asyncio.Event,
+    reuse_port: bool = False,
+    history: int = DEFAULT_HISTORY,
+    recorder: Optional[Recorder] = None,
+    sink: Optional[SinkPipeline] = None,
+    metrics: Optional[MetricsRegistry] = None,
+    tickets: Optional[SessionTicketStore] = None,
+    sessions: Optional[SessionTable] = None,
+    protocol_class: type = HttpServerProtocol,
+    ready: Optional[asyncio.Event] = None
 ) -> None:
     server = None
-    protocol = None
+    registry = ConnectionRegistry()
+    stats_task = None
+    if metrics is not None:
+        metrics.register(registry.collect_metrics)
     
     def protocol_factory(*args, **kwargs):
-        nonlocal protocol
-        protocol = HttpServerProtocol(*args, **kwargs)
-        return protocol
+        return protocol_class(*args, registry=registry, history=history, recorder=recorder,
+                              sink=sink, sessions=sessions, **kwargs)
+
+    # Issuing and accepting session tickets is what lets clients resume with 0-RTT
+    ticket_hooks = dict(session_ticket_fetcher=tickets.pop, session_ticket_handler=tickets.add) if tickets is not None else {}
 
     try:
-        server = await serve(
-            host,
-            port,
-            configuration=configuration,
-            create_protocol=protocol_factory,
-        )
+        if reuse_port:
+            server = await serve_reuseport(host, port, configuration, protocol_factory, **ticket_hooks)
+        else:
+            server = await serve(
+                host,
+                port,
+                configuration=configuration,
+                create_protocol=protocol_factory,
+                **ticket_hooks,
+            )
         
         logging.info(f"Server started on {host}:{port}")
+        if ready is not None:
+            ready.set()
+        stats_task = asyncio.create_task(registry.report_stats())
         await shutdown_event.wait()
         logging.info("Server shutdown initiated")
         
     except asyncio.CancelledError:
         logging.info("Server received cancellation")
     finally:
+        if stats_task:
+            stats_task.cancel()
         if server:
-            if protocol:
-                await protocol.shutdown()
+            await registry.shutdown()
+            registry.log_stats()
             server.close()
             await asyncio.sleep(0.1)
 
 def handle_sigint(shutdown_event: asyncio.Event):
-    """Signal handler for SIGINT"""
-    logging.info("Received SIGINT, initiating shutdown")
+    """Signal handler for SIGINT and SIGTERM"""
+    logging.info("Received shutdown signal, initiating shutdown")
     shutdown_event.set()
 
-async def main():
+async def main(host, reuse_port=False, history=DEFAULT_HISTORY, record_dir=None, fsync=FSYNC_INTERVAL,
+               sinks=None, sink_buffer=DEFAULT_MAX_PENDING, sink_interval=FLUSH_INTERVAL, metrics_port=None,
+               metrics_host=DEFAULT_METRICS_HOST, max_tickets=DEFAULT_MAX_TICKETS, max_sessions=DEFAULT_MAX_SESSIONS,
+               protocol_class=HttpServerProtocol,
+               ready=None):
     configuration = QuicConfiguration(
         is_client=False,
         alpn_protocols=["h3"],
@@ -228,21 +555,32 @@ async def main():
     )
     configuration.load_cert_chain("ssl_cert.pem", "ssl_key.pem")
     
-    parser = argparse.ArgumentParser(description="QUIC Server for IMU Data")
-    parser.add_argument('--host', type=str, default='local', help='Host to connect to')
-    args = parser.parse_args()
-    
-    host = 'localhost' if args.host == 'local' else "0.0.0.0"
-    
+    # Each process maps its own recording segments
+    recorder = Recorder(record_dir, fsync=fsync) if record_dir else None
+    sink = pipeline_from_options(sinks, sink_buffer, sink_interval)
+    # Tickets live in this process only, a worker cannot resume another worker's sessions
+    tickets = SessionTicketStore(max_tickets) if max_tickets else None
+    # Likewise for reliable sessions, a client that reconnects to another worker may see duplicates
+    sessions = SessionTable(max_sessions) if max_sessions else None
+    metrics = MetricsServer(metrics_host, metrics_port) if metrics_port else None
+    if metrics:
+        await metrics.start()
+        if sink:
+            metrics.registry.register(sink.collect)
+        if tickets is not None:
+            metrics.registry.register(tickets.collect)
+        if sessions is not None:
+            metrics.registry.register(sessions.collect)
     shutdown_event = asyncio.Event()
     loop = asyncio.get_running_loop()
     
-    # Set up signal handler
+    # Set up signal handlers, SIGTERM is how the parent stops worker processes
     try:
-        loop.add_signal_handler(
-            signal.SIGINT, 
-            lambda: handle_sigint(shutdown_event)
-        )
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(
+                signum, 
+                lambda: handle_sigint(shutdown_event)
+            )
     except NotImplementedError:
         logging.warning("Signal handlers not supported on this platform")
     
@@ -251,15 +589,93 @@ async def main():
             host=host,
             port=4433,
             configuration=configuration,
-            shutdown_event=shutdown_event
+            shutdown_event=shutdown_event,
+            reuse_port=reuse_port,
+            history=history,
+            recorder=recorder,
+            sink=sink,
+            metrics=metrics.registry if metrics else None,
+            tickets=tickets,
+            sessions=sessions,
+            protocol_class=protocol_class,
+            ready=ready
         )
     except Exception as e:
         logging.error(f"Server error: {e}")
+    finally:
+        if metrics:
+            await metrics.close()
+        if sink:
+            await sink.close()
+        if recorder:
+            recorder.close()
+
+def worker_main(host, worker_id, options):
+    """Entry point of one worker process"""
+    # Tag every log line with the worker so each one's stats can be told apart
+    formatter = logging.Formatter(f'%(asctime)s - worker-{worker_id} - %(levelname)s - %(message)s')
+    for handler in logging.getLogger().handlers:
+        handler.setFormatter(formatter)
+    if options.get('metrics_port'):
+        # Every worker serves its own metrics, on consecutive ports
+        options = dict(options, metrics_port=options['metrics_port'] + worker_id)
+    try:
+        asyncio.run(main(host, reuse_port=True, **options))
+    except KeyboardInterrupt:
+        pass
+
+def run_workers(host, workers, options):
+    """Run one server process per worker, all sharing the UDP port"""
+    processes = [
+        multiprocessing.Process(target=worker_main, args=(host, i, options), name=f"worker-{i}")
+        for i in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    logging.info(f"Started {workers} workers")
+
+    def stop_workers(*_):
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+    signal.signal(signal.SIGINT, stop_workers)
+    signal.signal(signal.SIGTERM, stop_workers)
+
+    # Workers stop together: as soon as one exits, ask the rest to shut down
+    multiprocessing.connection.wait([process.sentinel for process in processes])
+    stop_workers()
+    for process in processes:
+        process.join(timeout=10)
+        if process.is_alive():
+            process.kill()
+    logging.info("All workers stopped")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="QUIC Server for IMU Data")
+    parser.add_argument('--host', type=str, default='local', help='Host to connect to')
+    parser.add_argument('--workers', type=int, default=1, help='Number of server processes sharing the port via SO_REUSEPORT')
+    parser.add_argument('--history', type=int, default=DEFAULT_HISTORY, help='Samples kept in memory per connection and sensor')
+    parser.add_argument('--record', type=str, default=None, help='Directory to record all received samples to')
+    parser.add_argument('--fsync', type=str, default=FSYNC_INTERVAL, choices=FSYNC_POLICIES, help='When recordings are forced to disk')
+    add_sink_arguments(parser)
+    add_metrics_arguments(parser)
+    parser.add_argument('--max-tickets', type=int, default=DEFAULT_MAX_TICKETS, help='TLS session tickets kept per process for 0-RTT resumption, 0 disables resumption')
+    parser.add_argument('--max-sessions', type=int, default=DEFAULT_MAX_SESSIONS, help='Reliable client sessions remembered per process to drop replayed samples, 0 disables acknowledgements')
+    args = parser.parse_args()
+    
+    host = 'localhost' if args.host == 'local' else "0.0.0.0"
+    options = dict(history=args.history, record_dir=args.record, fsync=args.fsync, metrics_port=args.metrics_port,
+                   metrics_host=args.metrics_host, max_tickets=args.max_tickets, max_sessions=args.max_sessions,
+                   **sink_options(args))
+    if args.workers > 1 and args.max_sessions:
+        logging.warning("Reliable sessions are tracked per worker, a client that reconnects to another worker may have its replay recorded twice")
     try:
-        asyncio.run(main())
+        if args.workers > 1:
+            run_workers(host, args.workers, options)
+        else:
+            asyncio.run(main(host, **options))
     except KeyboardInterrupt:
         logging.info("KeyboardInterrupt received")
     except Exception as e:
-        logging.error(f"Fatal error: {e}")
\ No newline at end of file
+        logging.error(f"Fatal error: {e}")
@@ -1,15 +1,32 @@
+import time
 import socket
-from queue import Queue
+import argparse
 from threading import Thread
-import time
 import traceback
-from helpers import IMUParser
+from helpers import IMUParser, SampleEncoder, FORMAT_BINARY, SENSOR_ACCEL, SENSOR_GYRO, SampleBridge
+from helpers.sources import add_source_arguments, source_from_args, channels_from_args
+from helpers.rate_control import RateController
+from helpers.ring import DROP_OLDEST, OVERFLOW_POLICIES
+from helpers.bridge import IDLE_TIMEOUT, ChannelRings
+from helpers.framing import StreamReassembler
+from helpers.session import add_session_arguments, session_from_args
 
 class TCPIMUClient:
-    def __init__(self, host='172.190.228.31', port=5555):
-        self.accel_queue = Queue(maxsize=100)
-        self.gyro_queue = Queue(maxsize=100)
-        self.imu_parser = IMUParser()
+    def __init__(self, host='172.190.228.31', port=5555, wire_format=FORMAT_BINARY, source=None, rate_control=None, overflow=DROP_OLDEST, session=None, channels=()):
+        self.bridge = SampleBridge()
+        # Accel and gyro, plus any extra channels such as the magnetometer
+        self.channels = ChannelRings(self.bridge, channels, overflow=overflow)
+        self.samples = self.channels.imu
+        self.imu_parser = IMUParser(source=source)
+        self.encoder = SampleEncoder(wire_format)
+        self.rate_control = rate_control
+        self.encoder.rate_control = rate_control
+        if rate_control:
+            rate_control.attach(self.channels.rings())
+        # ReliableSession that reconnects after outages and replays what the server has not acknowledged
+        self.session = session
+        if session:
+            session.bind(self.encoder, wakeup=self.bridge.notify)
         self.running = False
         self.host = host
         self.port = port
@@ -18,37 +35,105 @@ class TCPIMUClient:
         """Main function to start the client"""
         # Start serial reader thread
         self.running = True
-        serial_thread = Thread(target=self.imu_parser.read_serial, args=(self.accel_queue, self.gyro_queue))
+        serial_thread = Thread(target=self.imu_parser.read_serial, args=(self.channels,))
         serial_thread.start()
 
+        try:
+            while True:
+                try:
+                    self.run_connection(serial_thread)
+                    break
+                except OSError as e:
+                    if not self.session:
+                        raise
+                    delay = self.session.backoff.next()
+                    print(f"Connection lost ({e}), reconnecting in {delay:.1f}s")
+                    self.hold(delay)
+        finally:
+            self.running = False
+            self.imu_parser.stop()
+            serial_thread.join()
+            if self.session:
+                self.session.close()
+
+    def run_connection(self, serial_thread):
+        """Send samples over one connection; with a session, socket errors propagate so start() reconnects"""
+        session = self.session
         # TCP connection
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+            if session:
+                # A dead link shows up as a send blocked for this long
+                s.settimeout(session.idle_timeout)
             s.connect((self.host, self.port))
             print(f"Connected to {self.host}:{self.port}")
+            s.sendall(self.encoder.header('both', self.channels.channels))
+            # With a session, samples go through its backlog so they can be replayed
+            encode = session.encode_items if session else self.encoder.encode_items
+            if session:
+                session.connected()
+                Thread(target=self.read_acks, args=(s,), daemon=True).start()
 
             try:
-                while self.running:
-                    # Send accelerometer data if available
-                    if not self.accel_queue.empty():
-                        data = self.accel_queue.get()
-                        message = f"ACCEL:{data[0]:.3f},{data[1]:.3f},{data[2]:.3f}\n"
-                        s.sendall(message.encode())
-
-                    # Send gyroscope data if available
-                    if not self.gyro_queue.empty():
-                        data = self.gyro_queue.get()
-                        message = f"GYRO:{data[0]:.3f},{data[1]:.3f},{data[2]:.3f}\n"
-                        s.sendall(message.encode())
-
-                    # Small delay to prevent CPU overload
-                    time.sleep(0)
+                while self.running and (serial_thread.is_alive() or self.bridge.pending() or (session and session.pending())):
+                    # Block until the serial thread hands over samples, a paced replay may go on meanwhile
+                    if not self.bridge.wait_blocking(session.timeout() if session else IDLE_TIMEOUT) and not session:
+                        continue
+                    if self.rate_control:
+                        # Pick each channel's output rate before draining, and tell the server when it changes
+                        self.rate_control.update()
+                        for _, msg in self.rate_control.announcements(self.encoder):
+                            s.sendall(msg)
+
+                    # Send every channel's data if available, encoding all of them before sending
+                    # so a send that fails still leaves every row in the backlogs
+                    for data in [encode(sensor, [block]) for sensor, block in self.channels.pop()]:
+                        s.sendall(data)
+                    if session:
+                        for channel in self.channels.channels:
+                            s.sendall(session.encode_ready(channel.id))
 
             except Exception as e:
+                if session and isinstance(e, OSError):
+                    raise
                 print(f"Connection closed {traceback.format_exc()}")
-            finally:
-                self.running = False
-                serial_thread.join()
+
+    def read_acks(self, s):
+        """Ack reader thread: hand the acknowledgements the server sends on the socket to the session"""
+        reassembler = StreamReassembler(FORMAT_BINARY)
+        while True:
+            try:
+                data = s.recv(4096)
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            if not data:
+                return
+            self.session.receive(reassembler.feed(data))
+
+    def hold(self, delay):
+        """Keep stamping samples into the session's backlogs while waiting to reconnect"""
+        deadline = time.monotonic() + delay
+        while time.monotonic() < deadline:
+            self.bridge.wait_blocking(min(deadline - time.monotonic(), IDLE_TIMEOUT))
+            self.session.buffer(self.channels.pop())
 
 if __name__ == "__main__":
-    client = TCPIMUClient()
+    parser = argparse.ArgumentParser(description="TCP Client for IMU Data")
+    parser.add_argument('--host', type=str, default='172.190.228.31', help='Server host')
+    parser.add_argument('--port', type=int, default=5555, help='Server port')
+    parser.add_argument('--format', type=str, default=FORMAT_BINARY, help='Wire format: text, bin1, dq1')
+    parser.add_argument('--scales', type=float, nargs=2, metavar=('ACCEL', 'GYRO'), help='Units per int16 step for the dq1 format')
+    parser.add_argument('--overflow', type=str, default=DROP_OLDEST, choices=OVERFLOW_POLICIES, help='What the serial reader does when the sender falls behind')
+    parser.add_argument('--adaptive', action='store_true', help='Decimate or average samples when the link cannot keep up')
+    add_source_arguments(parser)
+    add_session_arguments(parser)
+    args = parser.parse_args()
+    client = TCPIMUClient(args.host, args.port, args.format, source=source_from_args(args),
+                          rate_control=RateController() if args.adaptive else None, overflow=args.overflow,
+                          session=session_from_args(args), channels=channels_from_args(args))
+    if args.device:
+        client.encoder.options['device'] = args.device
+    if args.scales:
+        client.encoder.scales.update({SENSOR_ACCEL: args.scales[0], SENSOR_GYRO: args.scales[1]})
     client.start()
\ No newline at end of file
@@ -2,19 +2,28 @@ import socket
 import threading
 import queue
 from datetime import datetime
-from collections import deque
+from collections import deque, Counter
 import asyncio
 import traceback
 import time
 import logging
 import os
+import argparse
+from helpers.codec import parse_header_options, decode_rates, split_by_type, FORMAT_TEXT, RECORD_RATE
+from helpers.channels import CHANNELS
+from helpers.framing import StreamReassembler
+from helpers.latency import StreamStats
+from helpers.recording import Recorder, device_name, FSYNC_INTERVAL, FSYNC_POLICIES
+from helpers.sinks import add_sink_arguments, sink_options, pipeline_from_options
+from helpers.metrics import MetricFamily, MetricsServer, StreamMetrics, add_metrics_arguments
+from helpers.session import SessionTable, AckTimer
 if not os.path.exists('logs'):
     os.makedirs('logs')
 # Set up logging
 logging.basicConfig(level=logging.INFO,
                     format='%(asctime)s - %(levelname)s - %(message)s', filename='logs/tcp_server.log')
 class TCPIMUServer:
-    def __init__(self, host='0.0.0.0', port=5555):
+    def __init__(self, host='0.0.0.0', port=5555, recorder=None, sink=None, metrics=None, sessions=None):
         self.host = host
         self.port = port
         self.server_socket = None
@@ -22,55 +31,101 @@ class TCPIMUServer:
         self.message_queue =  asyncio.Queue()
         self.buffer_size = 4096 
         self.client_buffers = {}
-        self.accel_count = 0
-        self.gyro_count = 0
+        # Latency, inter-arrival and loss per connected client
+        self.client_stats = {}
+        # Samples processed per channel name
+        self.sample_counts = Counter()
         self.start_time = time.time()
         self.last_log = time.time()
+        self.recorder = recorder
+        # SinkPipeline that decoded samples are handed to, None discards them
+        self.sink = sink
+        # MetricsServer to expose this server's metrics on, None disables them
+        self.metrics = metrics
+        self.total_connections = 0
+        # Reliable client sessions, their replayed samples are dropped and acknowledged back on the socket
+        self.sessions = SessionTable() if sessions is None else sessions
+        # Session id per connected client, kept until everything it sent has been processed
+        self.client_sessions = {}
+        # Device name per connected client, from its header, that its samples are recorded under
+        self.client_devices = {}
 
-    async def process_accel_data(self,data):
-        """Process accelerometer data."""
-        accel = list(map(float, data.split(":")[1].split(",")))
-        print(f"Accel: X={accel[0]:.2f} Y={accel[1]:.2f} Z={accel[2]:.2f} ")
-    
-    async def process_gyro_data(self,data):
-        """Process gyroscope data."""
-        gyro = list(map(float, data.split(":")[1].split(",")))
-        print(f"Gyro: X={gyro[0]:.2f} Y={gyro[1]:.2f} Z={gyro[2]:.2f}")
+    async def process_channel_data(self, channel, records, device=None):
+        """Process a block of records of one channel."""
+        self.sample_counts[channel.name] += len(records)
+        if self.sink:
+            self.sink.submit(device, channel.name, records)
+
+    async def process_records(self, records, device=None):
+        """Dispatch a batch of records by sensor type, through the channel registry"""
+        for sensor, block in split_by_type(records):
+            channel = CHANNELS.get(sensor)
+            if channel is not None:
+                if self.recorder:
+                    self.recorder.append(device, channel.name, block)
+                await self.process_channel_data(channel, block, device)
+            elif sensor == RECORD_RATE:
+                for announced, rate, factor, mode in decode_rates(block):
+                    name = CHANNELS[announced].name if announced in CHANNELS else f"channel {announced}"
+                    logging.info(f"[TCP] {device} sends {name} at {rate:.1f} samples/sec ({mode}, factor {factor})")
+
+    def collect_metrics(self):
+        """Metric families for the server and every connected client"""
+        connections = MetricFamily('imu_connections', 'gauge', 'Open connections')
+        connections.add(self.client_count)
+        opened = MetricFamily('imu_connections_total', 'counter', 'Connections accepted')
+        opened.add(self.total_connections)
+        samples = MetricFamily('imu_samples_total', 'counter', 'Samples processed, by sensor')
+        for sensor, count in sorted(self.sample_counts.items()):
+            samples.add(count, sensor=sensor)
+        depth = MetricFamily('imu_queue_depth', 'gauge', 'Decoded batches waiting to be processed, from all clients')
+        depth.add(self.message_queue.qsize())
+        streams = StreamMetrics()
+        # A device that reconnected before its old connection was closed is reported through its newest one
+        latest = {self.client_devices.get(client, client): stats for client, stats in list(self.client_stats.items())}
+        for device, stats in latest.items():
+            streams.add(stats, device=device, stream='tcp')
+        return [connections, opened, samples, depth] + streams.families()
 
     async def process_messages(self):
         """Separate thread for processing messages from the queue"""
         while True:
-            try:
-                if self.message_queue.empty():
-                    await asyncio.sleep(0)
-                    continue
-                message = self.message_queue.get_nowait()
-                now = time.time()
-                if message.startswith("ACCEL:"):          
-                    self.accel_count += 1          
-                    await self.process_accel_data(message)
-                elif message.startswith("GYRO:"):
-                    self.gyro_count += 1
-                    await self.process_gyro_data(message)
-                print(now-self.last_log)
-                if now - self.last_log >= 5:
-                    total_time = now - self.start_time
-                    print(f"[TCP] Accel rate: {self.accel_count / total_time:.2f} msgs/sec | "
-                        f"Gyro rate: {self.gyro_count / total_time:.2f} msgs/sec over {total_time:.1f}s")
-                    logging.info(f"[TCP] Accel rate: {self.accel_count / total_time:.2f} msgs/sec | "
-                                 f"Gyro rate: {self.gyro_count / total_time:.2f} msgs/sec over {total_time:.1f}s")
-                    self.last_log = now
-                    self.message_queue.task_done()
-            except queue.Empty:
+            client, records = await self.message_queue.get()
+            now = time.time()
+            device = self.client_devices.get(client, client)
+            if records is None:
+                # Client disconnected and everything it sent has been processed
+                self.client_devices.pop(client, None)
+                if self.recorder and device not in self.client_devices.values():
+                    self.recorder.close_device(device)
+                self.client_sessions.pop(client, None)
+                self.message_queue.task_done()
                 continue
+            await self.process_records(records, device)
+            session = self.client_sessions.get(client)
+            if session is not None:
+                # Only now may the client forget these samples
+                self.sessions.commit(session, records)
+            if now - self.last_log >= 5:
+                for client, stats in list(self.client_stats.items()):
+                    summary = f"[TCP] {client} {stats.summary()}"
+                    print(summary)
+                    logging.info(summary)
+                self.last_log = now
+            self.message_queue.task_done()
 
     async def handle_client(self, reader, writer):
         """Handle individual client connection with complete message reading"""
         
         addr = writer.get_extra_info('peername')
+        client = f"{addr[0]}_{addr[1]}"
         print(f"New connection from {addr}")
         self.client_count += 1
+        self.total_connections += 1
         buffer = b''
+        reassembler = None
+        acks = None
+        stats = self.client_stats[client] = StreamStats()
         
         try:
             while True:
@@ -78,18 +133,55 @@ class TCPIMUServer:
                 data = await reader.read(4096)
                 if not data:
                     break
+                stats.messages += 1
+                stats.bytes += len(data)
                 
-                buffer += data
-                while b'\n' in buffer:
-                    message, buffer = buffer.split(b'\n', 1)
-                    await self.message_queue.put(message.decode().strip())
+                if reassembler is None:
+                    # Optional header line announces the wire format; legacy clients send samples straight away
+                    buffer += data
+                    if b'\n' not in buffer:
+                        continue
+                    if buffer.startswith(CHANNELS.prefixes):
+                        fmt, options, data = FORMAT_TEXT, {}, buffer
+                        channels = None
+                    else:
+                        tag, fmt, options, data = parse_header_options(buffer)
+                        channels = CHANNELS.stream_channels(tag, options)
+                    device = self.client_devices[client] = device_name(options, client)
+                    reassembler = StreamReassembler(fmt, channels)
+                    print(f"Client {addr} using {fmt} format")
+                    session = options.get('session')
+                    if session and fmt != FORMAT_TEXT:
+                        self.client_sessions[client] = session
+                        acks = AckTimer(self.sessions, session, writer.write)
+                        # Tell a reconnecting client right away what it no longer needs to replay
+                        acks.flush()
+                        logging.info(f"[TCP] {device} joined reliable session {session}")
+
+                records = reassembler.feed(data)
+                if len(records) and acks is not None:
+                    # Replayed samples this session already delivered are dropped before anything counts them
+                    records = self.sessions.accept(acks.session, records)
+                    acks.schedule()
+                if len(records):
+                    stats.observe(records)
+                    await self.message_queue.put((client, records))
                 
+        except (UnicodeDecodeError, ValueError):
+            # Undecodable data leaves no way to resynchronise with the stream
+            stats.parse_errors += 1
+            print(f"Error decoding data from client {traceback.format_exc()}")
         except Exception as e:
             print(f"Error handling client {traceback.format_exc()}")
         finally:
+            if acks is not None:
+                acks.cancel()
             writer.close()
             await writer.wait_closed()
             self.client_count -= 1
+            logging.info(f"[TCP] {self.client_devices.get(client, client)} {stats.summary(windowed=False)}")
+            self.client_stats.pop(client, None)
+            await self.message_queue.put((client, None))
             print(f"Client {addr} disconnected")
 
     async def start(self):
@@ -100,12 +192,36 @@ class TCPIMUServer:
             self.port
         )
         asyncio.create_task(self.process_messages())
+        if self.metrics:
+            self.metrics.registry.register(self.collect_metrics)
+            if self.sink:
+                self.metrics.registry.register(self.sink.collect)
+            self.metrics.registry.register(self.sessions.collect)
+            await self.metrics.start()
         
         print(f"Server listening on {self.host}:{self.port}")
-        async with self.server:
-            await self.server.serve_forever()
+        try:
+            async with self.server:
+                await self.server.serve_forever()
+        finally:
+            if self.metrics:
+                await self.metrics.close()
+            if self.sink:
+                await self.sink.close()
 
 
 if __name__ == "__main__":
-    server = TCPIMUServer()
-    asyncio.run(server.start())
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="TCP Server for IMU Data")
+    parser.add_argument('--record', type=str, default=None, help='Directory to record all received samples to')
+    parser.add_argument('--fsync', type=str, default=FSYNC_INTERVAL, choices=FSYNC_POLICIES, help='When recordings are forced to disk')
+    add_sink_arguments(parser)
+    add_metrics_arguments(parser)
+    args = parser.parse_args()
+    recorder = Recorder(args.record, fsync=args.fsync) if args.record else None
+    metrics = MetricsServer(args.metrics_host, args.metrics_port) if args.metrics_port else None
+    server = TCPIMUServer(recorder=recorder, sink=pipeline_from_options(**sink_options(args)), metrics=metrics)
+    try:
+        asyncio.run(server.start())
+    finally:
+        if recorder:
+            recorder.close()
\ No newline at end of file
@@ -0,0 +1,72 @@
+import asyncio
+import unittest
+from helpers.batching import SampleBatcher, next_flush_timeout
+
+
+class FakeWriter:
+    def __init__(self):
+        self.writes = []
+
+    def write(self, data):
+        self.writes.append(data)
+
+    async def drain(self):
+        pass
+
+
+class SampleBatcherTest(unittest.TestCase):
+    def test_flushes_at_size_limit(self):
+        writer = FakeWriter()
+        batcher = SampleBatcher(writer, max_batch_bytes=10, max_linger=60)
+
+        async def run():
+            for _ in range(5):
+                await batcher.write(b'abcd')
+        asyncio.run(run())
+        # A batch never grows past the limit, the third sample starts a new one
+        self.assertEqual(writer.writes, [b'abcd' * 2, b'abcd' * 2])
+        self.assertEqual(len(batcher), 4)
+
+    def test_oversized_write_goes_out_alone(self):
+        writer = FakeWriter()
+        batcher = SampleBatcher(writer, max_batch_bytes=10, max_linger=60)
+
+        async def run():
+            await batcher.write(b'ab')
+            await batcher.write(b'x' * 20)
+        asyncio.run(run())
+        self.assertEqual(writer.writes, [b'ab', b'x' * 20])
+
+    def test_flushes_after_linger(self):
+        writer = FakeWriter()
+        batcher = SampleBatcher(writer, max_batch_bytes=1000, max_linger=0.01)
+
+        async def run():
+            await batcher.write(b'abc')
+            await batcher.flush_if_due()
+            self.assertEqual(writer.writes, [])
+            await asyncio.sleep(0.02)
+            await batcher.flush_if_due()
+        asyncio.run(run())
+        self.assertEqual(writer.writes, [b'abc'])
+        self.assertIsNone(batcher.time_left())
+
+    def test_zero_linger_sends_every_sample(self):
+        writer = FakeWriter()
+        batcher = SampleBatcher(writer, max_batch_bytes=1000, max_linger=0)
+
+        async def run():
+            await batcher.write(b'a')
+            await batcher.write(b'b')
+        asyncio.run(run())
+        self.assertEqual(writer.writes, [b'a', b'b'])
+
+    def test_next_flush_timeout(self):
+        idle, pending = SampleBatcher(FakeWriter(), max_linger=5), SampleBatcher(FakeWriter(), max_linger=0.5)
+        self.assertEqual(next_flush_timeout([idle, pending], 2.0), 2.0)
+        pending.add(b'abc')
+        self.assertLessEqual(next_flush_timeout([idle, pending], 2.0), 0.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import os
+import csv
+import json
+import socket
+import tempfile
+import unittest
+import numpy as np
+from benchmark.runner import cases, run_case, write_results, FIELDS
+from benchmark.server import ReceiveStats
+from helpers.codec import RECORD_DTYPE
+
+try:
+    import matplotlib
+except ImportError:
+    matplotlib = None
+
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class SweepTest(unittest.TestCase):
+    def test_tcp_has_no_batching_knobs(self):
+        swept = list(cases(('tcp', 'multi'), (100, 1000), (600, 1200), (0.0, 2.0)))
+        self.assertEqual([case for case in swept if case[0] == 'tcp'], [('tcp', 100, 0, 0.0), ('tcp', 1000, 0, 0.0)])
+        self.assertEqual(len([case for case in swept if case[0] == 'multi']), 8)
+
+    def test_receive_stats(self):
+        stats = ReceiveStats()
+        stats.start()
+        records = np.zeros(4, dtype=RECORD_DTYPE)
+        records['ts'][1:] = 1.0
+        stats.observe(records)
+        summary = stats.summary()
+        self.assertEqual(summary['received'], 4)
+        # Untimestamped text records count towards throughput but not latency
+        self.assertEqual(len(stats.latencies[0]), 3)
+        self.assertLessEqual(summary['latency_p50_ms'], summary['latency_p99_ms'])
+
+    def test_results_files(self):
+        results = [dict(mode='tcp', rate=100, batch_bytes=0, linger_ms=0.0, throughput=99.0, extra='ignored')]
+        with tempfile.TemporaryDirectory() as out:
+            write_results(results, out)
+            with open(os.path.join(out, 'results.json')) as f:
+                self.assertEqual(json.load(f), results)
+            with open(os.path.join(out, 'results.csv')) as f:
+                rows = list(csv.DictReader(f))
+            self.assertEqual(tuple(rows[0]), FIELDS)
+            self.assertEqual(rows[0]['throughput'], '99.0')
+
+    @unittest.skipIf(matplotlib is None, "matplotlib is not installed")
+    def test_plots(self):
+        from benchmark.plots import plot_results, PLOTS
+        results = [dict(mode='multi', rate=rate, batch_bytes=1200, linger_ms=2.0, throughput=rate * 2.0,
+                        latency_p50_ms=1.0) for rate in (100, 1000)]
+        with tempfile.TemporaryDirectory() as out:
+            paths = plot_results(results, out)
+            self.assertEqual(len(paths), len(PLOTS))
+            self.assertTrue(all(os.path.getsize(path) for path in paths))
+
+
+class LoopbackTest(unittest.TestCase):
+    """Short runs of a real server and client over loopback"""
+    def check(self, mode, batch_bytes, linger_ms):
+        result = run_case(mode, 500, 0.5, batch_bytes, linger_ms, port=free_port())
+        self.assertEqual(result['offered'], 500)
+        self.assertEqual(result['received'], result['offered'])
+        self.assertEqual(result['ring_dropped'], 0)
+        self.assertGreater(result['throughput'], 0)
+        self.assertIn('latency_p99_ms', result)
+
+    def test_tcp(self):
+        self.check('tcp', 0, 0.0)
+
+    def test_quic_multi_stream(self):
+        self.check('multi', 1200, 2.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import asyncio
+import threading
+import unittest
+import numpy as np
+from helpers.bridge import SampleBridge
+from helpers.imu import IMUParser
+from helpers.ring import BLOCK
+
+
+class SampleBridgeTest(unittest.TestCase):
+    def test_push_from_thread_wakes_the_loop(self):
+        bridge = SampleBridge()
+        ring = bridge.ring(capacity=8)
+
+        async def run():
+            bridge.attach(asyncio.get_running_loop())
+            threading.Timer(0.01, ring.push, args=(np.ones((2, 6)),)).start()
+            woken = await bridge.wait(timeout=5)
+            return woken, ring.pop()
+        woken, rows = asyncio.run(run())
+        self.assertTrue(woken)
+        self.assertEqual(len(rows), 2)
+
+    def test_wait_times_out_when_idle(self):
+        bridge = SampleBridge()
+        bridge.ring()
+
+        async def run():
+            bridge.attach(asyncio.get_running_loop())
+            return await bridge.wait(timeout=0.01)
+        self.assertFalse(asyncio.run(run()))
+
+    def test_one_callback_until_the_consumer_runs(self):
+        bridge = SampleBridge()
+        ring = bridge.ring(capacity=64)
+        scheduled = []
+
+        async def run():
+            loop = asyncio.get_running_loop()
+            bridge.attach(loop)
+            original = loop.call_soon_threadsafe
+            loop.call_soon_threadsafe = lambda *args: scheduled.append(args) or original(*args)
+            thread = threading.Thread(target=lambda: [ring.push(np.ones((1, 6))) for _ in range(10)])
+            thread.start()
+            thread.join()
+            await bridge.wait(timeout=5)
+        asyncio.run(run())
+        self.assertEqual(len(scheduled), 1)
+
+    def test_blocking_consumer(self):
+        bridge = SampleBridge()
+        ring = bridge.ring()
+        threading.Timer(0.01, ring.push, args=(np.ones((1, 6)),)).start()
+        self.assertTrue(bridge.wait_blocking(timeout=5))
+        self.assertFalse(SampleBridge().wait_blocking(timeout=0.01))
+
+
+class BlockingPushTest(unittest.TestCase):
+    def test_reader_waits_for_the_consumer_without_dropping(self):
+        bridge = SampleBridge()
+        ring = bridge.ring(capacity=4, overflow=BLOCK)
+        rows = np.arange(20 * 6, dtype=np.float32).reshape(20, 6)
+
+        async def run():
+            bridge.attach(asyncio.get_running_loop())
+            push = asyncio.create_task(IMUParser()._push(ring, rows))
+            received = []
+            while len(received) < len(rows):
+                await bridge.wait(timeout=5)
+                received.extend(ring.pop())
+            await push
+            return np.array(received)
+        np.testing.assert_array_equal(asyncio.run(run()), rows)
+        self.assertGreater(ring.blocked, 0)
+        self.assertEqual(ring.dropped_oldest + ring.dropped_newest, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
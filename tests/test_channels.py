@@ -0,0 +1,84 @@
+import unittest
+import numpy as np
+from helpers.bridge import ChannelRings, SampleBridge
+from helpers.channels import (ACCEL, BARO, CHANNELS, EXTRA_CHANNELS, GYRO, IMU_CHANNELS, IMU_WIDTH, MAG, TEMP, Channel,
+                              ChannelRegistry, channels_spec)
+from helpers.codec import RECORD_DTYPE, decode_text, split_by_type
+
+
+class RegistryTest(unittest.TestCase):
+    def test_lookup(self):
+        self.assertIs(CHANNELS[3], MAG)
+        self.assertIs(CHANNELS['baro'], BARO)
+        self.assertIs(CHANNELS.by_prefix(b'TEMP'), TEMP)
+        self.assertIsNone(CHANNELS.by_prefix(b'accel'))
+        for key in (0, 9, 16, 255, 'compass'):
+            self.assertNotIn(key, CHANNELS)
+            self.assertIsNone(CHANNELS.get(key))
+        with self.assertRaises(KeyError):
+            CHANNELS[16]
+        self.assertEqual(CHANNELS.names, ['accel', 'gyro', 'mag', 'baro', 'temp'])
+        self.assertIn(b'BARO:', CHANNELS.prefixes)
+        self.assertEqual(IMU_CHANNELS + EXTRA_CHANNELS, tuple(CHANNELS))
+        self.assertEqual(IMU_WIDTH, 6)
+
+    def test_register_rejects_bad_channels(self):
+        registry = ChannelRegistry([ACCEL])
+        for channel in (Channel(0, 'zero'), Channel(16, 'control'), Channel(6, 'wide', dim=4),
+                        Channel(6, 'complex', dtype='c8'), Channel(6, 'idle', priority=0),
+                        Channel(1, 'again'), Channel(6, 'accel')):
+            with self.assertRaises(ValueError, msg=channel.name):
+                registry.register(channel)
+        registry.register(Channel(6, 'counter', 1, dtype='i2'))
+        self.assertEqual(len(registry), 2)
+
+    def test_negotiate(self):
+        spec = channels_spec((MAG, BARO))
+        self.assertEqual(spec, 'mag:3:3:f4,baro:4:1:f4')
+        self.assertEqual(CHANNELS.negotiate(spec), (MAG, BARO))
+        # Details may be left out, what is given has to match
+        self.assertEqual(CHANNELS.negotiate('temp,mag:3'), (TEMP, MAG))
+        for spec in ('compass', 'baro:4:3', 'mag:4', 'accel:1:3:f8'):
+            with self.assertRaises(ValueError, msg=spec):
+                CHANNELS.negotiate(spec)
+
+    def test_stream_channels(self):
+        self.assertEqual(CHANNELS.stream_channels('both', {}), IMU_CHANNELS)
+        self.assertEqual(CHANNELS.stream_channels('gyro', {}), (GYRO,))
+        # An announced channel list wins over the tag
+        self.assertEqual(CHANNELS.stream_channels('env', {'channels': 'baro,temp'}), (BARO, TEMP))
+        with self.assertRaises(ValueError):
+            CHANNELS.stream_channels('env', {})
+
+
+class DispatchTest(unittest.TestCase):
+    def test_text_lines_decode_per_channel(self):
+        records = decode_text([b'BARO:1013.25', b'MAG:1.0,2.0,3.0', b'BARO:1.0,2.0', b'WIND:3.0', b'TEMP:21.5\r',
+                               b'ACCEL:0.5,0.5,1.0'])
+        found = {sensor: block['axes'].tolist() for sensor, block in split_by_type(records)}
+        self.assertEqual(found, {BARO.id: [[1013.25, 0, 0]], TEMP.id: [[21.5, 0, 0]], MAG.id: [[1, 2, 3]],
+                                 ACCEL.id: [[0.5, 0.5, 1]]})
+
+    def test_split_by_type_keeps_arrival_order(self):
+        records = np.zeros(6, dtype=RECORD_DTYPE)
+        records['type'] = [MAG.id, ACCEL.id, MAG.id, TEMP.id, ACCEL.id, MAG.id]
+        records['seq'] = np.arange(6)
+        groups = [(sensor, block['seq'].tolist()) for sensor, block in split_by_type(records)]
+        self.assertEqual(groups, [(ACCEL.id, [1, 4]), (MAG.id, [0, 2, 5]), (TEMP.id, [3])])
+        self.assertEqual(split_by_type(records[:0]), [])
+
+    def test_rings_per_channel(self):
+        rings = ChannelRings(SampleBridge(), extra=(BARO, ACCEL))
+        self.assertEqual(rings.channels, (ACCEL, GYRO, BARO))
+        rings.imu.push(np.arange(12, dtype=np.float32).reshape(2, 6))
+        tagged = decode_text([b'BARO:1000.0', b'MAG:1.0,2.0,3.0', b'BARO:1001.0'])
+        # Channels the client does not send are dropped
+        for ring, rows in rings.route(tagged):
+            ring.push(rows)
+        blocks = {sensor: block.tolist() for sensor, block in rings.pop()}
+        self.assertEqual(blocks, {ACCEL.id: [[0, 1, 2], [6, 7, 8]], GYRO.id: [[3, 4, 5], [9, 10, 11]],
+                                  BARO.id: [[1000], [1001]]})
+
+
+if __name__ == '__main__':
+    unittest.main()
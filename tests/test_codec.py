@@ -0,0 +1,64 @@
+import unittest
+import numpy as np
+from helpers.codec import (SampleEncoder, encode_header, parse_header_options, parse_header, encode_batch, decode_batch,
+                           RECORD, RECORD_DTYPE, SEQ_MASK, FORMAT_TEXT, FORMAT_BINARY, SENSOR_ACCEL, SENSOR_GYRO)
+
+
+class HeaderTest(unittest.TestCase):
+    def test_options_round_trip(self):
+        header = encode_header('accel', FORMAT_BINARY, session='abc') + b'rest'
+        self.assertEqual(parse_header_options(header), ('accel', FORMAT_BINARY, {'session': 'abc'}, b'rest'))
+
+    def test_legacy_text_header(self):
+        self.assertEqual(encode_header('gyro'), b'gyro\n')
+        self.assertEqual(parse_header(b'gyro'), ('gyro', FORMAT_TEXT, b''))
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            parse_header(b'accel;bin9\n')
+
+    def test_malformed_option(self):
+        with self.assertRaises(ValueError):
+            parse_header_options(b'accel;bin1;session\n')
+
+
+class BinaryFormatTest(unittest.TestCase):
+    def test_record_layout(self):
+        self.assertEqual(RECORD.size, 25)
+        payload = encode_batch(SENSOR_GYRO, [7], 1.5, [[1.0, 2.0, 3.0]])
+        self.assertEqual(RECORD.unpack(payload), (SENSOR_GYRO, 7, 1.5, 1.0, 2.0, 3.0))
+
+    def test_decode_keeps_partial_record(self):
+        payload = encode_batch(SENSOR_ACCEL, [0, 1], 1.0, [[1, 2, 3], [4, 5, 6]])
+        records, consumed = decode_batch(payload + payload[:10])
+        self.assertEqual(consumed, 2 * RECORD.size)
+        self.assertEqual(records['axes'].tolist(), [[1, 2, 3], [4, 5, 6]])
+
+    def test_sequence_numbers_per_sensor(self):
+        encoder = SampleEncoder(FORMAT_BINARY)
+        accel, _ = decode_batch(encoder.encode_many(SENSOR_ACCEL, np.zeros((3, 3))))
+        gyro, _ = decode_batch(encoder.encode(SENSOR_GYRO, (1.0, 2.0, 3.0)))
+        accel_more, _ = decode_batch(encoder.encode(SENSOR_ACCEL, (1.0, 2.0, 3.0)))
+        self.assertEqual(accel['seq'].tolist(), [0, 1, 2])
+        self.assertEqual(gyro['seq'].tolist(), [0])
+        self.assertEqual(accel_more['seq'].tolist(), [3])
+
+    def test_sequence_numbers_wrap(self):
+        encoder = SampleEncoder(FORMAT_BINARY)
+        encoder._seq[SENSOR_ACCEL] = SEQ_MASK - 1
+        records, _ = decode_batch(encoder.encode_many(SENSOR_ACCEL, np.zeros((4, 3))))
+        self.assertEqual(records['seq'].tolist(), [SEQ_MASK - 1, SEQ_MASK, 0, 1])
+
+    def test_text_format(self):
+        encoder = SampleEncoder(FORMAT_TEXT)
+        self.assertEqual(encoder.encode(SENSOR_ACCEL, (1, -2, 0.5)), b'ACCEL:1.000,-2.000,0.500\n')
+
+    def test_stamped_records_encode_unchanged(self):
+        encoder = SampleEncoder(FORMAT_BINARY)
+        records = encoder.stamp_items(SENSOR_ACCEL, [np.ones((5, 3), dtype=np.float32)])
+        self.assertEqual(records.dtype, RECORD_DTYPE)
+        self.assertEqual(encoder.encode_records(records), records.tobytes())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import asyncio
+import unittest
+import numpy as np
+from client_files.quic_client_datagram import DatagramWriter, MAX_DATAGRAM_BATCH_BYTES
+from helpers.batching import SampleBatcher
+from helpers.codec import SampleEncoder, decode_batch, RECORD, SENSOR_ACCEL
+from helpers.sequence import SequenceTracker
+
+
+class FakeQuic:
+    def __init__(self):
+        self.datagrams = []
+
+    def send_datagram_frame(self, data):
+        self.datagrams.append(data)
+
+
+class FakeConnection:
+    def __init__(self):
+        self._quic = FakeQuic()
+        self.transmits = 0
+
+    def transmit(self):
+        self.transmits += 1
+
+
+class SequenceTrackerTest(unittest.TestCase):
+    def test_gap_counts_as_lost(self):
+        tracker = SequenceTracker()
+        tracker.update([0, 1, 2, 5, 6])
+        self.assertEqual((tracker.received, tracker.lost, tracker.out_of_order), (5, 2, 0))
+
+    def test_late_arrival_is_taken_back_out_of_lost(self):
+        tracker = SequenceTracker()
+        tracker.update([0, 1, 3])
+        tracker.update([2, 4])
+        self.assertEqual((tracker.lost, tracker.out_of_order), (0, 1))
+
+    def test_starts_at_first_number_seen(self):
+        tracker = SequenceTracker()
+        tracker.update([100, 101])
+        self.assertEqual(tracker.lost, 0)
+
+
+class DatagramWriterTest(unittest.TestCase):
+    def test_one_datagram_per_flush_of_whole_records(self):
+        connection = FakeConnection()
+        batcher = SampleBatcher(DatagramWriter(connection), MAX_DATAGRAM_BATCH_BYTES, max_linger=60)
+        payload = SampleEncoder().encode_many(SENSOR_ACCEL, np.zeros((100, 3)))
+        step = (MAX_DATAGRAM_BATCH_BYTES // RECORD.size) * RECORD.size
+
+        async def run():
+            for i in range(0, len(payload), step):
+                await batcher.write(payload[i:i + step])
+            await batcher.flush()
+        asyncio.run(run())
+
+        datagrams = connection._quic.datagrams
+        self.assertEqual(connection.transmits, len(datagrams))
+        self.assertTrue(all(len(datagram) <= MAX_DATAGRAM_BATCH_BYTES for datagram in datagrams))
+        self.assertTrue(all(len(datagram) % RECORD.size == 0 for datagram in datagrams))
+        records = np.concatenate([decode_batch(datagram)[0] for datagram in datagrams])
+        self.assertEqual(records['seq'].tolist(), list(range(100)))
+
+
+if __name__ == '__main__':
+    unittest.main()
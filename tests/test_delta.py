@@ -0,0 +1,103 @@
+import unittest
+import numpy as np
+from helpers.channels import ACCEL, BARO
+from helpers.codec import (DeltaDecoder, DeltaEncoder, SampleEncoder, decode_varints, encode_varints, pack_varint,
+                           unzigzag, zigzag, DEFAULT_SCALES, FORMAT_DELTA, FRAME_DELTA, FRAME_KEY, INT16_MAX,
+                           RECORD, SENSOR_ACCEL, SENSOR_GYRO, VARINT_VECTOR_MIN)
+
+
+class VarintTest(unittest.TestCase):
+    def test_zigzag(self):
+        values = np.array([0, -1, 1, -2, 2, INT16_MAX, -INT16_MAX - 1])
+        self.assertEqual(zigzag(values[:5]).tolist(), [0, 1, 2, 3, 4])
+        np.testing.assert_array_equal(unzigzag(zigzag(values)), values)
+
+    def test_scalar_and_vector_paths_agree(self):
+        values = np.array([0, 1, 127, 128, 16383, 16384, (1 << 21) - 1] * 20, dtype=np.uint32)
+        encoded = encode_varints(values)
+        self.assertEqual(encoded, b''.join(pack_varint(value) for value in values.tolist()))
+        np.testing.assert_array_equal(decode_varints(encoded), values)
+        short = values[:VARINT_VECTOR_MIN - 1]
+        np.testing.assert_array_equal(decode_varints(encode_varints(short)), short)
+
+    def test_rejects_bad_input(self):
+        with self.assertRaises(ValueError):
+            encode_varints([1 << 21])
+        for data in (b'\x80', b'\x80' * 100, b'\xff\xff\xff\x01', b'\x01' * 70 + b'\xff\xff\xff\xff\x01'):
+            with self.assertRaises(ValueError, msg=data):
+                decode_varints(data)
+
+
+class DeltaCodecTest(unittest.TestCase):
+    def test_round_trip_within_half_a_step(self):
+        rng = np.random.default_rng(0)
+        rows = np.cumsum(rng.normal(0, 0.01, (500, 3)), axis=0).astype(np.float32)
+        encoder, decoder = DeltaEncoder(), DeltaDecoder()
+        data = b''.join(encoder.encode(SENSOR_ACCEL, seq, 1000.0 + seq / 1000, rows[seq:seq + 50])
+                        for seq in range(0, 500, 50))
+        records, consumed = decoder.decode(data)
+        self.assertEqual(consumed, len(data))
+        self.assertEqual(records['seq'].tolist(), list(range(500)))
+        np.testing.assert_allclose(records['axes'], rows, atol=DEFAULT_SCALES[SENSOR_ACCEL] / 2 + 1e-6)
+        # Block timestamps survive to the microsecond
+        np.testing.assert_allclose(records['ts'][::50], 1000.0 + np.arange(0, 500, 50) / 1000, atol=1e-6)
+        # A slowly changing channel costs well under the 25 byte binary record
+        self.assertLess(len(data), 500 * RECORD.size / 4)
+
+    def test_key_frames(self):
+        encoder = DeltaEncoder(keyframe_interval=100)
+        rows = np.zeros((50, 3))
+        kinds = [encoder.encode(SENSOR_ACCEL, seq, 0.0, rows)[0] for seq in range(0, 300, 50)]
+        self.assertEqual(kinds, [FRAME_KEY, FRAME_DELTA, FRAME_KEY, FRAME_DELTA, FRAME_KEY, FRAME_DELTA])
+        # A gap in sequence numbers or a new scale restarts from a key frame
+        self.assertEqual(encoder.encode(SENSOR_ACCEL, 400, 0.0, rows)[0], FRAME_KEY)
+        self.assertEqual(encoder.encode(SENSOR_ACCEL, 450, 0.0, rows)[0], FRAME_DELTA)
+        encoder.scales[SENSOR_ACCEL] = 0.5
+        self.assertEqual(encoder.encode(SENSOR_ACCEL, 500, 0.0, rows)[0], FRAME_KEY)
+
+    def test_values_clip_to_int16(self):
+        encoder, decoder = DeltaEncoder(), DeltaDecoder()
+        scale = np.float32(DEFAULT_SCALES[SENSOR_GYRO])
+        records, _ = decoder.decode(encoder.encode(SENSOR_GYRO, 0, 0.0, [[1e9, -1e9, 0.0]]))
+        self.assertEqual(records['axes'][0].tolist(), [INT16_MAX * scale, -(INT16_MAX + 1) * scale, 0.0])
+
+    def test_partial_frames_are_kept(self):
+        data = DeltaEncoder().encode(SENSOR_ACCEL, 0, 0.0, np.ones((10, 3)))
+        decoder = DeltaDecoder()
+        records, consumed = decoder.decode(data[:-1])
+        self.assertEqual((len(records), consumed), (0, 0))
+        records, consumed = decoder.decode(data)
+        self.assertEqual((len(records), consumed), (10, len(data)))
+
+    def test_delta_before_key_frame_is_skipped(self):
+        encoder = DeltaEncoder()
+        key = encoder.encode(SENSOR_ACCEL, 0, 0.0, np.ones((5, 3)))
+        delta = encoder.encode(SENSOR_ACCEL, 5, 0.0, np.ones((5, 3)))
+        decoder = DeltaDecoder()
+        records, consumed = decoder.decode(delta + key)
+        self.assertEqual((len(records), consumed, decoder.skipped), (5, len(delta) + len(key), 5))
+
+    def test_one_axis_channel(self):
+        encoder, decoder = DeltaEncoder(), DeltaDecoder()
+        records, _ = decoder.decode(encoder.encode(BARO.id, 0, 0.0, [[1013.25, 7.0, 7.0], [1013.30, 7.0, 7.0]]))
+        np.testing.assert_allclose(records['axes'][:, 0], [1013.25, 1013.30], atol=BARO.scale / 2 + 1e-4)
+        # Axes beyond the channel's dimension are not sent
+        self.assertEqual(records['axes'][:, 1:].tolist(), [[0, 0], [0, 0]])
+
+    def test_unannounced_channel(self):
+        data = DeltaEncoder().encode(SENSOR_GYRO, 0, 0.0, np.zeros((1, 3)))
+        with self.assertRaises(ValueError):
+            DeltaDecoder(channels=[ACCEL]).decode(data)
+
+    def test_sample_encoder_records_keep_their_numbers(self):
+        encoder = SampleEncoder(FORMAT_DELTA)
+        records = encoder.stamp_items(SENSOR_ACCEL, [np.zeros((10, 3))])
+        # Drop two records in the middle, as a bounded send queue would
+        kept = np.concatenate((records[:4], records[6:]))
+        decoded, _ = DeltaDecoder().decode(encoder.encode_records(kept))
+        self.assertEqual(decoded['seq'].tolist(), [0, 1, 2, 3, 6, 7, 8, 9])
+        np.testing.assert_array_equal(decoded['ts'], kept['ts'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import unittest
+import numpy as np
+from helpers.codec import SampleEncoder, FORMAT_TEXT, FORMAT_BINARY, FORMAT_DELTA, SENSOR_ACCEL, SENSOR_GYRO
+from helpers.framing import StreamReassembler
+
+
+def rows(start, count):
+    return np.column_stack([np.arange(start, start + count) * 0.1] * 3).astype(np.float32)
+
+
+class BinaryStreamTest(unittest.TestCase):
+    def test_records_split_across_every_byte(self):
+        data = SampleEncoder(FORMAT_BINARY).encode_many(SENSOR_ACCEL, rows(0, 4))
+        reassembler = StreamReassembler(FORMAT_BINARY)
+        records = np.concatenate([reassembler.feed(data[i:i + 1]) for i in range(len(data))])
+        self.assertEqual(records['seq'].tolist(), [0, 1, 2, 3])
+        np.testing.assert_array_equal(records['axes'], rows(0, 4))
+        self.assertEqual(len(reassembler), 0)
+
+    def test_whole_chunk_decodes_without_copying(self):
+        data = bytearray(SampleEncoder(FORMAT_BINARY).encode_many(SENSOR_ACCEL, rows(0, 4)))
+        records = StreamReassembler(FORMAT_BINARY).feed(data)
+        self.assertFalse(records.flags.owndata)
+        self.assertTrue(np.shares_memory(records, np.frombuffer(data, dtype=np.uint8)))
+
+    def test_mixed_sensors_in_one_batch(self):
+        encoder = SampleEncoder(FORMAT_BINARY)
+        data = encoder.encode_many(SENSOR_ACCEL, rows(0, 2)) + encoder.encode_many(SENSOR_GYRO, rows(0, 3))
+        records = StreamReassembler(FORMAT_BINARY).feed(data)
+        self.assertEqual(records['type'].tolist(), [SENSOR_ACCEL] * 2 + [SENSOR_GYRO] * 3)
+
+
+class TextStreamTest(unittest.TestCase):
+    def test_line_split_across_chunks(self):
+        reassembler = StreamReassembler(FORMAT_TEXT)
+        self.assertEqual(len(reassembler.feed(b'ACCEL:1.0,2.0,')), 0)
+        records = reassembler.feed(b'3.0\nGYRO:4.0,5.0,6.0\nACC')
+        self.assertEqual(records['type'].tolist(), [SENSOR_ACCEL, SENSOR_GYRO])
+        self.assertEqual(records['axes'].tolist(), [[1, 2, 3], [4, 5, 6]])
+        self.assertEqual(len(reassembler), 3)
+
+
+class DeltaStreamTest(unittest.TestCase):
+    def test_round_trip_across_chunks(self):
+        encoder = SampleEncoder(FORMAT_DELTA)
+        data = encoder.encode_many(SENSOR_ACCEL, rows(0, 8)) + encoder.encode_many(SENSOR_ACCEL, rows(8, 8))
+        reassembler = StreamReassembler(FORMAT_DELTA)
+        records = np.concatenate([reassembler.feed(data[:7]), reassembler.feed(data[7:])])
+        self.assertEqual(records['seq'].tolist(), list(range(16)))
+        np.testing.assert_allclose(records['axes'], rows(0, 16), atol=0.002)
+
+    def test_corrupt_frame_breaks_the_stream(self):
+        encoder = SampleEncoder(FORMAT_DELTA)
+        first = encoder.encode_many(SENSOR_ACCEL, rows(0, 8))
+        lost = bytearray(encoder.encode_many(SENSOR_ACCEL, rows(8, 8)))
+        following = encoder.encode_many(SENSOR_ACCEL, rows(16, 8))
+        # A channel byte no stream announced
+        lost[1] = 9
+
+        reassembler = StreamReassembler(FORMAT_DELTA)
+        self.assertEqual(len(reassembler.feed(first)), 8)
+        with self.assertRaises(ValueError):
+            reassembler.feed(bytes(lost))
+        self.assertTrue(reassembler.broken)
+        # The next frame would decode against the samples before the lost ones, so it must not decode at all
+        with self.assertRaises(ValueError):
+            reassembler.feed(following)
+
+    def test_sequence_gap_starts_a_key_frame(self):
+        encoder = SampleEncoder(FORMAT_DELTA)
+        records = encoder.stamp_items(SENSOR_ACCEL, [rows(0, 20)])
+        # Records 5 to 12 dropped before sending, as by a sender's full buffer
+        data = encoder.encode_records(records[:5]) + encoder.encode_records(records[13:])
+        decoded = StreamReassembler(FORMAT_DELTA).feed(data)
+        self.assertEqual(decoded['seq'].tolist(), list(range(5)) + list(range(13, 20)))
+        np.testing.assert_allclose(decoded['axes'], rows(0, 20)[list(range(5)) + list(range(13, 20))], atol=0.002)
+
+    def test_gap_inside_one_block(self):
+        encoder = SampleEncoder(FORMAT_DELTA)
+        records = encoder.stamp_items(SENSOR_ACCEL, [rows(0, 20)])
+        kept = np.concatenate([records[:5], records[13:]])
+        decoded = StreamReassembler(FORMAT_DELTA).feed(encoder.encode_records(kept))
+        self.assertEqual(decoded['seq'].tolist(), kept['seq'].tolist())
+
+
+if __name__ == '__main__':
+    unittest.main()
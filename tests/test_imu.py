@@ -0,0 +1,47 @@
+import unittest
+import numpy as np
+from helpers.imu import IMUParser
+from helpers.codec import SENSOR_MAG
+
+CHUNK = (b'1.0,2.0,3.0,4.0,5.0,6.0\n'
+         b'garbage\n'
+         b'-1.5,0.0,0.25,1.0,1.0,1.0\n'
+         b'MAG:10.0,20.0,30.0\n'
+         b'1.0,2.0,3.0\n'
+         b'7.0,8.0,9.0,1.0,2.0,3.0\n'
+         b'1.0,2.0,')
+
+
+class ParserTest(unittest.TestCase):
+    def test_bulk_matches_line_by_line(self):
+        results = []
+        for bulk in (False, True):
+            parser = IMUParser(bulk=bulk)
+            rows, records, rest = parser.parse_chunk(CHUNK)
+            results.append((rows, records, rest, parser.rejected))
+        (rows, records, rest, rejected), (bulk_rows, bulk_records, bulk_rest, bulk_rejected) = results
+        np.testing.assert_array_equal(rows, bulk_rows)
+        np.testing.assert_array_equal(records['axes'], bulk_records['axes'])
+        self.assertEqual((rest, rejected), (bulk_rest, bulk_rejected))
+
+    def test_bulk_parse(self):
+        parser = IMUParser(bulk=True)
+        rows, records, rest = parser.parse_chunk(CHUNK)
+        self.assertEqual(rows.shape, (3, 6))
+        self.assertEqual(rows[1].tolist(), [-1.5, 0.0, 0.25, 1.0, 1.0, 1.0])
+        self.assertEqual(records['type'].tolist(), [SENSOR_MAG])
+        self.assertEqual(records['axes'].tolist(), [[10, 20, 30]])
+        self.assertEqual(rest, b'1.0,2.0,')
+        self.assertEqual(parser.rejected, 2)
+
+    def test_no_complete_line(self):
+        rows, records, rest = IMUParser(bulk=True).parse_chunk(b'1.0,2.0')
+        self.assertEqual((len(rows), len(records), rest), (0, 0, b'1.0,2.0'))
+
+    def test_runaway_partial_line_is_dropped(self):
+        _, _, rest = IMUParser(bulk=True).parse_chunk(b'1' * 10000)
+        self.assertEqual(rest, b'')
+
+
+if __name__ == '__main__':
+    unittest.main()
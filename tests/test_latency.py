@@ -0,0 +1,95 @@
+import unittest
+import numpy as np
+from helpers.codec import RECORD_DTYPE, SENSOR_ACCEL, SENSOR_GYRO
+from helpers.latency import (WindowedHistogram, StreamStats, bucket_bounds, bucket_index, bucket_indices,
+                             BUCKETS, MAX_VALUE_US, PRECISION_BITS, SCRATCH_SIZE)
+
+
+class BucketTest(unittest.TestCase):
+    def test_bounds_contain_the_value(self):
+        for value in list(range(200)) + [1000, 12345, 999999, MAX_VALUE_US]:
+            low, width = bucket_bounds(bucket_index(value))
+            self.assertTrue(low <= value < low + width, value)
+            # Buckets stay within one sub-bucket of precision
+            self.assertLessEqual(width, max(1, value >> (PRECISION_BITS - 1)))
+
+    def test_vectorized_matches_scalar(self):
+        values = np.random.default_rng(1).integers(0, MAX_VALUE_US, 5000)
+        self.assertEqual(bucket_indices(values).tolist(), [bucket_index(int(value)) for value in values])
+        self.assertEqual(bucket_index(MAX_VALUE_US), BUCKETS - 1)
+
+
+class WindowedHistogramTest(unittest.TestCase):
+    def test_percentiles(self):
+        histogram = WindowedHistogram()
+        histogram.record_many(np.arange(1, 10001), now=0.0)
+        p50, p99, p999 = histogram.percentiles(now=0.0)
+        self.assertAlmostEqual(p50, 5000, delta=5000 * 0.04)
+        self.assertAlmostEqual(p99, 9900, delta=9900 * 0.04)
+        self.assertAlmostEqual(p999, 9990, delta=9990 * 0.04)
+        self.assertEqual(WindowedHistogram().percentiles(now=0.0), [None] * 3)
+
+    def test_window_expires_slot_by_slot(self):
+        histogram = WindowedHistogram(window=10.0, slots=10)
+        histogram.record(100, now=0.5)
+        histogram.record(200, now=5.5)
+        self.assertEqual(histogram.count(now=9.9), 2)
+        self.assertEqual(histogram.count(now=10.5), 1)
+        self.assertEqual(histogram.count(now=100.0), 0)
+        # The lifetime histogram keeps everything
+        self.assertEqual(histogram.count(windowed=False), 2)
+
+    def test_values_are_clamped(self):
+        histogram = WindowedHistogram()
+        histogram.record_many(np.array([-5.0, 1e12]), now=0.0)
+        self.assertEqual(histogram.lifetime[0], 1)
+        self.assertEqual(histogram.lifetime[BUCKETS - 1], 1)
+
+    def test_batches_match_single_records(self):
+        values = np.random.default_rng(2).exponential(2000, 3 * SCRATCH_SIZE)
+        one, many = WindowedHistogram(), WindowedHistogram()
+        for value in values:
+            one.record(value, now=0.0)
+        # The first batch is larger than the scratch buffers, the next ones fit
+        many.record_many(values[:2 * SCRATCH_SIZE], now=0.0)
+        many.record_many(values[2 * SCRATCH_SIZE:], now=0.0)
+        np.testing.assert_array_equal(one.lifetime, many.lifetime)
+
+    def test_record_elapsed(self):
+        stamps = 100.0 - np.array([0.001, 0.002, 0.5])
+        elapsed, reference = WindowedHistogram(), WindowedHistogram()
+        elapsed.record_elapsed(stamps, 100.0, now=0.0)
+        reference.record_many((100.0 - stamps) * 1e6, now=0.0)
+        np.testing.assert_array_equal(elapsed.lifetime, reference.lifetime)
+        # Recording reuses the scratch buffers instead of allocating new ones
+        buffers = elapsed._values, elapsed._indices
+        elapsed.record_elapsed(stamps, 100.0, now=0.0)
+        self.assertIs(elapsed._values, buffers[0])
+        self.assertIs(elapsed._indices, buffers[1])
+
+
+class StreamStatsTest(unittest.TestCase):
+    def records(self, sensor, seqs, ts=1.0):
+        out = np.zeros(len(seqs), dtype=RECORD_DTYPE)
+        out['type'] = sensor
+        out['seq'] = seqs
+        out['ts'] = ts
+        return out
+
+    def test_sequences_are_tracked_per_channel(self):
+        stats = StreamStats()
+        stats.observe(np.concatenate([self.records(SENSOR_ACCEL, [0, 1, 3]), self.records(SENSOR_GYRO, [0, 1])]))
+        stats.observe(self.records(SENSOR_ACCEL, [2, 4]))
+        self.assertEqual((stats.received, stats.lost, stats.out_of_order), (7, 0, 1))
+        self.assertEqual(stats.latency.count(windowed=False), 7)
+        self.assertEqual(stats.interarrival.count(windowed=False), 1)
+        self.assertIn('lost=0 out_of_order=1', stats.summary())
+
+    def test_untimed_records_skip_latency(self):
+        stats = StreamStats()
+        stats.observe(self.records(SENSOR_ACCEL, [0, 0], ts=0.0))
+        self.assertEqual((stats.received, stats.latency.count(windowed=False)), (2, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,179 @@
+import os
+import ssl
+import asyncio
+import unittest
+import numpy as np
+from aioquic.quic.configuration import QuicConfiguration
+from aioquic.quic.connection import QuicConnection
+from helpers.codec import RECORD_DTYPE, SENSOR_ACCEL
+from helpers.latency import StreamStats, WindowedHistogram
+from helpers.metrics import (Histogram, MetricFamily, MetricsRegistry, MetricsServer, QuicMetrics, StreamMetrics,
+                             LoopLagMonitor, log_histogram_buckets, track_lost_packets)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def connected_pair():
+    """A client and server connection that completed their handshake in memory"""
+    server_configuration = QuicConfiguration(is_client=False)
+    server_configuration.load_cert_chain(os.path.join(ROOT, 'ssl_cert.pem'), os.path.join(ROOT, 'ssl_key.pem'))
+    client_configuration = QuicConfiguration(is_client=True)
+    client_configuration.verify_mode = ssl.CERT_NONE
+    client = QuicConnection(configuration=client_configuration)
+    server = QuicConnection(configuration=server_configuration,
+                            original_destination_connection_id=client.original_destination_connection_id)
+    client.connect(('10.0.0.2', 4433), now=0.0)
+    for _ in range(5):
+        exchange(client, server, 0.0)
+    return client, server
+
+
+def exchange(client, server, now):
+    for data, _ in client.datagrams_to_send(now):
+        server.receive_datagram(data, ('10.0.0.1', 5000), now)
+    for data, _ in server.datagrams_to_send(now):
+        client.receive_datagram(data, ('10.0.0.2', 4433), now)
+
+
+async def fetch(port, request):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(request)
+    response = await reader.read()
+    writer.close()
+    head, _, body = response.partition(b'\r\n\r\n')
+    return head.split(b'\r\n')[0].decode(), body.decode()
+
+
+class FormatTest(unittest.TestCase):
+    def test_render(self):
+        family = MetricFamily('imu_test_total', 'counter', 'A test counter')
+        family.add(3, device='a"b\\c\nd')
+        family.add(0.5)
+        family.add(float('inf'), kind='x')
+        self.assertEqual(family.render(), [
+            '# HELP imu_test_total A test counter',
+            '# TYPE imu_test_total counter',
+            'imu_test_total{device="a\\"b\\\\c\\nd"} 3',
+            'imu_test_total 0.5',
+            'imu_test_total{kind="x"} +Inf',
+        ])
+
+    def test_histogram(self):
+        histogram = Histogram(bounds=(0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 5.0):
+            histogram.observe(value)
+        self.assertEqual(histogram.buckets(), [(0.1, 2), (1.0, 3)])
+        family = MetricFamily('imu_h', 'histogram', 'h')
+        family.add_histogram(histogram.buckets(), histogram.sum, histogram.count, device='a')
+        self.assertEqual(family.render()[2:], [
+            'imu_h_bucket{device="a",le="0.1"} 2',
+            'imu_h_bucket{device="a",le="1.0"} 3',
+            'imu_h_bucket{device="a",le="+Inf"} 4',
+            'imu_h_sum{device="a"} 5.65',
+            'imu_h_count{device="a"} 4',
+        ])
+
+    def test_log_histogram_buckets(self):
+        latency = WindowedHistogram()
+        latency.record_many(np.array([100, 900, 3000, 70000]), now=0.0)
+        buckets, total, count = log_histogram_buckets(latency.lifetime, bounds=(0.001, 0.01, 0.1))
+        self.assertEqual(buckets, [(0.001, 2), (0.01, 3), (0.1, 4)])
+        self.assertEqual(count, 4)
+        self.assertAlmostEqual(total, 0.074, delta=0.074 * 0.04)
+
+
+class CollectorTest(unittest.TestCase):
+    def test_stream_metrics(self):
+        stats = StreamStats()
+        records = np.zeros(3, dtype=RECORD_DTYPE)
+        records['type'] = SENSOR_ACCEL
+        records['seq'] = [0, 1, 3]
+        records['ts'] = 1.0
+        stats.observe(records)
+        stats.messages, stats.bytes = 1, 75
+        metrics = StreamMetrics()
+        metrics.add(stats, 2, device='a', stream='2')
+        lines = [line for family in metrics.families() for line in family.render()]
+        self.assertIn('imu_stream_samples_total{device="a",stream="2"} 3', lines)
+        self.assertIn('imu_stream_samples_lost_total{device="a",stream="2"} 1', lines)
+        self.assertIn('imu_stream_queue_depth{device="a",stream="2"} 2', lines)
+        self.assertIn('imu_stream_latency_seconds_count{device="a",stream="2"} 3', lines)
+
+    def test_quic_metrics(self):
+        client, server = connected_pair()
+        track_lost_packets(client)
+        client.send_stream_data(client.get_next_available_stream_id(), b'x' * 5000)
+        # The first flight never arrives, so loss detection has to declare it lost
+        client.datagrams_to_send(0.1)
+        now = 0.1
+        for _ in range(20):
+            now += 0.2
+            timer = client.get_timer()
+            if timer is not None and timer <= now:
+                client.handle_timer(now)
+            exchange(client, server, now)
+        metrics = QuicMetrics()
+        metrics.add(client, device='a')
+        lines = [line for family in metrics.families() for line in family.render()]
+        lost = [line for line in lines if line.startswith('imu_quic_packets_lost_total')]
+        self.assertEqual(lost, [f'imu_quic_packets_lost_total{{device="a"}} {client._loss.packets_lost}'])
+        self.assertGreater(client._loss.packets_lost, 0)
+        self.assertEqual(sorted(labels['kind'] for _, labels, _ in metrics.rtt.samples), ['latest', 'min', 'smoothed'])
+
+    def test_a_failing_collector_is_skipped(self):
+        registry = MetricsRegistry()
+        family = MetricFamily('imu_ok', 'gauge', 'ok')
+        family.add(1)
+        registry.register(lambda: 1 / 0)
+        registry.register(lambda: [family, MetricFamily('imu_empty', 'gauge', 'empty')])
+        with self.assertLogs(level='ERROR'):
+            text = registry.render()
+        self.assertEqual(text, '# HELP imu_ok ok\n# TYPE imu_ok gauge\nimu_ok 1\n')
+
+
+class MetricsServerTest(unittest.TestCase):
+    def test_endpoint(self):
+        async def run():
+            server = MetricsServer(port=0)
+            family = MetricFamily('imu_up', 'gauge', 'Whether the server is up')
+            family.add(1)
+            server.registry.register(lambda: [family])
+            await server.start()
+            port = server._server.sockets[0].getsockname()[1]
+            try:
+                responses = [await fetch(port, request) for request in (
+                    b'GET /metrics HTTP/1.1\r\nHost: x\r\n\r\n',
+                    b'HEAD /metrics HTTP/1.1\r\n\r\n',
+                    b'GET /other HTTP/1.1\r\n\r\n',
+                    b'POST /metrics HTTP/1.1\r\n\r\n',
+                )]
+            finally:
+                await server.close()
+            return responses
+        (status, body), head, missing, post = asyncio.run(run())
+        self.assertEqual(status, 'HTTP/1.1 200 OK')
+        self.assertIn('imu_up 1\n', body)
+        self.assertIn('imu_event_loop_lag_seconds_count', body)
+        self.assertEqual(head, ('HTTP/1.1 200 OK', ''))
+        self.assertEqual(missing[0], 'HTTP/1.1 404 Not Found')
+        self.assertEqual(post[0], 'HTTP/1.1 405 Method Not Allowed')
+
+    def test_loop_lag(self):
+        async def run():
+            monitor = LoopLagMonitor(interval=0.01)
+            task = asyncio.create_task(monitor.run())
+            await asyncio.sleep(0.015)
+            # Hold the loop so the monitor's timer fires late
+            busy_until = asyncio.get_running_loop().time() + 0.05
+            while asyncio.get_running_loop().time() < busy_until:
+                pass
+            await asyncio.sleep(0.02)
+            task.cancel()
+            return monitor
+        monitor = asyncio.run(run())
+        self.assertGreaterEqual(monitor.histogram.count, 2)
+        self.assertGreater(monitor.histogram.sum, 0.02)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+import os
+import ssl
+import asyncio
+import unittest
+from aioquic.asyncio import serve
+from aioquic.quic.configuration import QuicConfiguration
+from aioquic.quic.connection import QuicConnection
+from aioquic.quic.events import StreamDataReceived
+from helpers.quic_connection import PrioritizedQuicConnection, connect_prioritized
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CLIENT_ADDR = ('10.0.0.1', 5000)
+SERVER_ADDR = ('10.0.0.2', 4433)
+
+
+def server_configuration():
+    configuration = QuicConfiguration(is_client=False)
+    configuration.load_cert_chain(os.path.join(ROOT, 'ssl_cert.pem'), os.path.join(ROOT, 'ssl_key.pem'))
+    return configuration
+
+
+def client_configuration():
+    configuration = QuicConfiguration(is_client=True)
+    configuration.verify_mode = ssl.CERT_NONE
+    return configuration
+
+
+class Link:
+    """A client and server connection exchanging datagrams in memory, with a fake clock"""
+    def __init__(self, client_class=PrioritizedQuicConnection):
+        self.client = client_class(configuration=client_configuration())
+        self.server = QuicConnection(configuration=server_configuration(),
+                                     original_destination_connection_id=self.client.original_destination_connection_id)
+        self.now = 0.0
+        self.received = {}
+        self.client.connect(SERVER_ADDR, now=self.now)
+        for _ in range(10):
+            self.step(0.0)
+
+    def step(self, elapsed=0.001):
+        self.now += elapsed
+        for data, _ in self.client.datagrams_to_send(self.now):
+            self.server.receive_datagram(data, CLIENT_ADDR, self.now)
+        for data, _ in self.server.datagrams_to_send(self.now):
+            self.client.receive_datagram(data, SERVER_ADDR, self.now)
+        event = self.server.next_event()
+        while event is not None:
+            if isinstance(event, StreamDataReceived):
+                self.received[event.stream_id] = self.received.get(event.stream_id, 0) + len(event.data)
+            event = self.server.next_event()
+
+    def run_until(self, total):
+        """Step until the server received total stream bytes"""
+        while sum(self.received.values()) < total:
+            self.step()
+
+
+def backlogged_streams(client, weights, size=200000):
+    stream_ids = []
+    for weight in weights:
+        stream_id = client.get_next_available_stream_id()
+        client.send_stream_data(stream_id, b'x' * size)
+        if weight is not None:
+            client.set_stream_weight(stream_id, weight)
+        stream_ids.append(stream_id)
+    return stream_ids
+
+
+class PacketSchedulingTest(unittest.TestCase):
+    def test_weights_decide_the_bandwidth_share(self):
+        link = Link()
+        first, second = backlogged_streams(link.client, (300, 100))
+        link.run_until(150000)
+        share = link.received[first] / (link.received[first] + link.received[second])
+        self.assertAlmostEqual(share, 0.75, delta=0.03)
+        self.assertAlmostEqual(link.client.scheduler.shares()[first], 0.75, delta=0.03)
+
+    def test_plain_connection_shares_evenly(self):
+        # What the weights change: aioquic on its own serves backlogged streams round robin
+        link = Link(QuicConnection)
+        first, second = backlogged_streams(link.client, (None, None))
+        link.run_until(150000)
+        share = link.received[first] / (link.received[first] + link.received[second])
+        self.assertAlmostEqual(share, 0.5, delta=0.03)
+
+    def test_weight_change_while_backlogged(self):
+        link = Link()
+        first, second = backlogged_streams(link.client, (100, 100), size=400000)
+        link.run_until(60000)
+        before = dict(link.received)
+        link.client.set_stream_weight(second, 300)
+        link.run_until(before[first] + before[second] + 120000)
+        first_bytes = link.received[first] - before[first]
+        second_bytes = link.received[second] - before[second]
+        self.assertAlmostEqual(second_bytes / (first_bytes + second_bytes), 0.75, delta=0.03)
+
+    def test_send_buffer_occupancy(self):
+        link = Link()
+        stream_id, = backlogged_streams(link.client, (100,), size=50000)
+        occupancy = link.client.send_buffer_occupancy()[stream_id]
+        self.assertEqual(occupancy, dict(unsent=50000, unacked=50000))
+        link.run_until(50000)
+        for _ in range(50):
+            link.step()
+        occupancy = link.client.send_buffer_occupancy()[stream_id]
+        self.assertEqual(occupancy, dict(unsent=0, unacked=0))
+
+
+class ConnectPrioritizedTest(unittest.TestCase):
+    def test_connects_with_a_prioritized_connection(self):
+        tokens = []
+
+        async def run():
+            server = await serve('127.0.0.1', 0, configuration=server_configuration())
+            port = server._transport.get_extra_info('sockname')[1]
+            try:
+                async with connect_prioritized('127.0.0.1', port, configuration=client_configuration(),
+                                               token_handler=tokens.append) as protocol:
+                    self.assertIsInstance(protocol._quic, PrioritizedQuicConnection)
+                    self.assertEqual(protocol._quic._token_handler, tokens.append)
+                    await protocol.ping()
+                    await asyncio.sleep(0.05)
+            finally:
+                server.close()
+        asyncio.run(run())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+import random
+import unittest
+from helpers.quic_priority import PriorityManager, HEAP_SLACK
+
+
+def run_backlogged(manager, sends, sizes=(100,), seed=0):
+    """Send with every registered stream backlogged, return the bytes each one got"""
+    rng = random.Random(seed)
+    start = {sid: priority.bytes_sent for sid, priority in manager._streams.items()}
+    for sid in manager._streams:
+        manager.activate(sid)
+    for _ in range(sends):
+        sid = manager.next_stream()
+        manager.update_after_send(sid, rng.choice(sizes))
+    return {sid: priority.bytes_sent - start[sid] for sid, priority in manager._streams.items()}
+
+
+class FairQueueingTest(unittest.TestCase):
+    def test_byte_shares_follow_weights(self):
+        manager = PriorityManager()
+        weights = {0: 256, 1: 128, 2: 64, 3: 16}
+        for sid, weight in weights.items():
+            manager.add_stream(sid, weight)
+        sent = run_backlogged(manager, 20000, sizes=(25, 100, 1200))
+        total = sum(sent.values())
+        for sid, weight in weights.items():
+            self.assertAlmostEqual(sent[sid] / total, weight / sum(weights.values()), delta=0.01)
+
+    def test_shares_count_bytes_not_messages(self):
+        manager = PriorityManager()
+        manager.add_stream(0)
+        manager.add_stream(1)
+        manager.activate(0)
+        manager.activate(1)
+        sends = {0: 0, 1: 0}
+        for _ in range(1100):
+            sid = manager.next_stream()
+            sends[sid] += 1
+            # Stream 0 sends ten times bigger messages, so it gets ten times fewer turns
+            manager.update_after_send(sid, 1000 if sid == 0 else 100)
+        self.assertAlmostEqual(sends[1] / sends[0], 10, delta=0.2)
+        self.assertAlmostEqual(manager.shares()[0], 0.5, delta=0.01)
+
+    def test_weight_change_applies_to_later_sends(self):
+        manager = PriorityManager()
+        manager.add_stream(0, 100)
+        manager.add_stream(1, 100)
+        run_backlogged(manager, 1000)
+        manager.set_weight(0, 300)
+        sent = run_backlogged(manager, 4000)
+        self.assertAlmostEqual(sent[0] / (sent[0] + sent[1]), 0.75, delta=0.01)
+
+    def test_idle_stream_gets_no_credit(self):
+        manager = PriorityManager()
+        manager.add_stream(0)
+        manager.add_stream(1)
+        manager.activate(0)
+        for _ in range(100):
+            manager.update_after_send(manager.next_stream(), 100)
+        # Stream 1 was idle all along, on waking it shares evenly rather than catching up
+        sent = run_backlogged(manager, 100)
+        self.assertEqual(sent[0], sent[1])
+
+    def test_ready_set(self):
+        manager = PriorityManager()
+        for sid in (0, 4, 8):
+            manager.add_stream(sid)
+        picked = []
+        for _ in range(6):
+            sid = manager.get_next_stream([4, 8])
+            picked.append(sid)
+            manager.update_after_send(sid, 100)
+        self.assertEqual(sorted(picked), [4, 4, 4, 8, 8, 8])
+        self.assertIsNone(manager.get_next_stream([]))
+        # Unregistered streams still get to send
+        self.assertEqual(manager.get_next_stream([99]), 99)
+
+    def test_removed_and_idle_streams_leave_the_heap(self):
+        manager = PriorityManager()
+        for sid in range(3):
+            manager.add_stream(sid)
+            manager.activate(sid)
+        manager.remove_stream(0)
+        manager.deactivate(1)
+        self.assertEqual(manager.next_stream(), 2)
+        self.assertNotIn(0, manager)
+        for _ in range(10 * HEAP_SLACK):
+            manager.activate(1)
+            manager.deactivate(1)
+        # Stale entries are compacted away
+        self.assertLessEqual(len(manager._heap), 2 * len(manager._active) + HEAP_SLACK)
+
+    def test_rejects_non_positive_weights(self):
+        manager = PriorityManager()
+        with self.assertRaises(ValueError):
+            manager.add_stream(0, 0)
+        manager.add_stream(0)
+        with self.assertRaises(ValueError):
+            manager.set_weight(0, -1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,176 @@
+import asyncio
+import tempfile
+import unittest
+import numpy as np
+from aioquic.quic.configuration import QuicConfiguration
+from aioquic.quic.connection import QuicConnection
+from aioquic.quic.events import StreamDataReceived
+from quic_server import ConnectionRegistry, HttpServerProtocol
+from helpers.recording import Recorder, FSYNC_NONE
+from helpers.session import SessionTable
+from helpers.channels import MAG, BARO
+from helpers.codec import SampleEncoder, FORMAT_BINARY, FORMAT_DELTA, FORMAT_TEXT, SENSOR_ACCEL, SENSOR_GYRO
+
+
+def make_protocol(port=40000, **kwargs):
+    """A server protocol on a connection that never sends, with a peer address to name it after"""
+    quic = QuicConnection(configuration=QuicConfiguration(is_client=True))
+    quic.connect(('127.0.0.1', port), now=0)
+    return HttpServerProtocol(quic, **kwargs)
+
+
+def stream_data(encoder, tag, sensor, count, header=True):
+    data = encoder.encode_many(sensor, np.zeros((count, 3)))
+    return encoder.header(tag) + data if header else data
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+class ConnectionLifecycleTest(unittest.TestCase):
+    def test_streams_are_processed_and_released(self):
+        async def run():
+            registry = ConnectionRegistry()
+            protocol = make_protocol(registry=registry)
+            encoder = SampleEncoder(FORMAT_BINARY)
+            protocol.quic_event_received(StreamDataReceived(stream_data(encoder, 'accel', SENSOR_ACCEL, 5), False, 2))
+            protocol.quic_event_received(StreamDataReceived(stream_data(encoder, 'gyro', SENSOR_GYRO, 3), True, 6))
+            await settle()
+            self.assertEqual(set(protocol.data_queues), {2})
+            protocol.quic_event_received(StreamDataReceived(stream_data(encoder, 'accel', SENSOR_ACCEL, 2, False), True, 2))
+            await settle()
+            # Every handler released its stream's state once the stream ended
+            self.assertEqual((protocol.data_queues, protocol.reassemblers, protocol._processing_tasks), ({}, {}, {}))
+            self.assertEqual(registry.sample_counts(), {'accel': 7, 'gyro': 3})
+            await registry.shutdown()
+            self.assertEqual(len(registry), 0)
+            self.assertEqual(registry.total_connections, 1)
+            # Samples of released connections still count
+            self.assertEqual(registry.sample_counts(), {'accel': 7, 'gyro': 3})
+        asyncio.run(run())
+
+    def test_shutdown_stops_open_streams(self):
+        async def run():
+            registry = ConnectionRegistry()
+            protocol = make_protocol(registry=registry)
+            protocol.quic_event_received(StreamDataReceived(stream_data(SampleEncoder(), 'accel', SENSOR_ACCEL, 4), False, 2))
+            await settle()
+            await registry.shutdown()
+            self.assertEqual(protocol._processing_tasks, {})
+            self.assertEqual(registry.sample_counts(), {'accel': 4})
+        asyncio.run(run())
+
+    def test_invalid_header_is_counted(self):
+        async def run():
+            protocol = make_protocol()
+            protocol.quic_event_received(StreamDataReceived(b'accel;bin9\n', False, 2))
+            await protocol.shutdown()
+            return protocol
+        protocol = asyncio.run(run())
+        self.assertEqual(protocol.invalid_headers, 1)
+        self.assertEqual(protocol.data_queues, {})
+
+    def test_announced_channels_are_dispatched(self):
+        async def run():
+            registry = ConnectionRegistry()
+            protocol = make_protocol(registry=registry)
+            encoder = SampleEncoder(FORMAT_DELTA)
+            data = (encoder.header('env', channels=(MAG, BARO)) + encoder.encode_many(MAG.id, np.ones((4, 3)))
+                    + encoder.encode_many(BARO.id, np.full((2, 1), 1013.25)))
+            protocol.quic_event_received(StreamDataReceived(data, True, 2))
+            # A channel announced with another shape than ours is refused
+            protocol.quic_event_received(StreamDataReceived(b'env;bin1;channels=baro:4:3\n', False, 6))
+            await settle()
+            self.assertEqual(protocol.invalid_headers, 1)
+            self.assertEqual(registry.sample_counts(), {'mag': 4, 'baro': 2})
+            self.assertEqual(protocol.series.channel(BARO.id).latest()['axes'][:, 0].tolist(), [1013.25, 1013.25])
+            await registry.shutdown()
+        asyncio.run(run())
+
+
+class DeviceNameTest(unittest.TestCase):
+    def test_reconnect_records_under_the_same_device(self):
+        async def run(root):
+            registry = ConnectionRegistry()
+            recorder = Recorder(root, fsync=FSYNC_NONE)
+            encoder = SampleEncoder(FORMAT_BINARY)
+            encoder.options['device'] = 'imu-7'
+            old = make_protocol(40000, registry=registry, recorder=recorder)
+            new = make_protocol(40001, registry=registry, recorder=recorder)
+            old.quic_event_received(StreamDataReceived(stream_data(encoder, 'accel', SENSOR_ACCEL, 3), True, 2))
+            new.quic_event_received(StreamDataReceived(stream_data(encoder, 'accel', SENSOR_ACCEL, 2), True, 2))
+            await settle()
+            self.assertEqual((old.device_id, new.device_id), ('imu-7', 'imu-7'))
+            # The stale connection going away leaves the device's logs open for the new one
+            await old.shutdown()
+            self.assertIn(('imu-7', 'accel'), recorder.logs)
+            self.assertEqual(recorder.logs[('imu-7', 'accel')].total, 5)
+            await new.shutdown()
+            self.assertEqual(recorder.logs, {})
+            recorder.close()
+        with tempfile.TemporaryDirectory() as root:
+            asyncio.run(run(root))
+
+    def test_unnamed_client_is_named_after_its_address(self):
+        async def run():
+            return [make_protocol(port).device_id for port in (40002, 40002, 40003)]
+        first, again, other = asyncio.run(run())
+        self.assertEqual(first, again)
+        self.assertNotEqual(first, other)
+
+    def test_invalid_device_name_is_rejected(self):
+        async def run():
+            protocol = make_protocol()
+            encoder = SampleEncoder()
+            encoder.options['device'] = '../x'
+            protocol.quic_event_received(StreamDataReceived(stream_data(encoder, 'accel', SENSOR_ACCEL, 1), False, 2))
+            await protocol.shutdown()
+            return protocol
+        protocol = asyncio.run(run())
+        self.assertEqual(protocol.invalid_headers, 1)
+
+
+class ReliableSessionTest(unittest.TestCase):
+    def test_replay_after_a_reconnect_is_deduplicated(self):
+        async def run():
+            registry = ConnectionRegistry()
+            sessions = SessionTable()
+            options = dict(session='abc')
+            old = make_protocol(40000, registry=registry, sessions=sessions)
+            encoder = SampleEncoder(FORMAT_BINARY)
+            encoder.options.update(options)
+            old.quic_event_received(StreamDataReceived(stream_data(encoder, 'accel', SENSOR_ACCEL, 5), True, 2))
+            await asyncio.sleep(0.1)
+            self.assertEqual(sessions.processed('abc'), {SENSOR_ACCEL: 4})
+            # The acknowledgements went out on a stream the server opened
+            self.assertIsNotNone(old._ack_stream)
+            await old.shutdown()
+            # The client never saw the acknowledgement and replays everything with two new samples
+            new = make_protocol(40001, registry=registry, sessions=sessions)
+            encoder = SampleEncoder(FORMAT_BINARY)
+            encoder.options.update(options)
+            new.quic_event_received(StreamDataReceived(stream_data(encoder, 'accel', SENSOR_ACCEL, 7), True, 2))
+            await settle()
+            self.assertEqual(sessions.processed('abc'), {SENSOR_ACCEL: 6})
+            await new.shutdown()
+            return registry, sessions
+        registry, sessions = asyncio.run(run())
+        self.assertEqual(registry.sample_counts(), {'accel': 7})
+        self.assertEqual((sessions.accepted, sessions.duplicates), (7, 5))
+
+    def test_text_streams_do_not_join_a_session(self):
+        async def run():
+            sessions = SessionTable()
+            protocol = make_protocol(sessions=sessions)
+            protocol.join_session('abc', FORMAT_TEXT)
+            await protocol.shutdown()
+            return protocol, sessions
+        protocol, sessions = asyncio.run(run())
+        self.assertIsNone(protocol.session_id)
+        self.assertEqual(sessions.sessions, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+import time
+import unittest
+import numpy as np
+from helpers.channels import BARO
+from helpers.codec import SampleEncoder, decode_batch, decode_rates, FORMAT_BINARY, SENSOR_ACCEL, SENSOR_GYRO, \
+    RATE_FULL, RATE_DECIMATE, RATE_AVERAGE
+from helpers.rate_control import (ChannelPolicy, ChannelReducer, RateController, DEGRADE_INTERVAL, RECOVER_HOLD,
+                                  ANNOUNCE_INTERVAL)
+from helpers.ring import SampleRing
+
+
+class ChannelReducerTest(unittest.TestCase):
+    def test_full_rate_passes_through(self):
+        rows = np.arange(12, dtype=np.float32).reshape(4, 3)
+        np.testing.assert_array_equal(ChannelReducer().reduce(rows), rows)
+
+    def test_decimate_carries_partial_windows(self):
+        reducer = ChannelReducer()
+        reducer.set_step(RATE_DECIMATE, 4)
+        rows = np.arange(30, dtype=np.float32).reshape(10, 3)
+        first = reducer.reduce(rows[:6])
+        second = reducer.reduce(rows[6:])
+        np.testing.assert_array_equal(np.concatenate((first, second)), rows[[0, 4]])
+        self.assertEqual(len(reducer._carry), 2)
+
+    def test_average(self):
+        reducer = ChannelReducer()
+        reducer.set_step(RATE_AVERAGE, 2)
+        rows = np.arange(12, dtype=np.float32).reshape(4, 3)
+        np.testing.assert_array_equal(reducer.reduce(rows), [[1.5, 2.5, 3.5], [7.5, 8.5, 9.5]])
+
+    def test_one_axis_channel(self):
+        reducer = ChannelReducer(BARO.dim)
+        reducer.set_step(RATE_AVERAGE, 4)
+        out = reducer.reduce(np.arange(8, dtype=np.float32))
+        self.assertEqual(out.shape, (2, 1))
+        np.testing.assert_array_equal(out[:, 0], [1.5, 5.5])
+
+    def test_step_change_drops_the_open_window(self):
+        reducer = ChannelReducer()
+        reducer.set_step(RATE_AVERAGE, 4)
+        reducer.reduce(np.ones((3, 3)))
+        reducer.set_step(RATE_AVERAGE, 2)
+        np.testing.assert_array_equal(reducer.reduce(np.zeros((2, 3))), np.zeros((1, 3)))
+        # Factor 1 is full rate whatever the mode
+        reducer.set_step(RATE_DECIMATE, 1)
+        self.assertEqual(reducer.mode, RATE_FULL)
+
+
+class RateControllerTest(unittest.TestCase):
+    def setUp(self):
+        self.ring = SampleRing(capacity=10)
+        self.controller = RateController()
+        self.controller.attach([self.ring])
+
+    def congest(self):
+        self.ring.push(np.zeros((6, 6)))
+
+    def test_degrades_one_level_per_interval(self):
+        self.congest()
+        self.controller.update(now=100.0)
+        self.controller.update(now=100.0 + DEGRADE_INTERVAL / 2)
+        self.assertEqual(self.controller.level, 1)
+        self.assertIn('queue', self.controller.reasons)
+        self.controller.update(now=100.0 + DEGRADE_INTERVAL)
+        self.assertEqual(self.controller.level, 2)
+        # Accel keeps full rate a level longer than gyro
+        self.assertEqual(self.controller.reducers[SENSOR_ACCEL].mode, RATE_AVERAGE)
+        self.assertEqual(self.controller.reducers[SENSOR_GYRO].factor, 4)
+
+    def test_recovers_after_a_quiet_hold(self):
+        self.congest()
+        self.controller.update(now=100.0)
+        self.ring.pop()
+        self.controller.update(now=100.0 + RECOVER_HOLD / 2)
+        self.assertEqual(self.controller.level, 1)
+        self.controller.update(now=100.0 + RECOVER_HOLD)
+        self.assertEqual(self.controller.level, 0)
+        self.assertEqual(self.controller.reasons, [])
+
+    def test_level_is_capped_by_the_longest_policy(self):
+        controller = RateController({SENSOR_ACCEL: ChannelPolicy(((RATE_FULL, 1), (RATE_DECIMATE, 2)))})
+        controller.attach([self.ring])
+        self.congest()
+        for i in range(5):
+            controller.update(now=100.0 + i * DEGRADE_INTERVAL)
+        self.assertEqual(controller.level, 1)
+        # Channels without a policy are left alone
+        rows = np.ones((4, 3))
+        self.assertIs(controller.reduce(SENSOR_GYRO, rows), rows)
+
+    def test_announces_step_changes_and_periodically(self):
+        encoder = SampleEncoder(FORMAT_BINARY)
+        # The announcement clock starts when the controller is built
+        start = time.monotonic()
+        self.assertEqual(self.controller.announcements(encoder, now=start), [])
+        self.congest()
+        self.controller.update(now=start)
+        messages = self.controller.announcements(encoder, now=start)
+        self.assertEqual([sensor for sensor, _ in messages], [SENSOR_GYRO])
+        rates = decode_rates(decode_batch(messages[0][1])[0])
+        self.assertEqual([(sensor, factor, mode) for sensor, _, factor, mode in rates], [(SENSOR_GYRO, 2, RATE_AVERAGE)])
+        messages = self.controller.announcements(encoder, now=start + ANNOUNCE_INTERVAL)
+        self.assertEqual(sorted(sensor for sensor, _ in messages), [SENSOR_ACCEL, SENSOR_GYRO])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+from helpers.codec import RECORD_DTYPE
+from helpers.recording import Recorder, Segment, SegmentLog, device_name, FSYNC_ALWAYS, FSYNC_NONE
+
+
+def records(start, count):
+    """Records numbered start..start+count, one every 10 ms"""
+    out = np.zeros(count, dtype=RECORD_DTYPE)
+    out['seq'] = np.arange(start, start + count)
+    out['ts'] = out['seq'] * 0.01
+    return out
+
+
+class SegmentLogTest(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.directory = self._tmp.name
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def test_segments_rotate_when_full(self):
+        log = SegmentLog(self.directory, segment_records=10, index_every=4, fsync=FSYNC_NONE)
+        log.append(records(0, 7))
+        log.append(records(7, 18))
+        self.assertEqual(log.segments, [f"{first:020d}" for first in (0, 10, 20)])
+        self.assertEqual(log.total, 25)
+        log.close()
+        counts = []
+        for name in log.segments:
+            segment = Segment(os.path.join(self.directory, name + '.seg'), readonly=True)
+            counts.append(segment.count)
+            segment.close()
+        self.assertEqual(counts, [10, 10, 5])
+
+    def test_sparse_index(self):
+        log = SegmentLog(self.directory, segment_records=10, index_every=4, fsync=FSYNC_NONE)
+        log.append(records(0, 3))
+        log.append(records(3, 10))
+        log.close()
+        # Entries sit at every fourth record counted from each segment's start
+        first = np.fromfile(os.path.join(self.directory, log.segments[0] + '.idx'), dtype=[('ts', '<f8'), ('rec', '<u8')])
+        second = np.fromfile(os.path.join(self.directory, log.segments[1] + '.idx'), dtype=[('ts', '<f8'), ('rec', '<u8')])
+        self.assertEqual(first['rec'].tolist(), [0, 4, 8])
+        self.assertEqual(second['rec'].tolist(), [0])
+
+    def test_read_range_matches_a_full_scan(self):
+        log = SegmentLog(self.directory, segment_records=50, index_every=8, fsync=FSYNC_NONE)
+        everything = records(0, 173)
+        for start in range(0, len(everything), 17):
+            log.append(everything[start:start + 17])
+        ts = everything['ts']
+        for t0, t1 in ((0.0, 2.0), (0.123, 0.987), (0.49, 0.51), (1.5, 10.0), (5.0, 6.0), (0.3, 0.3)):
+            expected = everything[(ts >= t0) & (ts < t1)]
+            self.assertEqual(log.read_range(t0, t1)['seq'].tolist(), expected['seq'].tolist(), (t0, t1))
+        log.close()
+
+    def test_reopen_continues_the_last_segment(self):
+        log = SegmentLog(self.directory, segment_records=10, fsync=FSYNC_NONE)
+        log.append(records(0, 13))
+        log.close()
+        log = SegmentLog(self.directory, segment_records=10, fsync=FSYNC_NONE)
+        self.assertEqual(log.total, 13)
+        log.append(records(13, 10))
+        self.assertEqual(log.read_range(0, 1)['seq'].tolist(), list(range(23)))
+        self.assertEqual(len(log.segments), 3)
+        log.close()
+
+    def test_rejects_unknown_fsync_policy(self):
+        with self.assertRaises(ValueError):
+            SegmentLog(self.directory, fsync='sometimes')
+
+    def test_not_a_segment(self):
+        path = os.path.join(self.directory, 'bogus.seg')
+        with open(path, 'wb') as f:
+            f.write(b'\0' * 128)
+        with self.assertRaises(ValueError):
+            Segment(path)
+
+
+class RecorderTest(unittest.TestCase):
+    def test_background_sync_and_close(self):
+        with tempfile.TemporaryDirectory() as root:
+            recorder = Recorder(root, segment_records=10, fsync=FSYNC_ALWAYS)
+            recorder.append('imu-1', 'accel', records(0, 25))
+            recorder.append('imu-1', 'gyro', records(0, 3))
+            recorder.append('imu-2', 'accel', records(0, 4))
+            recorder.close_device('imu-1')
+            self.assertEqual(set(recorder.logs), {('imu-2', 'accel')})
+            recorder.close()
+            # Every queued sync and close ran before close() returned
+            self.assertEqual(recorder.logs, {})
+            self.assertTrue(recorder.executor._shutdown)
+            log = SegmentLog(os.path.join(root, 'imu-1', 'accel'), segment_records=10)
+            self.assertEqual(log.total, 25)
+            self.assertEqual(len(log.read_range(0, 1)), 25)
+            log.close()
+
+
+class DeviceNameTest(unittest.TestCase):
+    def test_device_then_session_then_peer(self):
+        self.assertEqual(device_name({'device': 'imu-7', 'session': 'abc'}, '10.0.0.1_4433'), 'imu-7')
+        self.assertEqual(device_name({'session': 'abc'}, '10.0.0.1_4433'), 'abc')
+        self.assertEqual(device_name({}, '10.0.0.1_4433'), '10.0.0.1_4433')
+
+    def test_names_must_be_safe_directory_names(self):
+        for name in ('../etc', '.', '..', 'a/b', '', 'x' * 65):
+            with self.assertRaises(ValueError, msg=name):
+                device_name({'device': name}, 'peer')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+import time
+import threading
+import unittest
+import numpy as np
+from helpers.ring import SampleRing, BLOCK, DROP_NEWEST
+
+
+def numbered(start, count, width=6):
+    """Rows whose every column holds the row's number"""
+    return np.repeat(np.arange(start, start + count, dtype=np.float32)[:, None], width, axis=1)
+
+
+class RacingRows:
+    """Stands in for a ring's row array and runs a callback partway through the consumer's copy"""
+    def __init__(self, rows, during_read):
+        self.rows = rows
+        self.during_read = during_read
+
+    def __getitem__(self, key):
+        during_read, self.during_read = self.during_read, None
+        if during_read:
+            during_read()
+        return self.rows[key]
+
+    def __setitem__(self, key, value):
+        self.rows[key] = value
+
+
+class OverflowTest(unittest.TestCase):
+    def test_rows_come_out_in_order_across_the_wrap(self):
+        ring = SampleRing(capacity=8)
+        ring.push(numbered(0, 6))
+        np.testing.assert_array_equal(ring.pop(4), numbered(0, 4))
+        ring.push(numbered(6, 5))
+        ring.push_row([11] * 6)
+        self.assertEqual(len(ring), 8)
+        np.testing.assert_array_equal(ring.pop(), numbered(4, 8))
+        self.assertTrue(ring.empty())
+        self.assertEqual(ring.pop().shape, (0, 6))
+
+    def test_drop_oldest_overwrite_is_counted_by_the_consumer(self):
+        ring = SampleRing(capacity=8)
+        ring.push(numbered(0, 5))
+        ring.push(numbered(5, 7))
+        # The producer never waits and never touches the consumer's counter
+        self.assertEqual((ring._truncated, ring._overwritten), (0, 0))
+        np.testing.assert_array_equal(ring.pop(), numbered(4, 8))
+        self.assertEqual(ring._overwritten, 4)
+        self.assertEqual(ring.stats(), dict(pushed=12, dropped_oldest=4, dropped_newest=0, blocked=0))
+
+    def test_drop_oldest_push_longer_than_the_ring(self):
+        ring = SampleRing(capacity=4)
+        ring.push(numbered(0, 10))
+        self.assertEqual((ring._truncated, ring.pushed), (6, 4))
+        np.testing.assert_array_equal(ring.pop(), numbered(6, 4))
+        self.assertEqual(ring.dropped_oldest, 6)
+
+    def test_rows_overwritten_mid_copy_are_discarded(self):
+        ring = SampleRing(capacity=8)
+        ring.push(numbered(0, 8))
+        # The producer overwrites the two oldest rows while the consumer copies them
+        ring._rows = RacingRows(ring._rows, lambda: ring.push(numbered(8, 2)))
+        rows = ring.pop()
+        np.testing.assert_array_equal(rows, numbered(2, 6))
+        self.assertEqual(ring._overwritten, 2)
+        np.testing.assert_array_equal(ring.pop(), numbered(8, 2))
+        self.assertEqual(ring.dropped_oldest, 2)
+
+    def test_drop_newest(self):
+        ring = SampleRing(capacity=4, overflow=DROP_NEWEST)
+        ring.push(numbered(0, 3))
+        ring.push(numbered(3, 3))
+        ring.push_row([9] * 6)
+        self.assertEqual((ring.dropped_newest, ring.dropped_oldest, ring.pushed), (3, 0, 4))
+        np.testing.assert_array_equal(ring.pop(), numbered(0, 4))
+
+    def test_block_waits_for_the_consumer(self):
+        ring = SampleRing(capacity=4, overflow=BLOCK)
+        producer = threading.Thread(target=ring.push, args=(numbered(0, 10),))
+        producer.start()
+        received = []
+        deadline = time.monotonic() + 5
+        while len(received) < 10 and time.monotonic() < deadline:
+            received.extend(ring.pop())
+            time.sleep(0.001)
+        producer.join(timeout=5)
+        np.testing.assert_array_equal(np.array(received), numbered(0, 10))
+        self.assertGreater(ring.blocked, 0)
+        self.assertEqual(ring.dropped_oldest + ring.dropped_newest, 0)
+
+    def test_concurrent_drop_oldest_accounting(self):
+        ring = SampleRing(capacity=64)
+        total = 200000
+
+        def produce():
+            for start in range(0, total, 100):
+                ring.push(numbered(start, 100))
+        producer = threading.Thread(target=produce)
+        producer.start()
+        received = []
+        while producer.is_alive() or not ring.empty():
+            rows = ring.pop()
+            if len(rows):
+                received.append(rows)
+        producer.join()
+        received = np.concatenate(received)
+        # Whatever was dropped, the consumer never sees a torn row, a row twice or out of order
+        self.assertTrue(np.all(received == received[:, :1]))
+        self.assertTrue(np.all(np.diff(received[:, 0]) > 0))
+        # and every row is either received or counted as dropped
+        self.assertEqual(len(received) + ring.dropped_oldest, total)
+
+    def test_waited(self):
+        ring = SampleRing()
+        self.assertEqual(ring.waited(), 0.0)
+        ring.push(numbered(0, 1))
+        time.sleep(0.01)
+        self.assertGreaterEqual(ring.waited(), 0.01)
+
+    def test_rejects_bad_arguments(self):
+        with self.assertRaises(ValueError):
+            SampleRing(overflow='drop-random')
+        with self.assertRaises(ValueError):
+            SampleRing(capacity=0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+import asyncio
+import unittest
+import numpy as np
+from helpers.batching import SampleBatcher
+from helpers.codec import FORMAT_BINARY, RECORD_RATE, SENSOR_ACCEL, SENSOR_GYRO, SampleEncoder, decode_batch
+from helpers.ring import BLOCK, DROP_NEWEST
+from helpers.senders import StreamSender, check_overflow, run_senders
+from helpers.session import ReliableSession
+
+
+class FakeWriter:
+    """Stream writer whose drain waits while the stream is stalled, and fails once it is broken"""
+    def __init__(self):
+        self.writes = []
+        self.flowing = asyncio.Event()
+        self.flowing.set()
+        self.error = None
+
+    def write(self, data):
+        self.writes.append(data)
+
+    async def drain(self):
+        await self.flowing.wait()
+        if self.error:
+            raise self.error
+
+    def seqs(self):
+        return decode_batch(b''.join(self.writes))[0]['seq'].tolist()
+
+
+def make_sender(sensor, writer, encoder, **kwargs):
+    # Every write is flushed at once, so a stalled drain holds the sender up right away
+    return StreamSender(sensor, SampleBatcher(writer, max_batch_bytes=1), encoder.encode_records, **kwargs)
+
+
+def stamp(encoder, sensor, count):
+    return encoder.stamp_items(sensor, [np.zeros((count, 3))])
+
+
+async def settle():
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+
+class OverflowTest(unittest.TestCase):
+    def setUp(self):
+        self.encoder = SampleEncoder(FORMAT_BINARY)
+
+    def test_drop_oldest(self):
+        async def run():
+            sender = make_sender(SENSOR_ACCEL, FakeWriter(), self.encoder, capacity=5)
+            sender.put(stamp(self.encoder, SENSOR_ACCEL, 3))
+            sender.put(stamp(self.encoder, SENSOR_ACCEL, 0))
+            sender.put(stamp(self.encoder, SENSOR_ACCEL, 4))
+            # Part of the oldest block goes
+            self.assertEqual((len(sender), sender.dropped_oldest), (5, 2))
+            self.assertEqual([block['seq'].tolist() for block in sender._blocks], [[2], [3, 4, 5, 6]])
+            # A block longer than the queue keeps only its newest records
+            sender.put(stamp(self.encoder, SENSOR_ACCEL, 8))
+            self.assertEqual([block['seq'].tolist() for block in sender._blocks], [[10, 11, 12, 13, 14]])
+            return sender.stats()
+        self.assertEqual(asyncio.run(run()), dict(queued=5, dropped_oldest=10, dropped_newest=0))
+
+    def test_drop_newest(self):
+        async def run():
+            sender = make_sender(SENSOR_ACCEL, FakeWriter(), self.encoder, capacity=5, overflow=DROP_NEWEST)
+            sender.put(stamp(self.encoder, SENSOR_ACCEL, 3))
+            sender.put(stamp(self.encoder, SENSOR_ACCEL, 3))
+            sender.put(stamp(self.encoder, SENSOR_ACCEL, 2))
+            return sender
+        sender = asyncio.run(run())
+        self.assertEqual([block['seq'].tolist() for block in sender._blocks], [[0, 1, 2], [6, 7]])
+        self.assertEqual(sender.stats(), dict(queued=5, dropped_oldest=0, dropped_newest=3))
+
+    def test_block_is_rejected(self):
+        with self.assertRaises(ValueError):
+            check_overflow(BLOCK)
+        with self.assertRaises(ValueError):
+            StreamSender(SENSOR_ACCEL, None, None, overflow=BLOCK)
+
+
+class RunSendersTest(unittest.TestCase):
+    def test_a_stalled_stream_does_not_hold_up_the_others(self):
+        encoder = SampleEncoder(FORMAT_BINARY)
+        accel, gyro = FakeWriter(), FakeWriter()
+        accel.flowing.clear()
+        senders = [make_sender(SENSOR_ACCEL, accel, encoder), make_sender(SENSOR_GYRO, gyro, encoder)]
+
+        async def feed():
+            for _ in range(3):
+                senders[0].put(stamp(encoder, SENSOR_ACCEL, 2))
+                senders[1].put(stamp(encoder, SENSOR_GYRO, 2))
+                await settle()
+            # The accel stream is stuck on its first write while gyro went out as it came
+            self.assertEqual((len(accel.writes), gyro.seqs()), (1, [0, 1, 2, 3, 4, 5]))
+            accel.flowing.set()
+        asyncio.run(asyncio.wait_for(run_senders(feed(), senders), timeout=5))
+        # Once the feed is done every sender sends what it still holds
+        self.assertEqual(accel.seqs(), [0, 1, 2, 3, 4, 5])
+        self.assertEqual(len(accel.writes), 2)
+
+    def test_messages_go_ahead_of_samples(self):
+        encoder = SampleEncoder(FORMAT_BINARY)
+        writer = FakeWriter()
+        sender = make_sender(SENSOR_ACCEL, writer, encoder)
+
+        async def feed():
+            sender.put(stamp(encoder, SENSOR_ACCEL, 1))
+            sender.send(encoder.encode_rate(SENSOR_ACCEL, 500.0, 2, 'decimate'))
+        asyncio.run(asyncio.wait_for(run_senders(feed(), [sender]), timeout=5))
+        records = decode_batch(b''.join(writer.writes))[0]
+        self.assertEqual(records['type'].tolist(), [RECORD_RATE, SENSOR_ACCEL])
+
+    def test_a_failing_stream_ends_the_group(self):
+        encoder = SampleEncoder(FORMAT_BINARY)
+        broken, healthy = FakeWriter(), FakeWriter()
+        broken.error = ConnectionError("Connection lost")
+        senders = [make_sender(SENSOR_ACCEL, broken, encoder), make_sender(SENSOR_GYRO, healthy, encoder)]
+        fed = asyncio.Event()
+
+        async def feed():
+            senders[0].put(stamp(encoder, SENSOR_ACCEL, 1))
+            fed.set()
+            await asyncio.sleep(60)
+
+        async def run():
+            with self.assertRaises(ConnectionError):
+                await run_senders(feed(), senders)
+            self.assertTrue(fed.is_set())
+        asyncio.run(asyncio.wait_for(run(), timeout=5))
+
+    def test_reliable_sender_sends_from_the_backlog(self):
+        encoder = SampleEncoder(FORMAT_BINARY)
+        session = ReliableSession(catchup_rate=0)
+        session.bind(encoder)
+        session.connected()
+        writer = FakeWriter()
+        sender = make_sender(SENSOR_ACCEL, writer, encoder, session=session)
+
+        async def feed():
+            session.buffer([(SENSOR_ACCEL, np.zeros((3, 3)))])
+            sender.wake()
+            await settle()
+            self.assertEqual(writer.seqs(), [0, 1, 2])
+        asyncio.run(asyncio.wait_for(run_senders(feed(), [sender]), timeout=5))
+        # Sent but not acknowledged, the samples stay in the backlog
+        self.assertEqual(len(session.backlog(SENSOR_ACCEL)), 3)
+        session.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
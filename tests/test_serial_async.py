@@ -0,0 +1,111 @@
+import os
+import fcntl
+import struct
+import asyncio
+import termios
+import threading
+import unittest
+import numpy as np
+from helpers.bridge import SampleBridge, ChannelRings
+from helpers.channels import MAG
+from helpers.codec import SENSOR_ACCEL, SENSOR_GYRO
+from helpers.imu import IMUParser
+from helpers.sources import SyntheticSource
+
+
+class PipePort:
+    """
+    Serial-port-like reader over a pipe, so the event loop can watch its
+    descriptor. Reads never block, like a serial port opened with timeout=0.
+    """
+    def __init__(self):
+        self.read_fd, self.write_fd = os.pipe()
+        os.set_blocking(self.read_fd, False)
+        self.closed = False
+
+    @property
+    def in_waiting(self):
+        return struct.unpack('i', fcntl.ioctl(self.read_fd, termios.FIONREAD, b'\0' * 4))[0]
+
+    def fileno(self):
+        return self.read_fd
+
+    def read(self, size=1):
+        try:
+            return os.read(self.read_fd, size)
+        except BlockingIOError:
+            return b''
+
+    def close(self):
+        self.closed = True
+        os.close(self.read_fd)
+        os.close(self.write_fd)
+
+
+class PipeSource:
+    def __init__(self):
+        self.port = PipePort()
+
+    def open(self, timeout=None):
+        return self.port
+
+
+def drain(rings):
+    blocks = {}
+    for sensor, block in rings.pop():
+        blocks.setdefault(sensor, []).append(block)
+    return {sensor: np.concatenate(found) for sensor, found in blocks.items()}
+
+
+class AsyncReaderTest(unittest.TestCase):
+    def test_polled_source_until_exhausted(self):
+        parser = IMUParser(bulk=True, source=SyntheticSource(rate=20000, duration=0.05, channels=(MAG,)))
+        rings = ChannelRings(SampleBridge(), extra=(MAG,), capacity=4096)
+        asyncio.run(asyncio.wait_for(parser.read_serial_async(rings), timeout=5))
+        blocks = drain(rings)
+        self.assertEqual(len(blocks[SENSOR_ACCEL]), 1000)
+        self.assertEqual(len(blocks[SENSOR_GYRO]), 1000)
+        self.assertEqual(len(blocks[MAG.id]), 5)
+        self.assertEqual(parser.rejected, 0)
+
+    def test_descriptor_reader_until_cancelled(self):
+        source = PipeSource()
+        parser = IMUParser(bulk=True, source=source)
+        bridge = SampleBridge()
+        rings = ChannelRings(bridge)
+
+        async def run():
+            loop = asyncio.get_running_loop()
+            bridge.attach(loop)
+            reader = asyncio.create_task(parser.read_serial_async(rings))
+            await asyncio.sleep(0)
+            # A line split across writes is only pushed once it is complete
+            os.write(source.port.write_fd, b'1.0,2.0,3.0,4.0,5.0,6.0\n7.0,8.0,')
+            await bridge.wait(timeout=5)
+            first = rings.imu.pop()
+            os.write(source.port.write_fd, b'9.0,1.0,2.0,3.0\n')
+            await bridge.wait(timeout=5)
+            second = rings.imu.pop()
+            reader.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await reader
+            # Cancelling unregisters the descriptor
+            self.assertNotIn(source.port.read_fd, loop._selector.get_map())
+            return first, second
+        first, second = asyncio.run(run())
+        self.assertEqual(first.tolist(), [[1, 2, 3, 4, 5, 6]])
+        self.assertEqual(second.tolist(), [[7, 8, 9, 1, 2, 3]])
+        self.assertTrue(source.port.closed)
+
+    def test_threaded_reader_stops(self):
+        parser = IMUParser(bulk=True, source=SyntheticSource(rate=1000))
+        rings = ChannelRings(SampleBridge())
+        thread = threading.Thread(target=parser.read_serial, args=(rings,))
+        thread.start()
+        parser.stop()
+        thread.join(timeout=5)
+        self.assertFalse(thread.is_alive())
+
+
+if __name__ == '__main__':
+    unittest.main()
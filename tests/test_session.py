@@ -0,0 +1,253 @@
+import os
+import asyncio
+import tempfile
+import unittest
+import numpy as np
+from helpers.codec import (RECORD_DTYPE, RECORD_RATE, SEQ_MASK, SENSOR_ACCEL, SENSOR_GYRO, FORMAT_BINARY, FORMAT_TEXT,
+                           SampleEncoder, decode_acks, decode_batch, encode_ack)
+from helpers.session import AckTimer, Backoff, ChannelBacklog, ReliableSession, SessionTable
+
+
+def stamped(start, count, sensor=SENSOR_ACCEL):
+    """Records of one sensor numbered from start, wrapping like sequence numbers do"""
+    records = np.zeros(count, dtype=RECORD_DTYPE)
+    records['type'] = sensor
+    records['seq'] = np.arange(start, start + count, dtype=np.uint64) & SEQ_MASK
+    return records
+
+
+def seqs(records):
+    return records['seq'].tolist()
+
+
+def acks(data):
+    return decode_acks(decode_batch(data)[0])
+
+
+class ChannelBacklogTest(unittest.TestCase):
+    def test_window_spills_to_the_spool_then_drops_the_oldest(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'accel.spool')
+            backlog = ChannelBacklog(window=4, spool_path=path, spool_records=4)
+            backlog.append(stamped(0, 6))
+            self.assertEqual((len(backlog.window), len(backlog.spool)), (4, 2))
+            self.assertEqual(seqs(backlog.take(0.0)), [0, 1, 2, 3, 4, 5])
+            backlog.append(stamped(6, 4))
+            # The spool is full, the two oldest records are gone and no longer count as sent
+            self.assertEqual((len(backlog), backlog.dropped, backlog.sent), (8, 2, 4))
+            self.assertEqual(seqs(backlog.take(0.0)), [6, 7, 8, 9])
+            backlog.close()
+            self.assertFalse(os.path.exists(path))
+
+    def test_without_a_spool_the_window_overflow_is_dropped(self):
+        backlog = ChannelBacklog(window=4)
+        backlog.append(stamped(0, 3))
+        backlog.append(stamped(3, 3))
+        self.assertEqual((len(backlog), backlog.dropped, backlog.appended), (4, 2, 6))
+        self.assertEqual(seqs(backlog.take(0.0)), [2, 3, 4, 5])
+
+    def test_acks_drop_records_across_spool_and_window(self):
+        with tempfile.TemporaryDirectory() as directory:
+            backlog = ChannelBacklog(window=4, spool_path=os.path.join(directory, 'spool'), spool_records=8)
+            backlog.append(stamped(0, 8))
+            backlog.take(0.0)
+            backlog.ack(5)
+            self.assertEqual((len(backlog), backlog.acked, backlog.sent), (2, 6, 2))
+            # An acknowledgement of records already gone changes nothing
+            backlog.ack(3)
+            self.assertEqual(len(backlog), 2)
+            backlog.ack(7)
+            self.assertEqual((len(backlog), backlog.acked, backlog.sent), (0, 8, 0))
+            backlog.ack(8)
+            backlog.close()
+
+    def test_acks_follow_sequence_numbers_across_the_wrap(self):
+        backlog = ChannelBacklog(window=8)
+        backlog.append(stamped(SEQ_MASK - 1, 4))
+        backlog.ack(0)
+        self.assertEqual(seqs(backlog.take(0.0)), [1])
+
+    def test_rewind_replays_at_the_catch_up_rate(self):
+        backlog = ChannelBacklog(window=256, catchup_rate=1000)
+        backlog.append(stamped(0, 100))
+        self.assertEqual(len(backlog.take(0.0)), 100)
+        self.assertIsNone(backlog.wait_time(0.0))
+        backlog.ack(9)
+        backlog.rewind(10.0)
+        self.assertEqual((backlog.replayed, backlog.sent), (90, 0))
+        self.assertTrue(backlog.catching_up)
+        # A burst of 20 ms worth goes out at once, then one record per millisecond
+        self.assertEqual(seqs(backlog.take(10.0)), list(range(10, 30)))
+        self.assertAlmostEqual(backlog.wait_time(10.0), 0.001)
+        self.assertEqual(len(backlog.take(10.005)), 5)
+        # An idle channel never saves up more than a burst
+        self.assertEqual(len(backlog.take(20.0)), 20)
+        backlog.append(stamped(100, 10))
+        sent = 45
+        now = 20.0
+        while backlog.catching_up:
+            now += 0.02
+            sent += len(backlog.take(now))
+        self.assertEqual(sent, 100)
+        self.assertIsNone(backlog.wait_time(now))
+        # Once caught up, new records go out as soon as they arrive
+        backlog.append(stamped(110, 50))
+        self.assertEqual(len(backlog.take(now)), 50)
+
+
+class BackoffTest(unittest.TestCase):
+    def test_doubles_up_to_the_maximum_with_jitter(self):
+        backoff = Backoff(initial=1.0, maximum=4.0)
+        for ceiling in (1.0, 2.0, 4.0, 4.0):
+            delay = backoff.next()
+            self.assertTrue(ceiling / 2 <= delay <= ceiling, (ceiling, delay))
+        backoff.reset()
+        self.assertLessEqual(backoff.next(), 1.0)
+
+
+class SessionTableTest(unittest.TestCase):
+    def test_replayed_records_are_dropped(self):
+        table = SessionTable()
+        self.assertEqual(seqs(table.accept('s', stamped(0, 5))), [0, 1, 2, 3, 4])
+        mixed = np.concatenate((stamped(3, 3), stamped(0, 2, SENSOR_GYRO), stamped(6, 2)))
+        kept = table.accept('s', mixed)
+        # Each channel is deduplicated on its own, and what is kept stays in arrival order
+        self.assertEqual(list(zip(kept['type'].tolist(), seqs(kept))),
+                         [(SENSOR_ACCEL, 5), (SENSOR_GYRO, 0), (SENSOR_GYRO, 1), (SENSOR_ACCEL, 6), (SENSOR_ACCEL, 7)])
+        self.assertEqual((table.accepted, table.duplicates), (10, 2))
+        # Another session keeps its own numbers
+        self.assertEqual(len(table.accept('t', stamped(0, 5))), 5)
+
+    def test_dedup_across_the_wrap(self):
+        table = SessionTable()
+        table.accept('s', stamped(SEQ_MASK - 1, 2))
+        self.assertEqual(seqs(table.accept('s', stamped(SEQ_MASK, 3))), [0, 1])
+
+    def test_other_record_types_pass_through(self):
+        table = SessionTable()
+        rates = stamped(SENSOR_ACCEL, 1, RECORD_RATE)
+        for _ in range(2):
+            self.assertEqual(len(table.accept('s', rates)), 1)
+        table.commit('s', rates)
+        self.assertEqual(table.processed('s'), {})
+
+    def test_commit_and_rewind(self):
+        table = SessionTable()
+        self.assertIsNone(table.processed('s'))
+        table.commit('s', stamped(0, 5))
+        table.accept('s', np.concatenate((stamped(0, 8), stamped(0, 4, SENSOR_GYRO))))
+        table.commit('s', stamped(0, 5))
+        self.assertEqual(table.processed('s'), {SENSOR_ACCEL: 4})
+        # Only the channels of the stream that stopped are taken in again
+        table.rewind('s', [SENSOR_ACCEL])
+        self.assertEqual(seqs(table.accept('s', stamped(3, 5))), [5, 6, 7])
+        self.assertEqual(len(table.accept('s', stamped(2, 2, SENSOR_GYRO))), 0)
+        table.rewind('s')
+        self.assertEqual(seqs(table.accept('s', stamped(0, 4, SENSOR_GYRO))), [0, 1, 2, 3])
+        table.rewind('unknown')
+
+    def test_keeps_the_most_recently_active_sessions(self):
+        table = SessionTable(max_sessions=2)
+        for session in ('a', 'b', 'a', 'c'):
+            table.accept(session, stamped(0, 1))
+        self.assertEqual(list(table.sessions), ['a', 'c'])
+        sessions, records = table.collect()
+        self.assertIn('imu_sessions 2', sessions.render())
+        self.assertIn('imu_session_records_total{outcome="duplicate"} 1', records.render())
+
+
+class AckTimerTest(unittest.TestCase):
+    def test_acknowledges_what_was_processed_once(self):
+        table = SessionTable()
+        sent = []
+
+        async def run():
+            timer = AckTimer(table, 's', sent.append, interval=0.01)
+            timer.flush()
+            table.accept('s', stamped(0, 5))
+            table.commit('s', stamped(0, 3))
+            timer.schedule()
+            timer.schedule()
+            await asyncio.sleep(0.05)
+            # Still waiting for the rest to be processed, but nothing new to send
+            self.assertEqual(len(sent), 1)
+            self.assertIsNotNone(timer._handle)
+            table.commit('s', stamped(3, 2))
+            await asyncio.sleep(0.05)
+            self.assertIsNone(timer._handle)
+            timer.schedule()
+            timer.cancel()
+        asyncio.run(run())
+        self.assertEqual([acks(data) for data in sent], [[(SENSOR_ACCEL, 2)], [(SENSOR_ACCEL, 4)]])
+
+    def test_a_failing_send_is_logged(self):
+        table = SessionTable()
+        table.accept('s', stamped(0, 1))
+        table.commit('s', stamped(0, 1))
+
+        def send(data):
+            raise ConnectionError("stream closed")
+        with self.assertLogs(level='ERROR'):
+            AckTimer(table, 's', send).flush()
+
+
+class ReliableSessionTest(unittest.TestCase):
+    def test_bind(self):
+        session = ReliableSession()
+        with self.assertRaises(ValueError):
+            session.bind(SampleEncoder(FORMAT_TEXT))
+        encoder = SampleEncoder(FORMAT_BINARY)
+        session.bind(encoder)
+        self.assertIn(f'session={session.id}'.encode(), encoder.header('accel'))
+
+    def test_unacknowledged_samples_are_replayed(self):
+        session = ReliableSession(catchup_rate=0)
+        woken = []
+        session.bind(SampleEncoder(FORMAT_BINARY), wakeup=lambda: woken.append(True))
+        session.connected()
+        first, _ = decode_batch(session.encode_items(SENSOR_ACCEL, [np.zeros((5, 3))]))
+        self.assertEqual(seqs(first), [0, 1, 2, 3, 4])
+        self.assertEqual(session.encode_ready(SENSOR_GYRO), b'')
+        session.receive(decode_batch(encode_ack(SENSOR_ACCEL, 2))[0])
+        self.assertEqual(woken, [True])
+        with self.assertLogs(level='WARNING'):
+            session.connected()
+        replayed, _ = decode_batch(session.encode_ready(SENSOR_ACCEL))
+        self.assertEqual(seqs(replayed), [3, 4])
+        self.assertTrue(session.pending())
+        self.assertEqual(session.stats(), {'accel': dict(appended=5, acked=3, replayed=2, dropped=0, unacked=2)})
+        session.receive(decode_batch(encode_ack(SENSOR_ACCEL, 4))[0])
+        session.encode_ready(SENSOR_ACCEL)
+        self.assertFalse(session.pending())
+        session.close()
+
+    def test_spool_files_are_removed_on_close(self):
+        with tempfile.TemporaryDirectory() as directory:
+            session = ReliableSession(window=2, spool_dir=directory, spool_records=4)
+            session.bind(SampleEncoder(FORMAT_BINARY))
+            session.buffer([(SENSOR_ACCEL, np.zeros((5, 3)))])
+            self.assertEqual(os.listdir(directory), [f'{session.id}-accel.spool'])
+            self.assertEqual(len(session.backlog(SENSOR_ACCEL).spool), 3)
+            session.close()
+            self.assertEqual(os.listdir(directory), [])
+
+    def test_run_reconnects_after_connection_errors(self):
+        session = ReliableSession()
+        session.backoff = Backoff(initial=0.001, maximum=0.002)
+        attempts = []
+
+        async def connect_once():
+            attempts.append(True)
+            if len(attempts) < 3:
+                raise ConnectionError("refused")
+            return 'done'
+
+        async def run():
+            with self.assertLogs(level='WARNING'):
+                return await session.run(connect_once)
+        self.assertEqual(asyncio.run(run()), 'done')
+        self.assertEqual(len(attempts), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
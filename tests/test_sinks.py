@@ -0,0 +1,152 @@
+import io
+import os
+import asyncio
+import tempfile
+import unittest
+import contextlib
+import numpy as np
+from helpers.codec import RECORD_DTYPE
+from helpers.sinks import (CallbackSink, FileSink, NullSink, RingSink, SinkPipeline, StdoutSink, Sink,
+                           pipeline_from_options, sink_from_spec)
+
+
+def records(count, start=0):
+    out = np.zeros(count, dtype=RECORD_DTYPE)
+    out['seq'] = np.arange(start, start + count)
+    out['ts'] = out['seq']
+    out['axes'] = out['seq'][:, None] * np.array([1, 2, 3])
+    return out
+
+
+class ListSink(Sink):
+    def __init__(self):
+        self.batches = []
+        self.closed = False
+
+    def write(self, device, sensor, records):
+        self.batches.append((device, sensor, records['seq'].tolist()))
+
+    def close(self):
+        self.closed = True
+
+
+class FailingSink(Sink):
+    def write(self, device, sensor, records):
+        raise OSError("disk full")
+
+
+class SinkTest(unittest.TestCase):
+    def test_stdout_format(self):
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            sink = StdoutSink()
+            sink.write('dev', 'accel', records(2))
+            one_axis = records(1)
+            one_axis['axes'][0, 0] = 1013.25
+            sink.write('dev', 'baro', one_axis)
+        self.assertEqual(out.getvalue(), "Accel: X=0.00 Y=0.00 Z=0.00\nAccel: X=1.00 Y=2.00 Z=3.00\nBaro: 1013.25\n")
+
+    def test_file_sink_appends_csv(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'samples.csv')
+            for start in (0, 2):
+                sink = FileSink(path)
+                sink.write('dev', 'gyro', records(2, start))
+                sink.close()
+            with open(path) as f:
+                lines = f.read().splitlines()
+        # The header is written once, however often the file is reopened
+        self.assertEqual(lines[0], 'device,sensor,ts,x,y,z')
+        self.assertEqual(len(lines), 5)
+        self.assertEqual(lines[4], 'dev,gyro,3.000000,3.000000,6.000000,9.000000')
+
+    def test_ring_sink_keeps_the_newest(self):
+        sink = RingSink(capacity=3)
+        sink.write('dev', 'accel', records(5))
+        self.assertEqual(sink.latest('dev', 'accel')['seq'].tolist(), [2, 3, 4])
+        self.assertIsNone(sink.latest('dev', 'gyro'))
+
+    def test_specs(self):
+        self.assertIsInstance(sink_from_spec('null'), NullSink)
+        self.assertIsInstance(sink_from_spec('stdout'), StdoutSink)
+        self.assertEqual(sink_from_spec('ring:10').capacity, 10)
+        self.assertIs(sink_from_spec('callback:os.path:join').callback, os.path.join)
+        for spec in ('file', 'callback:nomodule', 'kafka'):
+            with self.assertRaises(ValueError, msg=spec):
+                sink_from_spec(spec)
+        self.assertIsNone(pipeline_from_options([]))
+        self.assertEqual(pipeline_from_options(['null', 'ring'], sink_buffer=10).max_pending, 10)
+
+
+class SinkPipelineTest(unittest.TestCase):
+    def test_batches_are_merged_per_device_and_sensor(self):
+        sink = ListSink()
+
+        async def run():
+            pipeline = SinkPipeline([sink], flush_interval=60)
+            pipeline.submit('a', 'accel', records(2))
+            pipeline.submit('a', 'gyro', records(1))
+            pipeline.submit('a', 'accel', records(2, 2))
+            pipeline.submit('b', 'accel', records(1))
+            await pipeline.close()
+            return pipeline
+        pipeline = asyncio.run(run())
+        self.assertEqual(sink.batches, [('a', 'accel', [0, 1, 2, 3]), ('a', 'gyro', [0]), ('b', 'accel', [0])])
+        self.assertTrue(sink.closed)
+        self.assertEqual((pipeline.submitted, pipeline.written, pipeline.dropped), (6, 6, 0))
+
+    def test_oldest_batches_drop_past_the_bound(self):
+        sink = ListSink()
+
+        async def run():
+            pipeline = SinkPipeline([sink], max_pending=5, flush_records=100, flush_interval=60)
+            for start in range(0, 12, 3):
+                pipeline.submit('a', 'accel', records(3, start))
+            self.assertEqual(pipeline.pending, 3)
+            await pipeline.close()
+            return pipeline
+        pipeline = asyncio.run(run())
+        self.assertEqual(sink.batches, [('a', 'accel', [9, 10, 11])])
+        self.assertEqual((pipeline.dropped, pipeline.written), (9, 3))
+
+    def test_full_buffer_flushes_before_the_interval(self):
+        sink = ListSink()
+
+        async def run():
+            pipeline = SinkPipeline([sink], flush_records=4, flush_interval=60)
+            pipeline.submit('a', 'accel', records(4))
+            for _ in range(5):
+                await asyncio.sleep(0)
+            flushed = list(sink.batches)
+            await pipeline.close()
+            return flushed
+        self.assertEqual(asyncio.run(run()), [('a', 'accel', [0, 1, 2, 3])])
+
+    def test_a_failing_sink_does_not_stop_the_others(self):
+        sink = ListSink()
+        received = []
+
+        async def run():
+            pipeline = SinkPipeline([FailingSink(), CallbackSink(lambda *batch: received.append(batch[:2])), sink])
+            pipeline.submit('a', 'accel', records(1))
+            with self.assertLogs(level='ERROR'):
+                await pipeline.close()
+        asyncio.run(run())
+        self.assertEqual(received, [('a', 'accel')])
+        self.assertEqual(len(sink.batches), 1)
+
+    def test_metrics(self):
+        async def run():
+            pipeline = SinkPipeline([NullSink()], max_pending=2, flush_interval=60)
+            pipeline.submit('a', 'accel', records(2))
+            pipeline.submit('a', 'accel', records(1))
+            families = pipeline.collect()
+            await pipeline.close()
+            return families
+        samples, pending = asyncio.run(run())
+        self.assertIn('imu_sink_samples_total{outcome="dropped"} 2', samples.render())
+        self.assertIn('imu_sink_pending_samples 1', pending.render())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+import os
+import argparse
+import tempfile
+import unittest
+from helpers.channels import MAG, BARO
+from helpers.sources import (RecordingPort, ReplaySource, SerialSource, SyntheticSource, add_source_arguments,
+                             source_from_args, GRAVITY)
+
+
+class FakeSerial:
+    """Hands out fixed chunks, then nothing"""
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+        self.closed = False
+
+    @property
+    def in_waiting(self):
+        return len(self.chunks[0]) if self.chunks else 0
+
+    def read(self, size=1):
+        return self.chunks.pop(0) if self.chunks else b''
+
+    def readline(self):
+        return self.read()
+
+    def close(self):
+        self.closed = True
+
+
+def read_all(port):
+    lines = []
+    while True:
+        line = port.readline()
+        if not line:
+            return lines
+        lines.append(line)
+
+
+class SyntheticSourceTest(unittest.TestCase):
+    def test_generates_rate_times_duration_lines(self):
+        port = SyntheticSource(rate=20000, duration=0.02).open()
+        lines = read_all(port)
+        self.assertTrue(port.exhausted)
+        self.assertEqual(len(lines), 400)
+        values = [float(value) for value in lines[0].split(b',')]
+        self.assertEqual(len(values), 6)
+        self.assertAlmostEqual(values[2], GRAVITY, places=3)
+
+    def test_extra_channels_at_their_own_rate(self):
+        port = SyntheticSource(rate=1000, duration=0.2, waveform='constant', channels=(MAG, BARO)).open()
+        lines = read_all(port)
+        self.assertEqual(sum(line.startswith(b'MAG:') for line in lines), 20)
+        self.assertEqual(sum(line.startswith(b'BARO:') for line in lines), 5)
+        self.assertEqual(sum(b':' not in line for line in lines), 200)
+        baro = next(line for line in lines if line.startswith(b'BARO:'))
+        self.assertEqual(baro, b'BARO:1013.2500\n')
+
+    def test_square_wave_swings_by_the_amplitude(self):
+        port = SyntheticSource(rate=10000, duration=0.05, waveform='square', frequency=50, amplitude=2.0).open()
+        ax = {float(line.split(b',')[0]) for line in read_all(port)}
+        self.assertLessEqual(ax, {-2.0, 0.0, 2.0})
+        self.assertTrue({-2.0, 2.0} <= ax)
+
+    def test_rejects_unknown_waveform(self):
+        with self.assertRaises(ValueError):
+            SyntheticSource(waveform='triangle')
+
+
+class RecordReplayTest(unittest.TestCase):
+    def test_replay_returns_the_recorded_bytes(self):
+        chunks = [b'1.0,2.0,3.0,4.0,5.0,6.0\n', b'7.0,8.0,', b'9.0,1.0,2.0,3.0\n']
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'session.rec')
+            serial = FakeSerial(chunks)
+            recording = RecordingPort(serial, path)
+            while recording.in_waiting:
+                recording.read(recording.in_waiting)
+            recording.close()
+            self.assertTrue(serial.closed)
+
+            port = ReplaySource(path, speed=0).open()
+            self.assertEqual(port.read(1000), b''.join(chunks))
+            self.assertEqual(port.read(10), b'')
+            self.assertTrue(port.exhausted)
+            port.close()
+
+    def test_rejects_other_files(self):
+        with tempfile.NamedTemporaryFile() as f:
+            f.write(b'not a recording')
+            f.flush()
+            with self.assertRaises(ValueError):
+                ReplaySource(f.name).open()
+
+
+class ArgumentsTest(unittest.TestCase):
+    def parse(self, *argv):
+        parser = argparse.ArgumentParser()
+        add_source_arguments(parser)
+        return source_from_args(parser.parse_args(argv))
+
+    def test_sources_from_arguments(self):
+        source = self.parse('--source', 'synthetic', '--rate', '500', '--channels', 'mag')
+        self.assertIsInstance(source, SyntheticSource)
+        self.assertEqual((source.rate, source.channels), (500, (MAG,)))
+        self.assertIsInstance(self.parse(), SerialSource)
+        replay = self.parse('--source', 'replay', '--replay', 'x.rec', '--speed', '4')
+        self.assertEqual((replay.path, replay.speed), ('x.rec', 4))
+
+    def test_replay_needs_a_file(self):
+        with self.assertRaises(ValueError):
+            self.parse('--source', 'replay')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,146 @@
+import os
+import ssl
+import datetime
+import tempfile
+import unittest
+from aioquic.quic.configuration import QuicConfiguration
+from aioquic.quic.connection import QuicConnection
+from aioquic.quic.events import HandshakeCompleted, StreamDataReceived
+from aioquic.tls import SessionTicket, CipherSuite
+from helpers.tickets import SessionTicketCache, SessionTicketStore, resume_options, ticket_from_dict, ticket_to_dict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HOST = 'localhost'
+
+
+def make_ticket(label=b'ticket', server_name=HOST, lifetime=3600, max_early_data_size=0xFFFFFFFF):
+    now = datetime.datetime.now(datetime.timezone.utc)
+    return SessionTicket(
+        age_add=1, cipher_suite=CipherSuite.AES_128_GCM_SHA256, not_valid_after=now + datetime.timedelta(seconds=lifetime),
+        not_valid_before=now - datetime.timedelta(seconds=1), resumption_secret=b'\x01' * 32, server_name=server_name,
+        ticket=label, max_early_data_size=max_early_data_size, other_extensions=[(42, b'\x00')],
+    )
+
+
+def handshake(store, cache, early=b''):
+    """
+    Connect a client and server in memory. Returns the client's
+    HandshakeCompleted event and the stream data the server received in the
+    client's first flight.
+    """
+    server_configuration = QuicConfiguration(is_client=False)
+    server_configuration.load_cert_chain(os.path.join(ROOT, 'ssl_cert.pem'), os.path.join(ROOT, 'ssl_key.pem'))
+    configuration = QuicConfiguration(is_client=True)
+    configuration.verify_mode = ssl.CERT_NONE
+    options = resume_options(cache, configuration, HOST)
+    client = QuicConnection(configuration=configuration, session_ticket_handler=options['session_ticket_handler'])
+    server = QuicConnection(configuration=server_configuration, session_ticket_handler=store.add,
+                            session_ticket_fetcher=store.pop,
+                            original_destination_connection_id=client.original_destination_connection_id)
+    client.connect(('10.0.0.2', 4433), now=0.0)
+    if early:
+        client.send_stream_data(client.get_next_available_stream_id(), early)
+    first_flight = b''
+    completed = None
+    for step in range(5):
+        for data, _ in client.datagrams_to_send(0.0):
+            server.receive_datagram(data, ('10.0.0.1', 5000), 0.0)
+        event = server.next_event()
+        while event is not None:
+            if step == 0 and isinstance(event, StreamDataReceived):
+                first_flight += event.data
+            event = server.next_event()
+        for data, _ in server.datagrams_to_send(0.0):
+            client.receive_datagram(data, ('10.0.0.2', 4433), 0.0)
+        event = client.next_event()
+        while event is not None:
+            if isinstance(event, HandshakeCompleted):
+                completed = event
+            event = client.next_event()
+    return completed, first_flight, options
+
+
+class ResumptionTest(unittest.TestCase):
+    def test_reconnect_resumes_with_early_data(self):
+        store = SessionTicketStore()
+        cache = SessionTicketCache()
+        completed, _, options = handshake(store, cache)
+        self.assertFalse(completed.session_resumed)
+        # A full handshake leaves a ticket with the client and waits to be connected
+        self.assertTrue(options['wait_connected'])
+        self.assertIsNotNone(cache.load(HOST))
+        self.assertEqual(store.issued, 1)
+
+        completed, first_flight, options = handshake(store, cache, early=b'accel;dq1\n')
+        self.assertFalse(options['wait_connected'])
+        self.assertTrue(completed.session_resumed)
+        self.assertTrue(completed.early_data_accepted)
+        # The stream header reached the server before the handshake finished
+        self.assertEqual(first_flight, b'accel;dq1\n')
+        self.assertEqual(store.resumed, 1)
+
+    def test_no_cache_means_no_resumption(self):
+        self.assertEqual(resume_options(None, QuicConfiguration(is_client=True), HOST), {})
+
+
+class SessionTicketStoreTest(unittest.TestCase):
+    def test_each_ticket_resumes_once(self):
+        store = SessionTicketStore()
+        store.add(make_ticket(b'a'))
+        self.assertIsNotNone(store.pop(b'a'))
+        self.assertIsNone(store.pop(b'a'))
+        self.assertEqual((store.issued, store.resumed), (1, 1))
+
+    def test_bounded_and_expiring(self):
+        store = SessionTicketStore(max_tickets=2)
+        store.add(make_ticket(b'old', lifetime=-10))
+        store.add(make_ticket(b'a'))
+        store.add(make_ticket(b'b'))
+        store.add(make_ticket(b'c'))
+        self.assertEqual(list(store.tickets), [b'b', b'c'])
+        store.tickets[b'expired'] = make_ticket(b'expired', lifetime=-10)
+        self.assertIsNone(store.pop(b'expired'))
+        held, counts = store.collect()
+        self.assertIn('imu_tls_tickets 2', held.render())
+        self.assertIn('imu_tls_tickets_total{outcome="issued"} 4', counts.render())
+
+
+class SessionTicketCacheTest(unittest.TestCase):
+    def test_ticket_round_trips_through_json(self):
+        ticket = make_ticket()
+        self.assertEqual(ticket_from_dict(ticket_to_dict(ticket)), ticket)
+
+    def test_tickets_persist_across_runs(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'tickets.json')
+            cache = SessionTicketCache(path)
+            cache.store(make_ticket(b'a', server_name='one'))
+            cache.store(make_ticket(b'b', server_name='two', lifetime=-10))
+            self.assertEqual(os.stat(path).st_mode & 0o777, 0o600)
+            cache = SessionTicketCache(path)
+            self.assertEqual(cache.load('one').ticket, b'a')
+            # Expired tickets are not written out
+            self.assertNotIn('two', cache.tickets)
+
+    def test_unreadable_file_is_ignored(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.json') as f:
+            f.write('{not json')
+            f.flush()
+            with self.assertLogs(level='WARNING'):
+                cache = SessionTicketCache(f.name)
+        self.assertEqual(cache.tickets, {})
+
+    def test_prepare(self):
+        cache = SessionTicketCache()
+        configuration = QuicConfiguration(is_client=True)
+        self.assertFalse(cache.prepare(configuration, HOST))
+        self.assertEqual(configuration.server_name, HOST)
+        cache.store(make_ticket(max_early_data_size=None))
+        self.assertFalse(cache.prepare(configuration, HOST))
+        self.assertIsNotNone(configuration.session_ticket)
+        cache.store(make_ticket())
+        self.assertTrue(cache.prepare(configuration, HOST))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import unittest
+import numpy as np
+from helpers.codec import RECORD_DTYPE, SENSOR_ACCEL, SENSOR_GYRO
+from helpers.timeseries import RingSeries, SeriesStore
+
+
+def records(start, count):
+    """Records numbered start..start+count with timestamps equal to their seq"""
+    out = np.zeros(count, dtype=RECORD_DTYPE)
+    out['seq'] = np.arange(start, start + count)
+    out['ts'] = out['seq']
+    return out
+
+
+class RingSeriesTest(unittest.TestCase):
+    def test_latest_before_full(self):
+        series = RingSeries(capacity=8)
+        series.append(records(0, 3))
+        self.assertEqual(len(series), 3)
+        self.assertEqual(series.latest()['seq'].tolist(), [0, 1, 2])
+        self.assertEqual(series.latest(2)['seq'].tolist(), [1, 2])
+        self.assertEqual(series.latest(100)['seq'].tolist(), [0, 1, 2])
+
+    def test_wraparound_keeps_newest_contiguous(self):
+        series = RingSeries(capacity=8)
+        for start in range(0, 20, 3):
+            series.append(records(start, 3))
+        self.assertEqual((len(series), series.total), (8, 21))
+        self.assertEqual(series.latest()['seq'].tolist(), list(range(13, 21)))
+
+    def test_batch_larger_than_capacity(self):
+        series = RingSeries(capacity=4)
+        series.append(records(0, 2))
+        series.append(records(2, 10))
+        self.assertEqual(series.total, 12)
+        self.assertEqual(series.latest()['seq'].tolist(), [8, 9, 10, 11])
+
+    def test_windows_are_views(self):
+        series = RingSeries(capacity=8)
+        series.append(records(0, 12))
+        self.assertTrue(np.shares_memory(series.latest(), series._data))
+        self.assertTrue(np.shares_memory(series.time_range(5, 9), series._data))
+
+    def test_time_range_is_half_open(self):
+        series = RingSeries(capacity=8)
+        series.append(records(0, 12))
+        self.assertEqual(series.time_range(6, 9)['seq'].tolist(), [6, 7, 8])
+        self.assertEqual(series.time_range(0, 5)['seq'].tolist(), [4])
+        self.assertEqual(len(series.time_range(20, 30)), 0)
+
+    def test_empty_append_is_ignored(self):
+        series = RingSeries(capacity=4)
+        series.append(records(0, 0))
+        self.assertEqual((len(series), series.total, len(series.latest())), (0, 0, 0))
+
+
+class SeriesStoreTest(unittest.TestCase):
+    def test_one_series_per_sensor(self):
+        store = SeriesStore(capacity=4)
+        store.append(SENSOR_ACCEL, records(0, 3))
+        store.append(SENSOR_GYRO, records(0, 1))
+        self.assertIs(store.channel(SENSOR_ACCEL), store.channels[SENSOR_ACCEL])
+        self.assertEqual((len(store.channel(SENSOR_ACCEL)), len(store.channel(SENSOR_GYRO))), (3, 1))
+        # Memory per channel is fixed by the capacity, not by how much was appended
+        self.assertEqual(store.nbytes(), 2 * 2 * 4 * RECORD_DTYPE.itemsize)
+
+
+if __name__ == '__main__':
+    unittest.main()
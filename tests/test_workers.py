@@ -0,0 +1,33 @@
+import os
+import socket
+import asyncio
+import unittest
+from aioquic.quic.configuration import QuicConfiguration
+from quic_server import HttpServerProtocol, serve_reuseport
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@unittest.skipUnless(hasattr(socket, 'SO_REUSEPORT'), "SO_REUSEPORT is not available on this platform")
+class ReusePortTest(unittest.TestCase):
+    def test_servers_share_a_port(self):
+        configuration = QuicConfiguration(is_client=False)
+        configuration.load_cert_chain(os.path.join(ROOT, 'ssl_cert.pem'), os.path.join(ROOT, 'ssl_key.pem'))
+
+        async def run():
+            first = await serve_reuseport('127.0.0.1', 0, configuration, HttpServerProtocol)
+            port = first._transport.get_extra_info('sockname')[1]
+            try:
+                # Without SO_REUSEPORT on both sockets this bind fails with EADDRINUSE
+                second = await serve_reuseport('127.0.0.1', port, configuration, HttpServerProtocol)
+                sock = second._transport.get_extra_info('socket')
+                self.assertEqual(sock.getsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT), 1)
+                self.assertEqual(sock.getsockname()[1], port)
+                second.close()
+            finally:
+                first.close()
+        asyncio.run(run())
+
+
+if __name__ == '__main__':
+    unittest.main()